@@ -0,0 +1,296 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import graph_analytics
+import graph_format
+import layout_engine
+from project_analyzer import IMPORT_ENGINES, ProjectAnalyzer, compare_import_engines
+
+
+def generate_synthetic_project(path, modules=1000, depth=2, imports_per_module=5, relative_ratio=0.3,
+                               file_size=2000, modules_per_package=20, seed=0):
+    # Writes `modules` files into a package tree `depth` directories deep, each importing
+    # `imports_per_module` other modules, a `relative_ratio` share of them from its own package
+    rng = random.Random(seed)
+    package_count = max(1, math.ceil(modules / modules_per_package))
+    branching = max(2, math.ceil(package_count ** (1 / max(1, depth))))
+
+    package_dirs = []
+    for package_index in range(package_count):
+        parts = []
+        index = package_index
+        for level in range(max(1, depth)):
+            parts.append(f'{"pkg" if level == 0 else "sub"}{index % branching}')
+            index //= branching
+        package_dirs.append('/'.join(reversed(parts)))
+
+    module_paths = [(package_dirs[module_index // modules_per_package], f'mod{module_index}')
+                    for module_index in range(modules)]
+    package_members = {}
+    for module_index, (package_dir, module_name) in enumerate(module_paths):
+        package_members.setdefault(package_dir, []).append(module_index)
+
+    for package_dir in package_members:
+        parts = package_dir.split('/')
+        for level in range(len(parts)):
+            init_path = os.path.join(path, *parts[:level + 1], '__init__.py')
+            if not os.path.exists(init_path):
+                os.makedirs(os.path.dirname(init_path), exist_ok=True)
+                with open(init_path, 'w') as file:
+                    file.write('')
+
+    for module_index, (package_dir, module_name) in enumerate(module_paths):
+        lines = ['import os', 'from collections import OrderedDict']
+        siblings = package_members[package_dir]
+        for _ in range(imports_per_module):
+            if len(siblings) > 1 and rng.random() < relative_ratio:
+                target = rng.choice(siblings)
+                if target != module_index:
+                    lines.append(f'from .mod{target} import function_{target}')
+                    continue
+            target = rng.randrange(modules)
+            if target != module_index:
+                target_dir, target_name = module_paths[target]
+                lines.append(f'from {target_dir.replace("/", ".")}.{target_name} import function_{target}')
+        lines.append('')
+        lines.append('')
+        lines.append(f'def function_{module_index}():')
+        lines.append(f'    return {module_index}')
+
+        filler_index = 0
+        source = '\n'.join(lines) + '\n'
+        while len(source) < file_size:
+            source += f'\n\ndef filler_{filler_index}(value):\n    value = value * {filler_index} + 1\n' \
+                      f'    return OrderedDict(value=value, name="{module_name}")\n'
+            filler_index += 1
+        with open(os.path.join(path, package_dir, module_name + '.py'), 'w') as file:
+            file.write(source)
+
+
+def benchmark_analyzer(project_path, output_dir, jobs=1, engine='regex'):
+    python_import_map = ProjectAnalyzer(project_path, jobs=jobs, engine=engine)
+    result = dict(python_import_map.phase_times)
+    result['files'] = len(python_import_map.source_files)
+    result['files_per_second'] = python_import_map.files_per_second()
+    result['relation_count'] = len(python_import_map.relations)
+    # Every engine reads the same files again, serially, so their times compare directly
+    engine_times, differences = compare_import_engines(python_import_map.source_files)
+    result['import_engines'] = engine_times
+    result['import_engine_differences'] = len(differences)
+
+    relation_graph_path = os.path.join(output_dir, 'relations' + graph_format.EXTENSION)
+    for output_format, path in (('rtm', os.path.join(output_dir, 'relations.rtm')), ('rtmb', relation_graph_path)):
+        timer_start = time.perf_counter()
+        python_import_map.write_output(path, output_format)
+        result[f'write_{output_format}'] = time.perf_counter() - timer_start
+    return result, relation_graph_path
+
+
+def benchmark_visualizer(relation_path, frames=5, physics_ticks=2, physics_engine='numpy', collapse_spacing=None):
+    # Headless: SDL renders into memory, the window never reaches a display
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    # pygame greets on stdout, which would end up in the JSON report
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    import numpy.matlib
+    import pygame
+    from model_visualizer import ModelVisualizer
+
+    result = {}
+    model_visualizer = ModelVisualizer()
+    timer_start = time.perf_counter()
+    model_visualizer.analyze_model(relation_path)
+    result['analyze_model'] = time.perf_counter() - timer_start
+
+    model_visualizer.max_physics_time = physics_ticks
+    model_visualizer.physics_engine = physics_engine
+    if collapse_spacing is not None:
+        model_visualizer.cluster_collapse_spacing = collapse_spacing
+    timer_start = time.perf_counter()
+    model_visualizer.prepare_vertex_position()
+    result['prepare_vertex_position'] = time.perf_counter() - timer_start
+    result['physics_tick'] = result['prepare_vertex_position'] / max(1, physics_ticks)
+
+    model_visualizer.create_window()
+    model_visualizer.caculate_drawing_view(numpy.matlib.identity(4), 1)
+    phase_times = {}
+    timer_start = time.perf_counter()
+    for frame in range(frames):
+        model_visualizer.draw_frame(1, phase_times)
+    result['frame'] = (time.perf_counter() - timer_start) / max(1, frames)
+    result['frame_phases'] = {name: total / max(1, frames) for name, total in phase_times.items()}
+    result['collapsed_clusters'] = len(model_visualizer.level_of_detail['clusters'])
+    result['shown_modules'] = int(model_visualizer.level_of_detail['shown'].sum())
+    result['text_surfaces'] = model_visualizer.text_surfaces.stats()
+
+    rng = random.Random(0)
+    points = [(rng.randrange(model_visualizer.window_w - model_visualizer.menu_panel_width),
+               rng.randrange(model_visualizer.window_h)) for _ in range(1000)]
+    timer_start = time.perf_counter()
+    model_visualizer.pick_vertex(points[0])
+    result['picking_grid'] = time.perf_counter() - timer_start
+    timer_start = time.perf_counter()
+    for point in points:
+        model_visualizer.pick_vertex(point)
+    result['pick_vertex'] = (time.perf_counter() - timer_start) / len(points)
+    pygame.quit()
+    return result
+
+
+def benchmark_layout(relation_graph_path, ticks=3, theta=layout_engine.BARNES_HUT_THETA,
+                     all_pairs_max_modules=5000, force_error_modules=2000, seed=0):
+    # Layout ticks alone on the analyzed graph, from random positions on the sphere like analyze_model
+    import numpy
+
+    with graph_format.GraphFile(relation_graph_path) as graph_file:
+        group_ids = {}
+        groups = [group_ids.setdefault(graph_file.node(node_id)['top_dir'], len(group_ids))
+                  for node_id in range(graph_file.node_count)]
+        edges = [(node_id, other_id) for node_id in range(graph_file.node_count)
+                 for other_id in graph_file.imports(node_id)]
+    externals = [group == group_ids.get('__external__') for group in groups]
+    positions = numpy.random.RandomState(seed).normal(size=(len(groups), 3))
+    positions /= numpy.linalg.norm(positions, axis=1)[:, None]
+    velocities = numpy.zeros_like(positions)
+
+    result = {'vertexes': len(groups), 'theta': theta}
+    # Relative RMS error of the octree forces against every pair, on the first modules from the same start
+    sample = min(len(groups), force_error_modules)
+    if sample:
+        exact_forces = layout_engine.ForceLayout(positions[:sample], velocities[:sample], groups[:sample],
+                                                 externals[:sample]).pair_forces(0.25)
+        sample_edges = [(node_id, other_id) for node_id, other_id in edges if node_id < sample and other_id < sample]
+        approximate_forces = layout_engine.BarnesHutLayout(positions[:sample], velocities[:sample], groups[:sample],
+                                                           externals[:sample], sample_edges, theta).pair_forces(0.25)
+        result['barnes-hut_force_error'] = float(numpy.linalg.norm(approximate_forces - exact_forces) /
+                                                 max(numpy.linalg.norm(exact_forces), 1e-12))
+        result['force_error_modules'] = sample
+    layouts = {'barnes-hut': layout_engine.BarnesHutLayout(positions, velocities, groups, externals, edges, theta)}
+    if len(groups) <= all_pairs_max_modules:
+        layouts['numpy'] = layout_engine.ForceLayout(positions, velocities, groups, externals)
+    for name, layout in layouts.items():
+        timer_start = time.perf_counter()
+        for tick in range(ticks):
+            layout.tick(0.25, 1 / (1 + tick / 4))
+        result[name] = (time.perf_counter() - timer_start) / max(1, ticks)
+    # Flat across sizes when a tick scales as N log N
+    result['barnes-hut_per_n_log_n'] = result['barnes-hut'] / max(1, len(groups) * math.log2(max(2, len(groups))))
+    return result
+
+
+def benchmark_analytics(relation_graph_path, queries=100, seed=0):
+    # Building the components and layers once, then single module queries against the built graph
+    import numpy
+
+    import_graph = graph_analytics.read_import_graph(relation_graph_path)
+    result = import_graph.summary()
+    result['build'] = dict(import_graph.phase_times)
+
+    rng = random.Random(seed)
+    node_ids = [rng.randrange(import_graph.node_count) for _ in range(queries)]
+    for name, query in (('transitive_imports', import_graph.transitive_imports),
+                        ('transitive_importers', import_graph.transitive_importers),
+                        ('impact', import_graph.impact)):
+        sizes = []
+        timer_start = time.perf_counter()
+        for node_id in node_ids:
+            sizes.append(len(query([node_id])))
+        result[name] = (time.perf_counter() - timer_start) / max(1, queries)
+        result[f'{name}_mean_size'] = float(numpy.mean(sizes)) if sizes else 0.0
+    timer_start = time.perf_counter()
+    cyclic_components = import_graph.cyclic_components()
+    if len(cyclic_components):
+        import_graph.shortest_cycle(import_graph.component_members(cyclic_components[0])[0])
+    result['largest_cycle'] = time.perf_counter() - timer_start
+    return result
+
+
+def run_benchmarks(module_counts, work_dir, args):
+    results = []
+    for modules in module_counts:
+        print(f'[Benchmark] {modules} modules', file=sys.stderr)
+        project_path = os.path.join(work_dir, f'project_{modules}')
+        output_dir = os.path.join(work_dir, f'output_{modules}')
+        os.makedirs(output_dir, exist_ok=True)
+
+        result = {'modules': modules}
+        timer_start = time.perf_counter()
+        generate_synthetic_project(project_path, modules, args.depth, args.imports, args.relative_ratio,
+                                   args.file_size, seed=args.seed)
+        result['generate'] = time.perf_counter() - timer_start
+
+        result['analyzer'], relation_graph_path = benchmark_analyzer(project_path + '/', output_dir, args.jobs,
+                                                                     args.engine)
+        if args.skip_layout:
+            result['layout'] = None
+        else:
+            result['layout'] = benchmark_layout(relation_graph_path, args.layout_ticks, args.theta,
+                                                args.all_pairs_max_modules, args.force_error_modules, args.seed)
+        if args.skip_analytics:
+            result['analytics'] = None
+        else:
+            result['analytics'] = benchmark_analytics(relation_graph_path, args.analytics_queries, args.seed)
+        if args.skip_visualizer or modules > args.visualizer_max_modules:
+            result['visualizer'] = None
+        else:
+            result['visualizer'] = benchmark_visualizer(relation_graph_path, args.frames, args.physics_ticks,
+                                                        args.physics, args.collapse_spacing)
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage=f'python {sys.argv[0]} [--modules 1000 10000 100000] [--output FILE]')
+    parser.add_argument('--modules', type=int, nargs='+', default=[1000], help='project sizes to benchmark')
+    parser.add_argument('--depth', type=int, default=2, help='package depth of the synthetic projects')
+    parser.add_argument('--imports', type=int, default=5, help='imports per module')
+    parser.add_argument('--relative-ratio', type=float, default=0.3, help='share of relative imports')
+    parser.add_argument('--file-size', type=int, default=2000, help='minimum size of every module in bytes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='analyzer worker processes')
+    parser.add_argument('--engine', choices=IMPORT_ENGINES, default='regex', help='import extraction engine')
+    parser.add_argument('--frames', type=int, default=5, help='frames drawn per visualizer benchmark')
+    parser.add_argument('--physics-ticks', type=int, default=2, help='layout ticks per visualizer benchmark')
+    parser.add_argument('--physics', choices=layout_engine.PHYSICS_ENGINES, default='numpy',
+                        help='visualizer layout engine')
+    parser.add_argument('--collapse-spacing', type=float,
+                        help='visualizer package collapse spacing in pixels, 0 draws every module')
+    parser.add_argument('--layout-ticks', type=int, default=3, help='ticks per layout engine benchmark')
+    parser.add_argument('--theta', type=float, default=layout_engine.BARNES_HUT_THETA,
+                        help='Barnes-Hut opening angle of the layout benchmark')
+    parser.add_argument('--all-pairs-max-modules', type=int, default=5000,
+                        help='skip the all pairs layout for larger projects')
+    parser.add_argument('--force-error-modules', type=int, default=2000,
+                        help='modules compared against the all pairs forces for the Barnes-Hut force error, 0 skips')
+    parser.add_argument('--skip-layout', action='store_true')
+    parser.add_argument('--analytics-queries', type=int, default=100,
+                        help='transitive and impact queries per analytics benchmark')
+    parser.add_argument('--skip-analytics', action='store_true')
+    parser.add_argument('--visualizer-max-modules', type=int, default=2000,
+                        help='skip the visualizer for larger projects')
+    parser.add_argument('--skip-visualizer', action='store_true')
+    parser.add_argument('--work-dir', help='keep the generated projects and outputs in this directory')
+    parser.add_argument('-o', '--output', help='write the JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'work_dir')}}
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        report['results'] = run_benchmarks(args.modules, args.work_dir, args)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            report['results'] = run_benchmarks(args.modules, work_dir, args)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,351 @@
+import argparse
+import sys
+import time
+
+import numpy
+
+import graph_format
+
+EXTERNAL_PREFIX = 'external://'
+
+
+def csr_from_imports(imports):
+    # (offsets, targets) of the dense node ids every node imports
+    counts = numpy.fromiter((len(targets) for targets in imports), dtype=numpy.int64, count=len(imports))
+    offsets = numpy.zeros(len(imports) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+    targets = numpy.fromiter((target for node_targets in imports for target in sorted(node_targets)),
+                             dtype=numpy.int64, count=int(offsets[-1]))
+    return offsets, targets
+
+
+def reverse_csr(offsets, targets, node_count):
+    # The same edges turned around; sources of every target come out in ascending order
+    sources = numpy.repeat(numpy.arange(node_count, dtype=numpy.int64), numpy.diff(offsets))
+    order = numpy.argsort(targets, kind='stable')
+    reverse_offsets = numpy.zeros(node_count + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(targets, minlength=node_count), out=reverse_offsets[1:])
+    return reverse_offsets, sources[order]
+
+
+def neighbours_of(offsets, targets, nodes):
+    # Every target of the given nodes in one gather, without a Python loop over the nodes
+    starts = offsets[nodes]
+    counts = offsets[nodes + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return targets[:0]
+    edge_indexes = numpy.repeat(starts - numpy.cumsum(counts) + counts, counts) + numpy.arange(total)
+    return targets[edge_indexes]
+
+
+def reachable_mask(offsets, targets, node_count, sources):
+    # Breadth first over a CSR graph, one vectorized gather per level; the mask includes the sources
+    reached = numpy.zeros(node_count, dtype=bool)
+    frontier = numpy.unique(numpy.asarray(sources, dtype=numpy.int64))
+    reached[frontier] = True
+    while len(frontier):
+        neighbours = neighbours_of(offsets, targets, frontier)
+        frontier = numpy.unique(neighbours[~reached[neighbours]])
+        reached[frontier] = True
+    return reached
+
+
+def strongly_connected_components(offsets, targets):
+    # Iterative Tarjan. A component is closed only after every component it imports, so component ids are a
+    # topological order of the condensation with dependencies first.
+    node_count = len(offsets) - 1
+    offsets = offsets.tolist()
+    targets = targets.tolist()
+    index = [-1] * node_count
+    low = [0] * node_count
+    on_stack = [False] * node_count
+    components = [-1] * node_count
+    edge_cursors = offsets[:-1]
+    stack = []
+    next_index = 0
+    component_count = 0
+
+    for root in range(node_count):
+        if index[root] >= 0:
+            continue
+        index[root] = low[root] = next_index
+        next_index += 1
+        stack.append(root)
+        on_stack[root] = True
+        call_stack = [root]
+        while call_stack:
+            node = call_stack[-1]
+            cursor = edge_cursors[node]
+            end = offsets[node + 1]
+            descended = False
+            while cursor < end:
+                other = targets[cursor]
+                cursor += 1
+                if index[other] < 0:
+                    edge_cursors[node] = cursor
+                    index[other] = low[other] = next_index
+                    next_index += 1
+                    stack.append(other)
+                    on_stack[other] = True
+                    call_stack.append(other)
+                    descended = True
+                    break
+                if on_stack[other] and index[other] < low[node]:
+                    low[node] = index[other]
+            if descended:
+                continue
+
+            call_stack.pop()
+            if call_stack and low[node] < low[call_stack[-1]]:
+                low[call_stack[-1]] = low[node]
+            if low[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    components[member] = component_count
+                    if member == node:
+                        break
+                component_count += 1
+    return numpy.array(components, dtype=numpy.int64), component_count
+
+
+class ImportGraph:
+    # Modules are dense integer ids and edges are CSR arrays, forward (imports) and reverse (importers). The
+    # strongly connected components condense the graph into a DAG, and transitive queries walk that smaller DAG
+    # with boolean masks before expanding the reached components back to their modules.
+    def __init__(self, abs_paths, mod_paths, offsets, targets):
+        timer_start = time.perf_counter()
+        self.phase_times = {}
+        self.abs_paths = list(abs_paths)
+        self.mod_paths = list(mod_paths)
+        self.node_count = len(self.abs_paths)
+        self.offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        self.targets = numpy.asarray(targets, dtype=numpy.int64)
+        self.reverse_offsets, self.reverse_targets = reverse_csr(self.offsets, self.targets, self.node_count)
+        self.node_ids = {}
+        for node_id, abs_path in enumerate(self.abs_paths):
+            self.node_ids.setdefault(abs_path, node_id)
+        for node_id, mod_path in enumerate(self.mod_paths):
+            # 'pkg.mod', 'pkg' for pkg/__init__.py and 'os' for external://os are accepted as well
+            self.node_ids.setdefault(mod_path, node_id)
+            if mod_path.endswith('.__init__'):
+                self.node_ids.setdefault(mod_path[:-len('.__init__')], node_id)
+            if mod_path.startswith(EXTERNAL_PREFIX):
+                self.node_ids.setdefault(mod_path[len(EXTERNAL_PREFIX):], node_id)
+        self.phase_times['index'] = time.perf_counter() - timer_start
+
+        timer_start = time.perf_counter()
+        self.components, self.component_count = strongly_connected_components(self.offsets, self.targets)
+        self.component_sizes = numpy.bincount(self.components, minlength=self.component_count)
+        sources = numpy.repeat(numpy.arange(self.node_count, dtype=numpy.int64), numpy.diff(self.offsets))
+        self.has_self_import = numpy.zeros(self.node_count, dtype=bool)
+        self.has_self_import[sources[sources == self.targets]] = True
+        self.phase_times['components'] = time.perf_counter() - timer_start
+
+        timer_start = time.perf_counter()
+        source_components = self.components[sources]
+        target_components = self.components[self.targets]
+        between = source_components != target_components
+        pairs = numpy.unique(source_components[between] * self.component_count + target_components[between])
+        component_sources = pairs // self.component_count
+        component_targets = pairs % self.component_count
+        self.component_offsets = numpy.zeros(self.component_count + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(component_sources, minlength=self.component_count),
+                     out=self.component_offsets[1:])
+        self.component_targets = component_targets
+        self.reverse_component_offsets, self.reverse_component_targets = reverse_csr(
+            self.component_offsets, self.component_targets, self.component_count)
+        self.phase_times['condensation'] = time.perf_counter() - timer_start
+
+        timer_start = time.perf_counter()
+        # Pairs are sorted by source component, and every target component has a smaller id, so its layer is
+        # final by the time its importers are visited
+        component_layers = [0] * self.component_count
+        for source, target in zip(component_sources.tolist(), component_targets.tolist()):
+            if component_layers[target] >= component_layers[source]:
+                component_layers[source] = component_layers[target] + 1
+        self.component_layers = numpy.array(component_layers, dtype=numpy.int64)
+        self.layers = self.component_layers[self.components]
+        self.phase_times['layers'] = time.perf_counter() - timer_start
+
+    def node_id(self, name):
+        node_id = self.node_ids.get(name)
+        if node_id is None:
+            raise KeyError(f'{name} is not a module of the graph')
+        return node_id
+
+    def node_ids_of(self, names):
+        return numpy.array([self.node_id(name) if isinstance(name, str) else int(name) for name in names],
+                           dtype=numpy.int64)
+
+    def is_external(self, node_id):
+        return self.abs_paths[node_id].startswith(EXTERNAL_PREFIX)
+
+    def direct_imports(self, node_id):
+        return self.targets[self.offsets[node_id]:self.offsets[node_id + 1]]
+
+    def direct_importers(self, node_id):
+        return self.reverse_targets[self.reverse_offsets[node_id]:self.reverse_offsets[node_id + 1]]
+
+    def cyclic_components(self):
+        # Components with an import cycle, largest first: several modules, or one module importing itself
+        cyclic = self.component_sizes > 1
+        cyclic[self.components[self.has_self_import]] = True
+        component_ids = numpy.flatnonzero(cyclic)
+        return component_ids[numpy.argsort(-self.component_sizes[component_ids], kind='stable')]
+
+    def component_members(self, component_id):
+        return numpy.flatnonzero(self.components == component_id)
+
+    def shortest_cycle(self, node_id):
+        # Shortest import path from the module back to itself, through its own component only
+        component_id = self.components[node_id]
+        parents = {}
+        frontier = [node_id]
+        while frontier:
+            next_frontier = []
+            for node in frontier:
+                for other in self.direct_imports(node).tolist():
+                    if self.components[other] != component_id:
+                        continue
+                    if other == node_id:
+                        path = [node]
+                        while path[-1] != node_id:
+                            path.append(parents[path[-1]])
+                        return path[::-1] + [node_id]
+                    if other not in parents:
+                        parents[other] = node
+                        next_frontier.append(other)
+            frontier = next_frontier
+        return []
+
+    def layer_members(self):
+        # Module ids of every layer; layer 0 imports nothing inside the graph, and a module imports only from
+        # lower layers or from its own cycle
+        order = numpy.argsort(self.layers, kind='stable')
+        bounds = numpy.cumsum(numpy.bincount(self.layers))
+        return numpy.split(order, bounds[:-1])
+
+    def expand_components(self, component_mask):
+        return numpy.flatnonzero(component_mask[self.components])
+
+    def transitive_imports(self, names):
+        # Every module the given modules depend on directly or indirectly, themselves included
+        component_mask = reachable_mask(self.component_offsets, self.component_targets, self.component_count,
+                                        self.components[self.node_ids_of(names)])
+        return self.expand_components(component_mask)
+
+    def transitive_importers(self, names):
+        # Every module depending on the given modules directly or indirectly, themselves included
+        component_mask = reachable_mask(self.reverse_component_offsets, self.reverse_component_targets,
+                                        self.component_count, self.components[self.node_ids_of(names)])
+        return self.expand_components(component_mask)
+
+    def impact(self, names):
+        # Modules affected by changing the given ones, in layer order so dependencies come before their importers
+        node_ids = self.transitive_importers(names)
+        return node_ids[numpy.argsort(self.layers[node_ids], kind='stable')]
+
+    def summary(self):
+        cyclic_components = self.cyclic_components()
+        return {'modules': self.node_count,
+                'relations': len(self.targets),
+                'components': self.component_count,
+                'cyclic_components': len(cyclic_components),
+                'modules_in_cycles': int(self.component_sizes[cyclic_components].sum()),
+                'largest_component': int(self.component_sizes.max()) if self.component_count else 0,
+                'layers': int(self.layers.max()) + 1 if self.node_count else 0}
+
+
+def read_import_graph(path):
+    timer_start = time.perf_counter()
+    if graph_format.is_graph_file(path):
+        with graph_format.GraphFile(path) as graph_file:
+            nodes = [graph_file.node(node_id) for node_id in range(graph_file.node_count)]
+            offsets = numpy.array(graph_file.edge_offsets, dtype=numpy.int64)
+            targets = numpy.array(graph_file.edge_targets, dtype=numpy.int64)
+    else:
+        nodes, imports = graph_format.graph_from_relation_map(graph_format.read_any_relation_map(path))
+        offsets, targets = csr_from_imports(imports)
+    load_time = time.perf_counter() - timer_start
+    import_graph = ImportGraph([node['abs_path'] for node in nodes], [node['mod_path'] for node in nodes],
+                               offsets, targets)
+    import_graph.phase_times = dict(load=load_time, **import_graph.phase_times)
+    return import_graph
+
+
+def import_graph_from_analyzer(project_analyzer):
+    # Dense ids follow abs_path order like ProjectAnalyzer.write_relation_graph
+    modules = project_analyzer.modules
+    module_ids = sorted(modules, key=lambda module_id: modules[module_id].abs_path)
+    node_ids = {module_id: node_id for node_id, module_id in enumerate(module_ids)}
+    offsets, targets = csr_from_imports([[node_ids[to_id] for to_id in project_analyzer.importees(module_id)]
+                                         for module_id in module_ids])
+    return ImportGraph([modules[module_id].abs_path for module_id in module_ids],
+                       [modules[module_id].mod_path for module_id in module_ids], offsets, targets)
+
+
+def print_modules(import_graph, node_ids, internal_only=False):
+    count = 0
+    for node_id in node_ids.tolist():
+        if internal_only and import_graph.is_external(node_id):
+            continue
+        print(f'{import_graph.layers[node_id]:>4} {import_graph.abs_paths[node_id]}')
+        count += 1
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage=f'python {sys.argv[0]} [INPUT_FILE] {{summary,cycles,layers,imports,'
+                                           f'importers,impact}} ...')
+    parser.add_argument('input_file')
+    parser.add_argument('--internal-only', action='store_true', help='leave external modules out of the lists')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('summary', help='module, relation, cycle and layer counts')
+    cycles_parser = commands.add_parser('cycles', help='import cycles, largest first, with one shortest cycle each')
+    cycles_parser.add_argument('--limit', type=int, default=20, help='cycles listed, 0 lists all')
+    commands.add_parser('layers', help='modules by layer, every module imports only from lower layers or its cycle')
+    for command, help_text in (('imports', 'modules the given modules depend on directly or indirectly'),
+                               ('importers', 'modules depending on the given modules directly or indirectly'),
+                               ('impact', 'modules affected by changing the given modules, in layer order')):
+        query_parser = commands.add_parser(command, help=help_text)
+        query_parser.add_argument('modules', nargs='+', help='abs_path, mod_path, package or external name')
+    args = parser.parse_args()
+
+    import_graph = read_import_graph(args.input_file)
+    print(f'[Analytics] {import_graph.node_count} modules, {len(import_graph.targets)} relations in '
+          + ', '.join(f'{name} {elapsed * 1000:.1f}ms' for name, elapsed in import_graph.phase_times.items()))
+
+    timer_start = time.perf_counter()
+    if args.command == 'summary':
+        for name, value in import_graph.summary().items():
+            print(f'{name}: {value}')
+    elif args.command == 'cycles':
+        cyclic_components = import_graph.cyclic_components()
+        for component_id in cyclic_components[:args.limit or None].tolist():
+            members = import_graph.component_members(component_id)
+            cycle = import_graph.shortest_cycle(members[0])
+            print(f'[Cycle] {len(members)} modules, e.g. '
+                  + ' -> '.join(import_graph.abs_paths[node_id] for node_id in cycle))
+            for node_id in members.tolist():
+                print(f'  {import_graph.abs_paths[node_id]}')
+        print(f'{len(cyclic_components)} cycles')
+    elif args.command == 'layers':
+        for layer, node_ids in enumerate(import_graph.layer_members()):
+            print(f'[Layer {layer}] {len(node_ids)} modules')
+            for node_id in node_ids.tolist():
+                if not (args.internal_only and import_graph.is_external(node_id)):
+                    print(f'  {import_graph.abs_paths[node_id]}')
+    else:
+        try:
+            if args.command == 'imports':
+                node_ids = import_graph.transitive_imports(args.modules)
+            elif args.command == 'importers':
+                node_ids = import_graph.transitive_importers(args.modules)
+            else:
+                node_ids = import_graph.impact(args.modules)
+        except KeyError as error:
+            parser.error(error.args[0])
+        print(f'{print_modules(import_graph, node_ids, args.internal_only)} modules')
+    print(f'[Analytics] {args.command} in {(time.perf_counter() - timer_start) * 1000:.1f}ms')
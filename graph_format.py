@@ -0,0 +1,231 @@
+import ast
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+# File layout (little endian, every section 4 byte aligned):
+#   header         MAGIC, version, node_count, edge_count, string_count, string_blob_size
+#   string_offsets u32[string_count + 1]   offsets into the string blob
+#   node_table     u32[node_count * len(NODE_FIELDS)]   string ids of every node field
+#   edge_offsets   u32[node_count + 1]   CSR row offsets
+#   edge_targets   u32[edge_count]   CSR column indexes (dense node ids)
+#   string_blob    utf-8 bytes of the interned strings
+MAGIC = b'RTMB'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIII')
+NODE_FIELDS = ('key', 'top_dir', 'mod_name', 'mod_path', 'abs_path')
+EXTENSION = '.rtmb'
+
+# Streaming relation records, one JSON object per line: a header, module records as soon as each module is
+# parsed, then import records ({'type': 'import', 'from': id, 'to': id}) once every module name is known
+JSONL_FORMAT = 'rtm-jsonl'
+JSONL_VERSION = 1
+JSONL_EXTENSION = '.jsonl'
+
+# Relation deltas pushed from project_watcher.py to a listening model_visualizer.py, one JSON object per line.
+# Modules are identified by abs_path: {'type': 'module', ...fields}, {'type': 'remove', 'abs_path'} and
+# {'type': 'imports', 'abs_path', 'imports': [abs_path, ...]}. A full state is framed by 'snapshot_begin'
+# and 'snapshot_end' records, and modules missing from it are dropped by the receiver.
+DELTA_PORT = 48621
+
+
+def write_graph(path, nodes, imports):
+    strings = {}
+    string_blob = bytearray()
+    string_offsets = array('I', [0])
+
+    def intern(text):
+        if text not in strings:
+            strings[text] = len(strings)
+            string_blob.extend(text.encode('utf-8'))
+            string_offsets.append(len(string_blob))
+        return strings[text]
+
+    node_table = array('I', (intern(node[field]) for node in nodes for field in NODE_FIELDS))
+    edge_offsets = array('I', [0])
+    edge_targets = array('I')
+    for targets in imports:
+        edge_targets.extend(sorted(targets))
+        edge_offsets.append(len(edge_targets))
+    if sys.byteorder == 'big':
+        for values in (string_offsets, node_table, edge_offsets, edge_targets):
+            values.byteswap()
+
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(nodes), len(edge_targets), len(strings), len(string_blob)))
+        file.write(string_offsets.tobytes())
+        file.write(node_table.tobytes())
+        file.write(edge_offsets.tobytes())
+        file.write(edge_targets.tobytes())
+        file.write(string_blob)
+
+
+def write_jsonl(path, nodes, imports):
+    # The records StreamingProjectAnalyzer streams, written at once; node ids are the positions in nodes
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(json.dumps({'type': 'header', 'format': JSONL_FORMAT, 'version': JSONL_VERSION}) + '\n')
+        for node_id, node in enumerate(nodes):
+            record = {'type': 'module', 'id': node_id}
+            record.update((field, node[field]) for field in NODE_FIELDS if field != 'key')
+            file.write(json.dumps(record) + '\n')
+        for node_id, targets in enumerate(imports):
+            for target in sorted(targets):
+                file.write(json.dumps({'type': 'import', 'from': node_id, 'to': target}) + '\n')
+
+
+class GraphFile:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.node_count, self.edge_count, string_count, string_blob_size = \
+            HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a relation graph file')
+        if version != VERSION:
+            raise ValueError(f'{path} has unsupported relation graph version {version}')
+
+        view = memoryview(self.buffer)
+        offset = HEADER.size
+        sections = []
+        for length in (string_count + 1, self.node_count * len(NODE_FIELDS), self.node_count + 1, self.edge_count):
+            sections.append(self.uint32_view(view[offset:offset + length * 4]))
+            offset += length * 4
+        self.string_offsets, self.node_table, self.edge_offsets, self.edge_targets = sections
+        self.string_blob = view[offset:offset + string_blob_size]
+        self.strings = [None] * string_count
+
+    @staticmethod
+    def uint32_view(view):
+        if sys.byteorder == 'big':
+            values = array('I', view.tobytes())
+            values.byteswap()
+            return values
+        return view.cast('I')
+
+    def string(self, string_id):
+        # Strings are decoded on first use and shared by every node that references them
+        text = self.strings[string_id]
+        if text is None:
+            text = str(self.string_blob[self.string_offsets[string_id]:self.string_offsets[string_id + 1]], 'utf-8')
+            self.strings[string_id] = text
+        return text
+
+    def node(self, node_id):
+        base = node_id * len(NODE_FIELDS)
+        return {field: self.string(self.node_table[base + k]) for k, field in enumerate(NODE_FIELDS)}
+
+    def key(self, node_id):
+        return self.string(self.node_table[node_id * len(NODE_FIELDS)])
+
+    def imports(self, node_id):
+        return self.edge_targets[self.edge_offsets[node_id]:self.edge_offsets[node_id + 1]]
+
+    def close(self):
+        for values in (self.string_offsets, self.node_table, self.edge_offsets, self.edge_targets, self.string_blob):
+            if isinstance(values, memoryview):
+                values.release()
+        self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def is_graph_file(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def read_relation_map(path):
+    # The legacy .rtm file is the str() of a dict of dicts and sets; literal_eval never runs code
+    with open(path, 'r') as file:
+        return ast.literal_eval(file.read())
+
+
+def read_jsonl_records(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            record = json.loads(line)
+            if record['type'] == 'header':
+                if record['format'] != JSONL_FORMAT or record['version'] != JSONL_VERSION:
+                    raise ValueError(f'{path} has unsupported relation records {record["format"]} '
+                                     f'version {record["version"]}')
+            else:
+                yield record
+
+
+def relation_map_from_jsonl(path):
+    # Records refer to modules by their ids; the relation map is keyed by abs_path like the analyzer's
+    relation_map = {}
+    keys = {}
+    for record in read_jsonl_records(path):
+        if record['type'] == 'module':
+            keys[record['id']] = record['abs_path']
+            relation_map[record['abs_path']] = {field: record[field] for field in NODE_FIELDS if field != 'key'}
+            relation_map[record['abs_path']]['imports'] = set()
+        elif record['type'] == 'import':
+            relation_map[keys[record['from']]]['imports'].add(keys[record['to']])
+    return relation_map
+
+
+def read_any_relation_map(path):
+    if is_graph_file(path):
+        with GraphFile(path) as graph_file:
+            return relation_map_from_graph(graph_file)
+    if path.endswith(JSONL_EXTENSION):
+        return relation_map_from_jsonl(path)
+    return read_relation_map(path)
+
+
+def write_relation_map(path, relation_map):
+    with open(path, 'w') as file:
+        file.write(str(relation_map))
+
+
+def graph_from_relation_map(relation_map):
+    keys = list(relation_map)
+    node_ids = {key: node_id for node_id, key in enumerate(keys)}
+    nodes = []
+    imports = []
+    for key in keys:
+        relation = relation_map[key]
+        node = {field: relation[field] for field in NODE_FIELDS if field != 'key'}
+        node['key'] = key
+        nodes.append(node)
+        imports.append([node_ids[other_key] for other_key in relation['imports']])
+    return nodes, imports
+
+
+def relation_map_from_graph(graph_file):
+    relation_map = {}
+    for node_id in range(graph_file.node_count):
+        relation = graph_file.node(node_id)
+        key = relation.pop('key')
+        relation['imports'] = set(graph_file.key(other_id) for other_id in graph_file.imports(node_id))
+        relation_map[key] = relation
+    return relation_map
+
+
+def convert(source_path, target_path):
+    relation_map = read_any_relation_map(source_path)
+    if target_path.endswith(EXTENSION):
+        write_graph(target_path, *graph_from_relation_map(relation_map))
+    elif target_path.endswith(JSONL_EXTENSION):
+        write_jsonl(target_path, *graph_from_relation_map(relation_map))
+    else:
+        write_relation_map(target_path, relation_map)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) <= 2:
+        print('Number of arguments is wrong.')
+        print(f'python {sys.argv[0]} [INPUT_FILE_NAME] [OUTPUT_FILE_NAME]')
+        print(f'Converts between .rtm, {EXTENSION} and {JSONL_EXTENSION} relation files '
+              '(the output format follows its extension)')
+    else:
+        convert(sys.argv[1], sys.argv[2])
@@ -0,0 +1,398 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy
+
+PHYSICS_ENGINES = ('numpy', 'barnes-hut', 'python')
+
+# Pair rules of ModelVisualizer.working_between_relations. Every ordered pair (A, B) pushes A along A->B by
+# dt * factor and B the opposite way, and both orders are visited, so one unordered pair moves each side twice.
+SAME_GROUP_ATTRACT_DISTANCE = 0.6
+# The pair rules multiply the same group attraction by 0.0; the layouts take both attraction constants as parameters
+SAME_GROUP_ATTRACT = 0.0
+SAME_GROUP_REPEL_DISTANCE = 0.2
+SAME_GROUP_REPEL = 1.9
+OTHER_GROUP_DISTANCE = 0.4
+OTHER_GROUP_REPEL = 0.1
+EXTERNAL_REPEL = 0.3
+# Import edges do not attract in the pair rules; a non-zero spring constant pulls an importer and its import together
+EDGE_ATTRACT = 0.0
+
+BARNES_HUT_THETA = 0.5
+BARNES_HUT_LEAF_SIZE = 8
+BARNES_HUT_DEPTH = 10
+BARNES_HUT_CELL_SAMPLES = 8
+
+# Background layout: ticks use the fixed timestep of prepare_vertex_position and stop once the mean movement of a
+# vertex in one tick drops below the threshold. Velocities are never damped, so movement rather than kinetic
+# energy tells when the layout has settled.
+LAYOUT_TIMESTEP = 0.25
+LAYOUT_MOVEMENT_THRESHOLD = 1e-3
+LAYOUT_MAX_TICKS = 1000
+
+LAYOUT_CACHE_ENTRIES = 8
+
+
+def same_group_attract_factors(distances, external_pairs, group_attract=SAME_GROUP_ATTRACT):
+    return numpy.where(~external_pairs & (distances > SAME_GROUP_ATTRACT_DISTANCE),
+                       group_attract * (distances - SAME_GROUP_ATTRACT_DISTANCE), 0.0)
+
+
+def same_group_repel_factors(distances, external_pairs):
+    return numpy.where(~external_pairs & (distances < SAME_GROUP_REPEL_DISTANCE),
+                       -SAME_GROUP_REPEL * (SAME_GROUP_REPEL_DISTANCE - distances), 0.0)
+
+
+def other_group_factors(distances, external_pairs):
+    return numpy.where(distances < OTHER_GROUP_DISTANCE,
+                       numpy.where(external_pairs, -EXTERNAL_REPEL, -OTHER_GROUP_REPEL), 0.0)
+
+
+def same_group_correction_factors(distances, external_pairs):
+    # Turns the other group rule, applied to every pair, into the same group rule for pairs of one group
+    return same_group_repel_factors(distances, external_pairs) - other_group_factors(distances, external_pairs)
+
+
+# Repulsion rules for the octree pass: factor function, distances where the factor jumps, and the distance below
+# which it varies with distance. Between jumps a constant factor is linear in the pair vector, so a whole cell
+# inside one constant band is summed exactly from its count and position sum.
+OTHER_GROUP_RULE = (other_group_factors, (OTHER_GROUP_DISTANCE,), 0.0)
+SAME_GROUP_CORRECTION_RULE = (same_group_correction_factors, (SAME_GROUP_REPEL_DISTANCE, OTHER_GROUP_DISTANCE),
+                              SAME_GROUP_REPEL_DISTANCE)
+
+
+def row_norms(vectors):
+    return numpy.sqrt(numpy.einsum('ij,ij->i', vectors, vectors))
+
+
+def cell_factors(factors_of, nearest, farthest, external_pairs):
+    # Mean factor over the distances a cell spans; a cell cut by a cutoff only gets the share that is in reach
+    factors = numpy.zeros(len(nearest))
+    for sample in range(BARNES_HUT_CELL_SAMPLES):
+        factors += factors_of(nearest + (farthest - nearest) * (sample + 0.5) / BARNES_HUT_CELL_SAMPLES,
+                              external_pairs)
+    return factors / BARNES_HUT_CELL_SAMPLES
+
+
+class ForceLayout:
+    def __init__(self, positions, velocities, groups, externals, edges=(), group_attract=SAME_GROUP_ATTRACT,
+                 edge_attract=EDGE_ATTRACT, chunk_pairs=1 << 20):
+        self.positions = numpy.array(positions, dtype=numpy.float64).reshape(-1, 3)
+        self.velocities = numpy.array(velocities, dtype=numpy.float64).reshape(-1, 3)
+        self.groups = numpy.asarray(groups, dtype=numpy.int64)
+        self.externals = numpy.asarray(externals, dtype=bool)
+        # (importer, import) rows of the vertex order, pulled together by edge_attract
+        self.edges = numpy.asarray(edges, dtype=numpy.int64).reshape(-1, 2)
+        self.group_attract = group_attract
+        self.edge_attract = edge_attract
+        # Pair arrays are built for row chunks, so memory stays near chunk_pairs * 3 floats for any graph size
+        self.chunk_pairs = chunk_pairs
+
+    def pair_factors(self, start, end, distances):
+        same_group = self.groups[start:end, None] == self.groups[None, :]
+        external_pairs = self.externals[start:end, None] | self.externals[None, :]
+        same_group_factors = same_group_attract_factors(distances, external_pairs, self.group_attract) + \
+            same_group_repel_factors(distances, external_pairs)
+        return numpy.where(same_group, same_group_factors, other_group_factors(distances, external_pairs))
+
+    def pair_forces(self, dt):
+        count = len(self.positions)
+        forces = numpy.zeros_like(self.positions)
+        chunk_rows = max(1, self.chunk_pairs // max(1, count))
+        for start in range(0, count, chunk_rows):
+            end = min(count, start + chunk_rows)
+            vectors = self.positions[None, :, :] - self.positions[start:end, None, :]
+            distances = numpy.sqrt(numpy.einsum('ijk,ijk->ij', vectors, vectors))
+            factors = self.pair_factors(start, end, distances)
+            # A vertex paired with itself has a zero vector, so the diagonal adds nothing
+            forces[start:end] = 2 * dt * numpy.einsum('ij,ijk->ik', factors, vectors)
+        return forces + 2 * dt * self.edge_forces()
+
+    def edge_forces(self):
+        # A spring along every import edge, pulling both of its ends by edge_attract times their distance
+        forces = numpy.zeros_like(self.positions)
+        if self.edge_attract and len(self.edges):
+            vectors = self.positions[self.edges[:, 1]] - self.positions[self.edges[:, 0]]
+            for axis in range(3):
+                forces[:, axis] += numpy.bincount(self.edges[:, 0], self.edge_attract * vectors[:, axis],
+                                                  len(self.positions))
+                forces[:, axis] -= numpy.bincount(self.edges[:, 1], self.edge_attract * vectors[:, axis],
+                                                  len(self.positions))
+        return forces
+
+    def tick(self, dt, physics_speed):
+        self.velocities += self.pair_forces(dt)
+        self.positions += self.velocities * dt * physics_speed
+        lengths = row_norms(self.positions)
+        lengths[lengths == 0] = 1
+        self.positions /= lengths[:, None]
+
+
+class Octree:
+    # Linear octree: vertexes sorted by (prefix, morton code), so the cells of every level are contiguous runs
+    # of the sorted order. A prefix splits the tree into one independent root per prefix value.
+    def __init__(self, positions, externals, prefixes, depth=BARNES_HUT_DEPTH):
+        self.depth = depth
+        low = positions.min(axis=0)
+        extent = max(float((positions.max(axis=0) - low).max()), 1e-12)
+        cells = numpy.minimum(((positions - low) / extent * (1 << depth)).astype(numpy.int64), (1 << depth) - 1)
+        codes = numpy.zeros(len(positions), dtype=numpy.int64)
+        for bit in range(depth):
+            for axis in range(3):
+                codes |= ((cells[:, axis] >> bit) & 1) << (3 * bit + axis)
+        codes |= prefixes.astype(numpy.int64) << (3 * depth)
+
+        self.order = numpy.argsort(codes, kind='stable')
+        self.codes = codes[self.order]
+        self.positions = positions[self.order]
+        self.externals = externals[self.order]
+        external_positions = self.positions * self.externals[:, None]
+
+        self.levels = []
+        for level in range(depth + 1):
+            keys, starts, counts = numpy.unique(self.codes >> (3 * (depth - level)),
+                                                return_index=True, return_counts=True)
+            self.levels.append({'keys': keys,
+                                'starts': starts,
+                                'counts': counts,
+                                'sums': numpy.add.reduceat(self.positions, starts),
+                                'external_counts': numpy.add.reduceat(self.externals.astype(numpy.int64), starts),
+                                'external_sums': numpy.add.reduceat(external_positions, starts),
+                                'lows': numpy.minimum.reduceat(self.positions, starts),
+                                'highs': numpy.maximum.reduceat(self.positions, starts)})
+        for level, cells in enumerate(self.levels):
+            cells['sizes'] = (cells['highs'] - cells['lows']).max(axis=1)
+            if level < depth:
+                child_keys = self.levels[level + 1]['keys'] >> 3
+                cells['child_starts'] = numpy.searchsorted(child_keys, cells['keys'], 'left')
+                cells['child_ends'] = numpy.searchsorted(child_keys, cells['keys'], 'right')
+
+    def vertex_keys(self, level):
+        return self.codes >> (3 * (self.depth - level))
+
+    def roots(self, vertexes):
+        return numpy.searchsorted(self.levels[0]['keys'], self.vertex_keys(0)[vertexes])
+
+
+def expand_ranges(owners, starts, counts):
+    # Pairs every owner with each index of its [start, start + count) range
+    owners = numpy.repeat(owners, counts)
+    offsets = numpy.arange(len(owners)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return owners, numpy.repeat(starts, counts) + offsets
+
+
+class BarnesHutLayout(ForceLayout):
+    # Repulsion is read from octrees: a cell inside one band of a rule acts through its count and centre of mass,
+    # exactly where the factor is constant and where it looks small from a vertex (size < theta * distance) where
+    # it varies. A cell cut by a cutoff acts through its share in reach once it is smaller than theta * cutoff, so
+    # the work per vertex stays bounded as the graph grows. A cell out of reach of every rule is skipped, and the
+    # rest are opened down to exact pairs. theta 0 evaluates every pair in reach exactly and gives the same layout
+    # as ForceLayout.
+    def __init__(self, positions, velocities, groups, externals, edges=(), theta=BARNES_HUT_THETA,
+                 group_attract=SAME_GROUP_ATTRACT, edge_attract=EDGE_ATTRACT, leaf_size=BARNES_HUT_LEAF_SIZE,
+                 chunk_vertexes=4096):
+        super().__init__(positions, velocities, groups, externals, edges, group_attract, edge_attract)
+        self.theta = theta
+        self.leaf_size = leaf_size
+        self.chunk_vertexes = chunk_vertexes
+
+    def tree_forces(self, tree, rule):
+        factors_of, breakpoints, varying_below = rule
+        reach = max(breakpoints)
+        count = len(tree.positions)
+        forces = numpy.zeros((count, 3))
+        vertex_keys = [tree.vertex_keys(level) for level in range(tree.depth + 1)]
+
+        for chunk_start in range(0, count, self.chunk_vertexes):
+            chunk_end = min(count, chunk_start + self.chunk_vertexes)
+            chunk_forces = forces[chunk_start:chunk_end]
+
+            def add_forces(vertexes, vectors):
+                # Only vertexes of the chunk get forces, so the sums are as long as the chunk, not the graph
+                for axis in range(3):
+                    chunk_forces[:, axis] += numpy.bincount(vertexes - chunk_start, vectors[:, axis],
+                                                            chunk_end - chunk_start)
+
+            vertexes = numpy.arange(chunk_start, chunk_end)
+            cells = tree.roots(vertexes)
+            for level, tree_cells in enumerate(tree.levels):
+                if len(vertexes) == 0:
+                    break
+                positions = tree.positions[vertexes]
+                lows = tree_cells['lows'][cells] - positions
+                highs = tree_cells['highs'][cells] - positions
+                nearest = row_norms(numpy.maximum(numpy.maximum(lows, -highs), 0))
+                in_reach = nearest < reach
+                vertexes, cells, positions = vertexes[in_reach], cells[in_reach], positions[in_reach]
+                nearest, lows, highs = nearest[in_reach], lows[in_reach], highs[in_reach]
+                farthest = row_norms(numpy.maximum(-lows, highs))
+
+                counts = tree_cells['counts'][cells]
+                sums = tree_cells['sums'][cells]
+                centers = sums / counts[:, None]
+                distances = row_norms(centers - positions)
+                # A cell cut by a jump of the factor is opened until it looks small from the jump, size < theta *
+                # jump distance, and then gets the share of it in reach. Opening it down to single pairs would make
+                # the whole shell around the cutoff pairwise, and that shell holds ~sqrt(N) vertexes per vertex.
+                sizes = tree_cells['sizes'][cells]
+                small_across_jumps = numpy.ones(len(cells), dtype=bool)
+                for jump_distance in breakpoints:
+                    small_across_jumps &= (farthest < jump_distance) | (nearest >= jump_distance) | \
+                        (sizes < self.theta * jump_distance)
+                accepted = (vertex_keys[level][vertexes] != tree_cells['keys'][cells]) & small_across_jumps & \
+                    ((nearest >= varying_below) | (sizes < self.theta * distances))
+                if accepted.any():
+                    accepted_cells = cells[accepted]
+                    accepted_positions = positions[accepted]
+                    accepted_nearest = nearest[accepted]
+                    accepted_farthest = farthest[accepted]
+                    vertex_externals = tree.externals[vertexes[accepted]]
+                    external_counts = tree_cells['external_counts'][accepted_cells]
+                    external_sums = tree_cells['external_sums'][accepted_cells]
+                    internal_counts = counts[accepted] - external_counts
+                    internal_sums = sums[accepted] - external_sums
+                    add_forces(vertexes[accepted],
+                               cell_factors(factors_of, accepted_nearest, accepted_farthest,
+                                            vertex_externals)[:, None] *
+                               (internal_sums - internal_counts[:, None] * accepted_positions) +
+                               cell_factors(factors_of, accepted_nearest, accepted_farthest,
+                                            numpy.ones_like(vertex_externals))[:, None] *
+                               (external_sums - external_counts[:, None] * accepted_positions))
+
+                opened = ~accepted
+                leaves = opened & ((counts <= self.leaf_size) | (level == tree.depth))
+                if leaves.any():
+                    pair_a, pair_b = expand_ranges(vertexes[leaves], tree_cells['starts'][cells[leaves]],
+                                                   counts[leaves])
+                    pair_a, pair_b = pair_a[pair_a != pair_b], pair_b[pair_a != pair_b]
+                    vectors = tree.positions[pair_b] - tree.positions[pair_a]
+                    factors = factors_of(row_norms(vectors), tree.externals[pair_a] | tree.externals[pair_b])
+                    add_forces(pair_a, factors[:, None] * vectors)
+
+                branches = opened & ~leaves
+                if level < tree.depth:
+                    child_starts = tree_cells['child_starts'][cells[branches]]
+                    child_counts = tree_cells['child_ends'][cells[branches]] - child_starts
+                    vertexes, cells = expand_ranges(vertexes[branches], child_starts, child_counts)
+
+        unsorted_forces = numpy.empty_like(forces)
+        unsorted_forces[tree.order] = forces
+        return unsorted_forces
+
+    def attraction_forces(self):
+        forces = self.edge_forces()
+        if self.group_attract:
+            # Members of a group pull towards its centre of mass instead of towards every other member
+            group_counts = numpy.bincount(self.groups)
+            centers = numpy.stack([numpy.bincount(self.groups, self.positions[:, axis]) for axis in range(3)],
+                                  axis=1) / numpy.maximum(group_counts, 1)[:, None]
+            vectors = centers[self.groups] - self.positions
+            factors = same_group_attract_factors(row_norms(vectors), self.externals, self.group_attract)
+            forces += (group_counts[self.groups] * factors)[:, None] * vectors
+        return forces
+
+    def pair_forces(self, dt):
+        if len(self.positions) == 0:
+            return numpy.zeros_like(self.positions)
+        forces = self.tree_forces(Octree(self.positions, self.externals, numpy.zeros_like(self.groups)),
+                                  OTHER_GROUP_RULE)
+        forces += self.tree_forces(Octree(self.positions, self.externals, self.groups), SAME_GROUP_CORRECTION_RULE)
+        return 2 * dt * (forces + self.attraction_forces())
+
+
+class LayoutWorker(threading.Thread):
+    # Ticks a layout away from the render loop. Every tick publishes a fresh positions array as `snapshot`, and
+    # readers take the reference as it is, so they never see a half written tick. on_tick(start, end) is called
+    # from the worker thread with the perf_counter times of every tick.
+    def __init__(self, layout, physics_speed_of, timestep=LAYOUT_TIMESTEP,
+                 movement_threshold=LAYOUT_MOVEMENT_THRESHOLD, max_ticks=LAYOUT_MAX_TICKS, on_tick=None):
+        super().__init__(daemon=True)
+        self.layout = layout
+        self.physics_speed_of = physics_speed_of
+        self.timestep = timestep
+        self.movement_threshold = movement_threshold
+        self.max_ticks = max_ticks
+        self.on_tick = on_tick
+        self.ticks = 0
+        self.movement = None
+        self.converged = False
+        self.snapshot = layout.positions.copy()
+        self.snapshot_version = 0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set() and self.ticks < self.max_ticks:
+            previous_positions = self.layout.positions.copy()
+            tick_start = time.perf_counter()
+            self.layout.tick(self.timestep, self.physics_speed_of(self.ticks))
+            if self.on_tick is not None:
+                self.on_tick(tick_start, time.perf_counter())
+            self.ticks += 1
+            self.movement = float(row_norms(self.layout.positions - previous_positions).mean()) \
+                if len(previous_positions) else 0.0
+            self.snapshot = self.layout.positions.copy()
+            self.snapshot_version += 1
+            if self.movement < self.movement_threshold:
+                self.converged = True
+                break
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+def graph_structure_hash(relation_data):
+    # Module ids differ between .rtm and .rtmb inputs, so the hash is built from abs_paths only
+    abs_paths = {module_id: relation['abs_path'] for module_id, relation in relation_data.items()}
+    digest = hashlib.sha1()
+    for module_id in sorted(relation_data, key=abs_paths.get):
+        relation = relation_data[module_id]
+        imports = '\0'.join(sorted(abs_paths[other_id] for other_id in relation['imports'] if other_id in abs_paths))
+        digest.update(f'{relation["abs_path"]}\0{relation["top_dir"]}\0{imports}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class LayoutCache:
+    version = 1
+
+    def __init__(self, cache_path, max_entries=LAYOUT_CACHE_ENTRIES):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.layouts = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get('version') == self.version:
+            self.layouts = data['layouts']
+
+    def save(self):
+        # Only the most recently saved layouts are kept, one per graph structure
+        newest = sorted(self.layouts, key=lambda graph_hash: self.layouts[graph_hash]['saved'], reverse=True)
+        layouts = {graph_hash: self.layouts[graph_hash] for graph_hash in newest[:self.max_entries]}
+        with open(self.cache_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'version': self.version, 'layouts': layouts}, file)
+        os.replace(self.cache_path + '.tmp', self.cache_path)
+
+    def get(self, graph_hash, abs_paths):
+        # The layout of the same structure, or else the one sharing the most modules; returns (positions, exact)
+        if graph_hash in self.layouts:
+            return self.layouts[graph_hash]['positions'], True
+        best_positions = {}
+        best_shared = 0
+        for layout in self.layouts.values():
+            shared = sum(1 for abs_path in abs_paths if abs_path in layout['positions'])
+            if shared > best_shared:
+                best_positions, best_shared = layout['positions'], shared
+        return best_positions, False
+
+    def put(self, graph_hash, positions):
+        self.layouts[graph_hash] = {'saved': time.time(), 'positions': positions}
@@ -0,0 +1,211 @@
+import argparse
+import html
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+# Surfaces only live in memory, no display is opened
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy
+import numpy.matlib
+import pygame
+
+import layout_engine
+from model_visualizer import ModelVisualizer, matrix_rotate_with_vector, matrix_rotate_xyz
+
+IMAGE_FORMATS = ('png', 'svg')
+
+# Loaded once per process and shared by every graph it renders
+font_source = None
+
+
+class SvgCanvas:
+    # The primitives of one frame as SVG elements, in drawing order
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.elements = []
+
+    @staticmethod
+    def color(color):
+        return f'rgb({int(color[0])},{int(color[1])},{int(color[2])})'
+
+    def fill(self, color):
+        self.elements.append(f'<rect width="{self.width}" height="{self.height}" fill="{self.color(color)}"/>')
+
+    def line(self, color, start_pos, end_pos, width):
+        self.elements.append(f'<line x1="{start_pos[0]}" y1="{start_pos[1]}" x2="{end_pos[0]}" y2="{end_pos[1]}" '
+                             f'stroke="{self.color(color)}" stroke-width="{width}"/>')
+
+    def circle(self, color, pos, radius):
+        self.elements.append(f'<circle cx="{pos[0]}" cy="{pos[1]}" r="{radius}" fill="{self.color(color)}"/>')
+
+    def text(self, family, size, text, x, y, color):
+        # Centred on (x, y) with a black outline under the fill, like draw_string_and_its_outline
+        self.elements.append(f'<text x="{x:g}" y="{y:g}" font-family="{html.escape(family)}" font-size="{size}" '
+                             f'text-anchor="middle" dominant-baseline="central" fill="{self.color(color)}" '
+                             f'stroke="black" stroke-width="2" paint-order="stroke">{html.escape(text)}</text>')
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+                       f'viewBox="0 0 {self.width} {self.height}">\n')
+            for element in self.elements:
+                file.write(element + '\n')
+            file.write('</svg>\n')
+
+
+def facing_rotation(direction):
+    # Rotation turning direction towards the camera, which looks along +z at the sphere
+    direction = numpy.asarray(direction, dtype=float)
+    length = numpy.linalg.norm(direction)
+    if length == 0:
+        return numpy.matlib.identity(4)
+    direction = direction / length
+    target = numpy.array([0.0, 0.0, -1.0])
+    axis = numpy.cross(direction, target)
+    if numpy.linalg.norm(axis) < 1e-9:
+        return numpy.matlib.identity(4) if direction @ target > 0 else matrix_rotate_xyz(numpy.pi, 0)
+    angle = math.acos(max(-1.0, min(1.0, direction @ target)))
+    return numpy.asmatrix(matrix_rotate_with_vector(axis / numpy.linalg.norm(axis), angle))
+
+
+def focus_scale(model_visualizer, rows, fill=0.8):
+    # drawing_scale fitting the rows into the view; offsets from the centre grow linearly with the scale
+    projection = model_visualizer.project_vertexes(1)
+    visible_rows = [row for row in rows if projection['visible'][row]]
+    if len(visible_rows) == 0:
+        return 1
+    center = numpy.array([(model_visualizer.window_w - model_visualizer.menu_panel_width) // 2,
+                          model_visualizer.window_h // 2])
+    offset = numpy.abs(projection['screen_positions'][visible_rows] - center).max(axis=0)
+    half_size = center * fill
+    scale = min(half_size[k] / offset[k] for k in range(2) if offset[k] > 0) if offset.any() else 5
+    return min(5, max(0.5, scale))
+
+
+def list_views(model_visualizer, angles=1, focus_top_dirs=False, drawing_scale=1):
+    # (name, rotation_view, drawing_scale, focused_top_dir) of every picture of a graph
+    views = [(f'angle{index}', matrix_rotate_xyz(0, 2 * numpy.pi * index / angles), drawing_scale, None)
+             for index in range(angles)]
+    if focus_top_dirs:
+        positions = model_visualizer.vertex_store.positions[model_visualizer.vertex_indexes()]
+        top_dirs = [model_visualizer.relation_data[module_id]['top_dir'] for module_id in model_visualizer.vertexes]
+        for top_dir in sorted(top_dir for top_dir in model_visualizer.top_dirs if top_dir != '__external__'):
+            member_rows = [row for row, member_top_dir in enumerate(top_dirs) if member_top_dir == top_dir]
+            rotation_view = facing_rotation(positions[member_rows].mean(axis=0))
+            model_visualizer.caculate_drawing_view(rotation_view, 1)
+            views.append((f'top_{top_dir}', rotation_view, focus_scale(model_visualizer, member_rows), top_dir))
+    return views
+
+
+def render_graph(relation_path, output_dir, image_formats=('png',), width=1600, height=1200, angles=1,
+                 focus_top_dirs=False, drawing_scale=1, physics='numpy', theta=layout_engine.BARNES_HUT_THETA,
+                 physics_ticks=40, collapse_spacing=None, seed=0, group_attract=layout_engine.SAME_GROUP_ATTRACT,
+                 edge_attract=layout_engine.EDGE_ATTRACT):
+    global font_source
+    timer_start = time.perf_counter()
+    # Seeded so the same graph gives the same pictures on every run
+    random.seed(seed)
+    model_visualizer = ModelVisualizer()
+    model_visualizer.physics_engine = physics
+    model_visualizer.barnes_hut_theta = theta
+    model_visualizer.group_attract = group_attract
+    model_visualizer.edge_attract = edge_attract
+    model_visualizer.max_physics_time = physics_ticks
+    if collapse_spacing:
+        model_visualizer.cluster_collapse_spacing = collapse_spacing
+        model_visualizer.widget_enable_collapsing_packages.attribute['is_checked'] = True
+    model_visualizer.analyze_model(relation_path)
+    model_visualizer.prepare_vertex_position()
+
+    model_visualizer.menu_panel_width = 0
+    model_visualizer.create_offscreen_surface(width, height, font_source)
+    if font_source is None:
+        font_source = model_visualizer
+
+    name = os.path.splitext(os.path.basename(relation_path))[0]
+    image_paths = []
+    for view_name, rotation_view, view_scale, focused_top_dir in list_views(model_visualizer, angles, focus_top_dirs,
+                                                                             drawing_scale):
+        model_visualizer.caculate_drawing_view(rotation_view, view_scale)
+        model_visualizer.focused_top_dir = focused_top_dir
+        model_visualizer.svg_canvas = SvgCanvas(width, height) if 'svg' in image_formats else None
+        model_visualizer.draw_frame(view_scale, draw_interface=False)
+
+        image_path = os.path.join(output_dir, f'{name}_{view_name}')
+        if 'png' in image_formats:
+            pygame.image.save(model_visualizer.window_surf, image_path + '.png')
+            image_paths.append(image_path + '.png')
+        if 'svg' in image_formats:
+            model_visualizer.svg_canvas.save(image_path + '.svg')
+            image_paths.append(image_path + '.svg')
+    model_visualizer.svg_canvas = None
+    return relation_path, image_paths, time.perf_counter() - timer_start
+
+
+def render_graph_task(task):
+    relation_path, output_dir, options = task
+    return render_graph(relation_path, output_dir, **options)
+
+
+def render_graphs(relation_paths, output_dir, jobs=1, **options):
+    tasks = [(relation_path, output_dir, options) for relation_path in relation_paths]
+    timer_start = time.perf_counter()
+    image_count = 0
+    # Every worker process loads the fonts once and keeps them for the graphs it is given
+    pool = multiprocessing.Pool(jobs) if jobs > 1 and len(tasks) > 1 else None
+    try:
+        results = pool.imap_unordered(render_graph_task, tasks) if pool else map(render_graph_task, tasks)
+        for relation_path, image_paths, elapsed in results:
+            print(f'[Render] {relation_path}: {len(image_paths)} images in {elapsed:.3f}s')
+            image_count += len(image_paths)
+    finally:
+        if pool:
+            pool.terminate()
+    print(f'[Render] {len(tasks)} graphs, {image_count} images in {time.perf_counter() - timer_start:.3f}s')
+    return image_count
+
+
+def parse_size(text):
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage=f'python {sys.argv[0]} [INPUT_FILE ...] --output-dir DIR')
+    parser.add_argument('input_files', nargs='+')
+    parser.add_argument('-o', '--output-dir', required=True, help='pictures are written here as NAME_VIEW.FORMAT')
+    parser.add_argument('--format', nargs='+', choices=IMAGE_FORMATS, default=['png'])
+    parser.add_argument('--size', type=parse_size, default=(1600, 1200), help='picture size, WIDTHxHEIGHT')
+    parser.add_argument('--angles', type=int, default=1, help='pictures turned evenly around the vertical axis')
+    parser.add_argument('--focus-top-dirs', action='store_true',
+                        help='one more picture per top_dir, turned and zoomed to it with only its relations')
+    parser.add_argument('--scale', type=float, default=1, help='zoom of the angle pictures, 0.5 to 5')
+    parser.add_argument('--physics', choices=layout_engine.PHYSICS_ENGINES, default='numpy', help='layout engine')
+    parser.add_argument('--theta', type=float, default=layout_engine.BARNES_HUT_THETA,
+                        help='Barnes-Hut opening angle, 0 is exact and larger values are faster')
+    parser.add_argument('--physics-ticks', type=int, default=40, help='layout ticks before drawing')
+    parser.add_argument('--group-attract', type=float, default=layout_engine.SAME_GROUP_ATTRACT,
+                        help='pull between modules of one top_dir further apart than 0.6, 0 is off')
+    parser.add_argument('--edge-attract', type=float, default=layout_engine.EDGE_ATTRACT,
+                        help='spring constant pulling every module towards its imports, 0 is off '
+                             '(numpy and barnes-hut layouts)')
+    parser.add_argument('--collapse-spacing', type=float,
+                        help='collapse packages, drawing one as a circle while its modules are closer than this many '
+                             'pixels (off by default)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the starting layout')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='graphs rendered at once')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    render_graphs(args.input_files, args.output_dir, args.jobs, image_formats=args.format, width=args.size[0],
+                  height=args.size[1], angles=args.angles, focus_top_dirs=args.focus_top_dirs,
+                  drawing_scale=args.scale, physics=args.physics, theta=args.theta, physics_ticks=args.physics_ticks,
+                  collapse_spacing=args.collapse_spacing, seed=args.seed, group_attract=args.group_attract,
+                  edge_attract=args.edge_attract)
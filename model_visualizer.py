@@ -1,14 +1,24 @@
+import argparse
+import collections
 import colorsys
-import datetime
+import contextlib
+import json
 import math
+import os
 import random
+import socket
 import statistics
 from math import sin, cos
 import sys
+import threading
+import time
 
 import numpy.matlib
 import pygame.locals
 
+import graph_format
+import layout_engine
+
 
 def matrix_scale(x=1, y=1, z=1, w=1):
     return numpy.array([
@@ -62,6 +72,19 @@ def points_distance(vector_a, vector_b):
             vector_a[2] - vector_b[2]) ** 2) ** 0.5
 
 
+def hsv_to_rgb_array(h, s, v):
+    # colorsys.hsv_to_rgb on arrays, returns an (N, 3) array
+    i = numpy.floor(h * 6.0)
+    f = h * 6.0 - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i.astype(numpy.int64) % 6
+    return numpy.stack([numpy.choose(i, [v, q, p, p, t, v]),
+                        numpy.choose(i, [t, v, v, q, p, p]),
+                        numpy.choose(i, [p, p, t, v, v, q])], axis=1)
+
+
 def homogeneous_coordinates_matrix():
     return numpy.array([
         [1, 0, 0, 0],
@@ -71,34 +94,122 @@ def homogeneous_coordinates_matrix():
     ])
 
 
-class Vertex:
-    def __init__(self, x: float, y: float, z: float):
-        self.x = x
-        self.y = y
-        self.z = z
+class VertexStore:
+    # Every vertex field lives in one contiguous array indexed by a dense slot id. Slots of removed vertexes are
+    # reused, and the generation of a slot changes whenever it is taken or freed. `version` changes with every
+    # write, so views derived from the arrays know when to recompute.
+    FLAG_COLOR_FIX_V = 1
+
+    def __init__(self, capacity=256):
+        self.positions = numpy.zeros((capacity, 3))
+        self.velocities = numpy.zeros((capacity, 3))
+        self.sizes = numpy.zeros(capacity)
+        self.colors = numpy.zeros((capacity, 3))
+        self.flags = numpy.zeros(capacity, dtype=numpy.uint8)
+        self.generations = numpy.zeros(capacity, dtype=numpy.int64)
+        self.count = 0
+        self.free_indexes = []
+        self.version = 0
+
+    def grow(self):
+        for name in ('positions', 'velocities', 'sizes', 'colors', 'flags', 'generations'):
+            values = getattr(self, name)
+            grown_values = numpy.zeros((len(values) * 2,) + values.shape[1:], dtype=values.dtype)
+            grown_values[:len(values)] = values
+            setattr(self, name, grown_values)
+
+    def allocate(self):
+        if self.free_indexes:
+            index = self.free_indexes.pop()
+        else:
+            if self.count == len(self.sizes):
+                self.grow()
+            index = self.count
+            self.count += 1
+        self.version += 1
+        self.generations[index] += 1
+        self.positions[index] = 0
+        self.velocities[index] = 0
+        self.sizes[index] = 0
+        self.colors[index] = 0
+        self.flags[index] = 0
+        return index
+
+    def release(self, index):
+        self.version += 1
+        self.generations[index] += 1
+        self.free_indexes.append(index)
+
+
+def vertex_field(name, column=None):
+    # The array is looked up on every access because grow() replaces it
+    if column is None:
+        def get_field(vertex):
+            return getattr(vertex.store, name)[vertex.index].item()
+
+        def set_field(vertex, value):
+            getattr(vertex.store, name)[vertex.index] = value
+            vertex.store.version += 1
+    else:
+        def get_field(vertex):
+            return getattr(vertex.store, name)[vertex.index, column].item()
+
+        def set_field(vertex, value):
+            getattr(vertex.store, name)[vertex.index, column] = value
+            vertex.store.version += 1
+    return property(get_field, set_field)
+
 
-        self.color_h = math.atan2(self.y, self.x) / (numpy.pi * 2) + 0.5
+class Vertex:
+    # A view of one slot of a VertexStore
+    __slots__ = ('store', 'index')
+
+    x = vertex_field('positions', 0)
+    y = vertex_field('positions', 1)
+    z = vertex_field('positions', 2)
+    vx = vertex_field('velocities', 0)
+    vy = vertex_field('velocities', 1)
+    vz = vertex_field('velocities', 2)
+    color_h = vertex_field('colors', 0)
+    color_s = vertex_field('colors', 1)
+    color_v = vertex_field('colors', 2)
+    size = vertex_field('sizes')
+
+    def __init__(self, x: float, y: float, z: float, store: VertexStore = None):
+        self.store = store if store is not None else VertexStore(1)
+        self.index = self.store.allocate()
+        self.set_pos([x, y, z])
+
+        self.color_h = math.atan2(y, x) / (numpy.pi * 2) + 0.5
         self.color_s = 0.8
         self.color_v = 1
         self.color_fix_v = False
 
-        self.vx = 0
-        self.vy = 0
-        self.vz = 0
         self.size = 7
 
+    @property
+    def color_fix_v(self):
+        return bool(self.store.flags[self.index] & VertexStore.FLAG_COLOR_FIX_V)
+
+    @color_fix_v.setter
+    def color_fix_v(self, value):
+        flags = int(self.store.flags[self.index])
+        if value:
+            self.store.flags[self.index] = flags | VertexStore.FLAG_COLOR_FIX_V
+        else:
+            self.store.flags[self.index] = flags & ~VertexStore.FLAG_COLOR_FIX_V
+        self.store.version += 1
+
     def get_pos(self):
-        return [self.x, self.y, self.z]
+        return self.store.positions[self.index].tolist()
 
     def add_force(self, v):
-        self.vx += v[0]
-        self.vy += v[1]
-        self.vz += v[2]
+        self.store.velocities[self.index] += v
+        self.store.version += 1
 
     def set_pos(self, v):
-        self.x = v[0]
-        self.y = v[1]
-        self.z = v[2]
+        self.store.positions[self.index] = v
+        self.store.version += 1
 
 
 class RelationInfo:
@@ -107,8 +218,10 @@ class RelationInfo:
         self.vertex_b = model.vertexes[B]
         self.detail_a = model.relation_data[A]
         self.detail_b = model.relation_data[B]
-        self.vector_a_to_b = [self.vertex_b.get_pos()[k] - self.vertex_a.get_pos()[k] for k in range(3)]
-        self.vector_a_to_b_length = points_distance(self.vertex_a.get_pos(), self.vertex_b.get_pos())
+        position_a = self.vertex_a.get_pos()
+        position_b = self.vertex_b.get_pos()
+        self.vector_a_to_b = [position_b[k] - position_a[k] for k in range(3)]
+        self.vector_a_to_b_length = points_distance(position_a, position_b)
         self.equal_top_dir = self.detail_a['top_dir'] == self.detail_b['top_dir']
         self.is_a_external = self.detail_a['top_dir'] == '__external__'
         self.is_b_external = self.detail_b['top_dir'] == '__external__'
@@ -116,40 +229,238 @@ class RelationInfo:
         self.b_import_a = (A in self.detail_b['imports'])
 
 
-def get_fit_size_of_singleline_for_circle(drawing_plain_fonts, line, radius):
-    last_size = None
-    for size in range(len(drawing_plain_fonts)):
-        text = drawing_plain_fonts[size].render(line, True, (0, 0, 0))
-        if text.get_width() <= radius * 2 or (last_size is None):
-            last_size = size
-        else:
-            break
-    return last_size
-
-
-def get_fit_size_of_mutipleline_text_for_circle(drawing_plain_fonts, lines, radius):
-    last_size = None
-    line_height = None
-    for size in range(len(drawing_plain_fonts)):
-        text = drawing_plain_fonts[size].render('examine text', True, (0, 0, 0))
-        if text.get_height() * len(lines) <= radius * 2 or (last_size is None):
-            if last_size is None:
-                last_size = size
-                line_height = text.get_height()
-            else:
-                is_fit = True
-                for line in lines:
-                    line_text = drawing_plain_fonts[size].render(line, True, (0, 0, 0))
-                    if not (line_text.get_width() <= radius * 2):
-                        is_fit = False
-                        break
-                if is_fit:
-                    last_size = size
-                    line_height = text.get_height()
-        else:
-            break
+class ScreenGrid:
+    # Circles bucketed into square screen cells inside a width x height area, for picking the circle drawn last under
+    # a point without testing every circle. Every circle is listed in each cell its bounding box overlaps, in the order
+    # the circles were drawn.
+    def __init__(self, positions, radii, width, height, cell_size=None):
+        self.positions = positions.tolist()
+        self.radii = radii.tolist()
+        if cell_size is None:
+            cell_size = max(8, 2 * int(numpy.median(radii))) if len(radii) > 0 else 8
+        self.cell_size = cell_size
+        self.columns = max(1, -(-width // cell_size))
+        self.rows = max(1, -(-height // cell_size))
+
+        low_columns = numpy.clip((positions[:, 0] - radii) // cell_size, 0, None)
+        high_columns = numpy.clip((positions[:, 0] + radii) // cell_size, None, self.columns - 1)
+        low_rows = numpy.clip((positions[:, 1] - radii) // cell_size, 0, None)
+        high_rows = numpy.clip((positions[:, 1] + radii) // cell_size, None, self.rows - 1)
+        span_columns = numpy.clip(high_columns - low_columns + 1, 0, None)
+        span_rows = numpy.clip(high_rows - low_rows + 1, 0, None)
+        cell_counts = span_columns * span_rows
+
+        circles = numpy.repeat(numpy.arange(len(radii)), cell_counts)
+        offsets = numpy.arange(len(circles)) - numpy.repeat(numpy.cumsum(cell_counts) - cell_counts, cell_counts)
+        cells = (low_rows[circles] + offsets // span_columns[circles]) * self.columns + \
+                low_columns[circles] + offsets % span_columns[circles]
+        # A stable sort keeps the drawing order within every cell
+        order = numpy.argsort(cells, kind='stable')
+        self.circles = circles[order].tolist()
+        self.cell_starts = numpy.concatenate(
+            ([0], numpy.cumsum(numpy.bincount(cells, minlength=self.columns * self.rows)))).tolist()
+
+    def pick(self, x, y):
+        # Index of the circle drawn last containing the point, None if there is none
+        column = x // self.cell_size
+        row = y // self.cell_size
+        if not (0 <= column < self.columns and 0 <= row < self.rows):
+            return None
+        cell = row * self.columns + column
+        for circle in reversed(self.circles[self.cell_starts[cell]:self.cell_starts[cell + 1]]):
+            position = self.positions[circle]
+            if points_distance([position[0], position[1], 0], [x, y, 0]) <= self.radii[circle]:
+                return circle
+        return None
+
+
+class TextFitCache:
+    # Largest plain font size whose text fits a circle. Widths come from Font.size, which measures without rendering
+    # and matches the rendered surface; summed glyph advances miss kerning and bearings. Widths grow with the font
+    # size, so sizes are binary searched. Widths and heights are whole pixels, so a fit only depends on floor(radius * 2)
+    # and results are memoized per (lines, floor(radius * 2)).
+    def __init__(self, drawing_plain_fonts, max_entries=1 << 16):
+        self.drawing_plain_fonts = drawing_plain_fonts
+        self.max_entries = max_entries
+        self.line_heights = [font.size('examine text')[1] for font in drawing_plain_fonts]
+        self.widths = {}
+        self.fit_sizes = {}
+
+    def width(self, size, text):
+        widths = self.widths.get(text)
+        if widths is None:
+            widths = self.widths[text] = [None] * len(self.drawing_plain_fonts)
+        if widths[size] is None:
+            widths[size] = self.drawing_plain_fonts[size].size(text)[0]
+        return widths[size]
 
-    return last_size, line_height
+    @staticmethod
+    def last_fit_size(low, high, is_fit):
+        # The largest size in [low, high] passing is_fit, low - 1 if none does
+        while low <= high:
+            middle = (low + high) // 2
+            if is_fit(middle):
+                low = middle + 1
+            else:
+                high = middle - 1
+        return high
+
+    def memoize(self, key, fit):
+        fit_size = self.fit_sizes.get(key)
+        if fit_size is None:
+            if len(self.fit_sizes) >= self.max_entries:
+                self.fit_sizes.clear()
+            fit_size = self.fit_sizes[key] = fit()
+        return fit_size
+
+    def fit_size_of_singleline_for_circle(self, line, radius):
+        # The smallest size when nothing fits
+        limit = math.floor(radius * 2)
+        return self.memoize((line, limit), lambda: max(0, self.last_fit_size(
+            1, len(self.drawing_plain_fonts) - 1, lambda size: self.width(size, line) <= limit)))
+
+    def fit_size_of_mutipleline_text_for_circle(self, lines, radius):
+        # Returns the size and its line height
+        limit = math.floor(radius * 2)
+
+        def fit():
+            last_size = self.last_fit_size(1, len(self.drawing_plain_fonts) - 1,
+                                           lambda size: self.line_heights[size] * len(lines) <= limit)
+            last_size = max(0, self.last_fit_size(
+                1, last_size, lambda size: all(self.width(size, line) <= limit for line in lines)))
+            return last_size, self.line_heights[last_size]
+        return self.memoize((tuple(lines), limit), fit)
+
+
+class TextSurfaceCache:
+    # Least recently used rendered texts, keyed by (text, font, color). The font object stands for its family and
+    # size, since the title font and one of the plain fonts share a point size.
+    def __init__(self, max_bytes=32 << 20):
+        self.max_bytes = max_bytes
+        self.surfaces = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, render):
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = render()
+        self.surfaces[key] = surface
+        self.bytes += surface.get_width() * surface.get_height() * surface.get_bytesize()
+        while self.bytes > self.max_bytes and len(self.surfaces) > 1:
+            _, evicted_surface = self.surfaces.popitem(last=False)
+            self.bytes -= evicted_surface.get_width() * evicted_surface.get_height() * evicted_surface.get_bytesize()
+            self.evictions += 1
+        return surface
+
+    def text(self, font, text, color=(0, 0, 0)):
+        color = tuple(color)
+        return self.get((text, font, color, 'text'), lambda: font.render(text, True, color))
+
+    def outlined_text(self, font, text, color=(255, 255, 255)):
+        # The four shifted shadows and the text composited once, one pixel of outline on every side
+        color = tuple(color)
+
+        def render():
+            text_shadow = font.render(text, True, (0, 0, 0))
+            text_solid = font.render(text, True, color)
+            surface = pygame.Surface((text_solid.get_width() + 2, text_solid.get_height() + 2), pygame.SRCALPHA)
+            for position in ((2, 2), (2, 0), (0, 2), (0, 0)):
+                surface.blit(text_shadow, position)
+            surface.blit(text_solid, (1, 1))
+            return surface
+        return self.get((text, font, color, 'outlined'), render)
+
+    def stats(self):
+        return {'surfaces': len(self.surfaces), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class FrameProfiler:
+    # Durations of named phases while recording: the last `window` samples of every phase for the overlay, and
+    # every span as a Chrome trace event (chrome://tracing, Perfetto) when tracing. Spans may be recorded from
+    # other threads, such as the layout worker.
+    def __init__(self, window=240, max_trace_events=1 << 20):
+        self.window = window
+        self.max_trace_events = max_trace_events
+        self.samples = {}
+        self.trace_events = None
+        self.dropped_trace_events = 0
+        self.thread_names = {}
+        self.show_overlay = False
+        self.recording = False
+        self.timer_origin = time.perf_counter()
+        self.idle_measure = contextlib.nullcontext()
+
+    def update_recording(self):
+        self.recording = self.show_overlay or self.trace_events is not None
+
+    def toggle_overlay(self):
+        self.show_overlay = not self.show_overlay
+        self.update_recording()
+
+    def start_trace(self):
+        self.trace_events = []
+        self.dropped_trace_events = 0
+        self.update_recording()
+
+    def record(self, name, start, end, category='frame'):
+        if not self.recording:
+            return
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples.setdefault(name, collections.deque(maxlen=self.window))
+        samples.append(end - start)
+        if self.trace_events is None:
+            return
+        if len(self.trace_events) >= self.max_trace_events:
+            self.dropped_trace_events += 1
+            return
+        thread_id = threading.get_ident()
+        if thread_id not in self.thread_names:
+            self.thread_names[thread_id] = threading.current_thread().name
+        self.trace_events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': thread_id,
+                                  'ts': (start - self.timer_origin) * 1e6, 'dur': (end - start) * 1e6})
+
+    @contextlib.contextmanager
+    def measuring(self, name, category):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), category)
+
+    def measure(self, name, category='frame'):
+        # Times the with block; a shared no-op while not recording
+        if not self.recording:
+            return self.idle_measure
+        return self.measuring(name, category)
+
+    def percentiles(self):
+        # {phase: (p50, p99, samples)} in seconds over the rolling window
+        result = {}
+        for name, samples in list(self.samples.items()):
+            durations = numpy.array(tuple(samples))
+            if len(durations):
+                p50, p99 = numpy.percentile(durations, [50, 99])
+                result[name] = (float(p50), float(p99), len(durations))
+        return result
+
+    def save_trace(self, path):
+        events = list(self.trace_events or [])
+        events.extend({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread_id,
+                       'args': {'name': thread_name}} for thread_id, thread_name in list(self.thread_names.items()))
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'dropped_events': self.dropped_trace_events}}, file)
+        return len(events)
 
 
 class PyUIWidget:
@@ -169,8 +480,14 @@ class PyUIWidget:
             self.attribute[key] = kwargs[key]
 
     @staticmethod
-    def draw_label(window_surf, work_on_rect, drawing_plain_font, widget, x=0, new_line=True):
-        text_solid = drawing_plain_font.render(widget.attribute['label'], True, (0, 0, 0))
+    def render(drawing_plain_font, text, text_surfaces=None):
+        if text_surfaces is None:
+            return drawing_plain_font.render(text, True, (0, 0, 0))
+        return text_surfaces.text(drawing_plain_font, text)
+
+    @staticmethod
+    def draw_label(window_surf, work_on_rect, drawing_plain_font, widget, x=0, new_line=True, text_surfaces=None):
+        text_solid = PyUIWidget.render(drawing_plain_font, widget.attribute['label'], text_surfaces)
         window_surf.blit(text_solid,
                          (work_on_rect[0] + x, work_on_rect[1] + (22 - text_solid.get_height()) // 2))
         if widget.tag == 'title':
@@ -182,11 +499,11 @@ class PyUIWidget:
             work_on_rect[3] -= 30
 
     @staticmethod
-    def draw_text(window_surf, work_on_rect, drawing_plain_font, widget, x=0, new_line=True):
+    def draw_text(window_surf, work_on_rect, drawing_plain_font, widget, x=0, new_line=True, text_surfaces=None):
         width = 0
         height = 0
         for line in widget.attribute['text'].split('\n'):
-            text_solid = drawing_plain_font.render(line, True, (0, 0, 0))
+            text_solid = PyUIWidget.render(drawing_plain_font, line, text_surfaces)
             window_surf.blit(text_solid, (work_on_rect[0] + x, work_on_rect[1] + (22 - text_solid.get_height()) // 2 + height))
             width = max(width, text_solid.get_width())
             height += 30
@@ -196,8 +513,8 @@ class PyUIWidget:
             work_on_rect[3] -= height
 
     @staticmethod
-    def draw_label(window_surf, work_on_rect, drawing_plain_font, widget, x=0, new_line=True):
-        text_solid = drawing_plain_font.render(widget.attribute['label'], True, (0, 0, 0))
+    def draw_label(window_surf, work_on_rect, drawing_plain_font, widget, x=0, new_line=True, text_surfaces=None):
+        text_solid = PyUIWidget.render(drawing_plain_font, widget.attribute['label'], text_surfaces)
         window_surf.blit(text_solid,
                          (work_on_rect[0] + x, work_on_rect[1] + (22 - text_solid.get_height()) // 2))
         if widget.tag == 'title':
@@ -209,7 +526,7 @@ class PyUIWidget:
             work_on_rect[3] -= 30
 
     @staticmethod
-    def draw_checkbox(window_surf, work_on_rect, drawing_plain_font, widget, x=0, new_line=True):
+    def draw_checkbox(window_surf, work_on_rect, drawing_plain_font, widget, x=0, new_line=True, text_surfaces=None):
         pygame.draw.rect(window_surf, [0, 0, 0], (work_on_rect[0] + x, work_on_rect[1], 22, 22))
         pygame.draw.rect(window_surf, [255, 255, 255],
                          (work_on_rect[0] + x + 1, work_on_rect[1] + 1, 20, 20))
@@ -222,7 +539,7 @@ class PyUIWidget:
                 (work_on_rect[0] + x + 8, work_on_rect[1] + 15),
             ])
 
-        text_solid = drawing_plain_font.render(widget.attribute['label'], True, (0, 0, 0))
+        text_solid = PyUIWidget.render(drawing_plain_font, widget.attribute['label'], text_surfaces)
         window_surf.blit(text_solid,
                          (work_on_rect[0] + 26 + x, work_on_rect[1] + (22 - text_solid.get_height()) // 2))
         widget.rect = [work_on_rect[0] + x, work_on_rect[1], 22, 22]
@@ -231,8 +548,8 @@ class PyUIWidget:
             work_on_rect[3] -= 30
 
     @staticmethod
-    def draw_scroll_bar(window_surf, work_on_rect, drawing_plain_font, widget, x=0, new_line=True):
-        text_solid = drawing_plain_font.render(widget.attribute['label'], True, (0, 0, 0))
+    def draw_scroll_bar(window_surf, work_on_rect, drawing_plain_font, widget, x=0, new_line=True, text_surfaces=None):
+        text_solid = PyUIWidget.render(drawing_plain_font, widget.attribute['label'], text_surfaces)
         window_surf.blit(text_solid,
                          (work_on_rect[0] + 2 + x, work_on_rect[1] + (22 - text_solid.get_height()) // 2))
         pygame.draw.rect(window_surf, [120, 120, 120], (work_on_rect[0] + x, work_on_rect[1] + 32, 260, 2))
@@ -253,6 +570,7 @@ class ModelVisualizer:
         self.widget_enable_drawing_relation = PyUIWidget(tag='checkbox', label='Enable Drawing All Relations')
         self.widget_enable_drawing_vertex_names = PyUIWidget(tag='checkbox', label='Enable Drawing Vertex names')
         self.widget_enable_drawing_group_names = PyUIWidget(tag='checkbox', label='Enable Drawing Group names')
+        self.widget_enable_collapsing_packages = PyUIWidget(tag='checkbox', label='Enable Collapsing Far Packages')
         self.widget_width_relations = PyUIWidget(tag='scrollbar', label='Witdh Relations')
         self.widget_scale_vertex_name = PyUIWidget(tag='scrollbar', label='Scale of Vertex\'s Name')
         self.widget_scale_vertex = PyUIWidget(tag='scrollbar', label='Scale of Vertexes')
@@ -261,9 +579,26 @@ class ModelVisualizer:
         self.menu_panel_width = 300
         self.window_h = 768
         self.window_surf = None
+        self.drawing_plain_fonts = []
+        self.drawing_title_font = None
+        self.font_specs = {}
+        self.text_surfaces = TextSurfaceCache()
+        self.text_fits = None
+        # Records every primitive drawn while set, for vector output of the same frame
+        self.svg_canvas = None
+        # Phase timings of main_loop, draw_frame and the physics ticks, off until the overlay is shown (F3) or a
+        # trace is started
+        self.profiler = FrameProfiler()
 
         self.stop_loop = False
-
+        # Frames are drawn only when frame_state changes unless continuous_redraw, at most max_fps a second (0 is
+        # unlimited). While idle the loop sleeps in the event queue, waking every idle_poll_interval seconds to
+        # receive relation deltas
+        self.max_fps = 60
+        self.continuous_redraw = False
+        self.idle_poll_interval = 0.1
+
+        self.vertex_store = VertexStore()
         self.vertexes = {}
         self.top_dirs = {}
         self.relation_data = {}
@@ -272,10 +607,42 @@ class ModelVisualizer:
         self.dt = 0.0
 
         self.selected_uuid = None
+        # Relations of this top_dir are drawn as if one of its modules were selected
+        self.focused_top_dir = None
 
         self.relation_view = numpy.matlib.identity(4)
+        self.view_version = 0
+        self.projection = None
+        self.picking_grid = None
+        self.picking_rows = None
+        self.picking_grid_key = None
+        self.relation_version = 0
+        self.relation_edges = None
+        # While collapsing is on, a package is drawn as one circle while its drawn modules are on average closer
+        # than this many pixels. It is off until the checkbox or --collapse-spacing turns it on, since at the
+        # starting zoom most packages of a typical project are that dense and would hide their modules
+        self.cluster_collapse_spacing = 24
+        self.cluster_tree = None
+        self.level_of_detail = None
 
         self.max_physics_time = 40
+        self.max_delta_physics_time = 5
+        self.physics_engine = 'numpy'
+        self.barnes_hut_theta = layout_engine.BARNES_HUT_THETA
+        self.group_attract = layout_engine.SAME_GROUP_ATTRACT
+        self.edge_attract = layout_engine.EDGE_ATTRACT
+        self.layout_worker = None
+        self.layout_indexes = None
+        self.layout_generations = None
+        self.layout_snapshot_version = 0
+        self.layout_cache = None
+        self.warm_layout = False
+
+        self.module_ids_by_abs_path = {}
+        self.delta_server = None
+        self.delta_connection = None
+        self.delta_buffer = b''
+        self.delta_snapshot = None
 
         self.widgets = []
 
@@ -291,53 +658,203 @@ class ModelVisualizer:
         self.widgets.append(self.widget_width_relations)
         self.widgets.append(self.widget_enable_drawing_vertex_names)
         self.widgets.append(self.widget_enable_drawing_group_names)
+        self.widgets.append(self.widget_enable_collapsing_packages)
         self.widgets.append(self.widget_enable_drawing_relation)
         self.widgets.append(self.widget_enable_strict_select_mode)
         self.widgets.append(self.widget_title)
         self.widgets.append(self.widget_description)
 
     def analyze_model(self, file_name):
-        with open(file_name, 'r') as file:
-            self.relation_data = eval(file.read())
-            for module_id in self.relation_data:
-                relation = self.relation_data[module_id]
-                self.vertexes[module_id] = Vertex(random.uniform(-1, +1), random.uniform(-1, +1),
-                                                  random.uniform(-1, +1))
-                self.vertexes[module_id].size += len(relation['imports']) * 2
-
-                if relation['top_dir'] != '__external__':
-                    if not (relation['top_dir'] in self.top_dirs):
-                        self.top_dirs[relation['top_dir']] = {}
-                    relation['mod_name'] = relation['abs_path'] \
-                        .replace(f'/{relation["top_dir"]}/', '') \
-                        .replace('.py', '') \
-                        .replace('/', '.')
-                else:
-                    relation['mod_name'] = relation['abs_path'][len('external://'):]
-
-            k = 0
-            for top_dir in self.top_dirs:
-                if top_dir != '__external__':
-                    self.top_dirs[top_dir]['color'] = k / (len(self.top_dirs))
-                    self.top_dirs[top_dir]['pos'] = [random.uniform(-1, +1), random.uniform(-1, +1),
-                                                     random.uniform(-1, +1)]
-                    k += 1
-
-            for module_id in self.vertexes:
-                vertex = self.vertexes[module_id]
-                relation = self.relation_data[module_id]
-                for other_module_id in relation['imports']:
-                    self.vertexes[other_module_id].size += 2
-
-                if relation['top_dir'] != '__external__':
-                    top_dir = self.top_dirs[relation['top_dir']]
-                    vertex.color_h = top_dir['color']
-                    vertex.set_pos([k + random.uniform(-1e-2, +1e-2) for k in top_dir['pos']])
-                else:
-                    vertex.color_h = 0
-                    vertex.color_s = 0
-                    vertex.color_fix_v = True
-                    vertex.color_v = 0.75
+        if graph_format.is_graph_file(file_name):
+            with graph_format.GraphFile(file_name) as graph_file:
+                for node_id in range(graph_file.node_count):
+                    relation = graph_file.node(node_id)
+                    relation['imports'] = set(graph_file.imports(node_id))
+                    self.relation_data[node_id] = relation
+        else:
+            self.relation_data = graph_format.read_any_relation_map(file_name)
+
+        for module_id in self.relation_data:
+            relation = self.relation_data[module_id]
+            self.vertexes[module_id] = Vertex(random.uniform(-1, +1), random.uniform(-1, +1),
+                                              random.uniform(-1, +1), self.vertex_store)
+            self.vertexes[module_id].size += len(relation['imports']) * 2
+            self.module_ids_by_abs_path[relation['abs_path']] = module_id
+            self.prepare_relation(relation)
+
+        k = 0
+        for top_dir in self.top_dirs:
+            if top_dir != '__external__':
+                self.top_dirs[top_dir]['color'] = k / (len(self.top_dirs))
+                self.top_dirs[top_dir]['pos'] = [random.uniform(-1, +1), random.uniform(-1, +1),
+                                                 random.uniform(-1, +1)]
+                k += 1
+
+        for module_id in self.vertexes:
+            vertex = self.vertexes[module_id]
+            relation = self.relation_data[module_id]
+            for other_module_id in relation['imports']:
+                self.vertexes[other_module_id].size += 2
+
+            self.style_vertex(vertex, relation)
+        self.relation_version += 1
+
+    def seed_layout_from_cache(self):
+        positions, exact = self.layout_cache.get(layout_engine.graph_structure_hash(self.relation_data),
+                                                 self.module_ids_by_abs_path)
+        if len(positions) == 0:
+            return 0
+
+        # Groups are centred where their cached members were, so new modules of a group start next to them
+        group_sums = {}
+        for module_id, relation in self.relation_data.items():
+            if relation['abs_path'] in positions and relation['top_dir'] != '__external__':
+                group_sum = group_sums.setdefault(relation['top_dir'], [0.0, 0.0, 0.0])
+                for k in range(3):
+                    group_sum[k] += positions[relation['abs_path']][k]
+        for top_dir, group_sum in group_sums.items():
+            length = points_distance(group_sum, [0, 0, 0])
+            if length > 0:
+                self.top_dirs[top_dir]['pos'] = [k / length for k in group_sum]
+
+        seeded = 0
+        for module_id, relation in self.relation_data.items():
+            self.style_vertex(self.vertexes[module_id], relation)
+            if relation['abs_path'] in positions:
+                self.vertexes[module_id].set_pos(positions[relation['abs_path']])
+                seeded += 1
+        self.warm_layout = True
+        print(f'[Layout] {seeded} of {len(self.vertexes)} modules seeded from the layout cache'
+              f'{" (same structure)" if exact else ""}')
+        return seeded
+
+    def save_layout_to_cache(self):
+        self.layout_cache.put(layout_engine.graph_structure_hash(self.relation_data),
+                              {self.relation_data[module_id]['abs_path']: vertex.get_pos()
+                               for module_id, vertex in self.vertexes.items()})
+        self.layout_cache.save()
+
+    def prepare_relation(self, relation):
+        if relation['top_dir'] != '__external__':
+            if not (relation['top_dir'] in self.top_dirs):
+                self.top_dirs[relation['top_dir']] = {}
+            relation['mod_name'] = relation['abs_path'] \
+                .replace(f'/{relation["top_dir"]}/', '') \
+                .replace('.py', '') \
+                .replace('/', '.')
+        else:
+            relation['mod_name'] = relation['abs_path'][len('external://'):]
+
+    def style_vertex(self, vertex, relation):
+        if relation['top_dir'] != '__external__':
+            top_dir = self.top_dirs[relation['top_dir']]
+            vertex.color_h = top_dir['color']
+            vertex.set_pos([k + random.uniform(-1e-2, +1e-2) for k in top_dir['pos']])
+        else:
+            vertex.color_h = 0
+            vertex.color_s = 0
+            vertex.color_fix_v = True
+            vertex.color_v = 0.75
+
+    def start_listening(self, port):
+        self.delta_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.delta_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.delta_server.bind(('localhost', port))
+        self.delta_server.listen(1)
+        self.delta_server.setblocking(False)
+
+    def receive_relation_deltas(self):
+        if self.delta_server is None:
+            return
+        try:
+            connection, address = self.delta_server.accept()
+            if self.delta_connection:
+                self.delta_connection.close()
+            connection.setblocking(False)
+            self.delta_connection = connection
+            self.delta_buffer = b''
+        except BlockingIOError:
+            pass
+        if self.delta_connection is None:
+            return
+
+        try:
+            while True:
+                data = self.delta_connection.recv(1 << 16)
+                if len(data) == 0:
+                    self.delta_connection.close()
+                    self.delta_connection = None
+                    break
+                self.delta_buffer += data
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.delta_connection = None
+
+        if b'\n' in self.delta_buffer:
+            lines, _, self.delta_buffer = self.delta_buffer.rpartition(b'\n')
+            for line in lines.split(b'\n'):
+                self.apply_relation_delta(json.loads(line))
+            if self.delta_snapshot is None:
+                self.update_vertex_sizes()
+                if self.layout_worker is not None:
+                    # Starts slow like the ticks below, so the existing layout is kept while the new vertexes settle
+                    self.start_layout_worker(lambda tick: 1 / (4 + tick))
+                    return
+                # Only a few ticks, so the existing layout is kept and the new vertexes settle in
+                for tick in range(self.max_delta_physics_time):
+                    self.dt = 0.25
+                    self.module_physic(1 / (4 + tick))
+
+    def apply_relation_delta(self, record):
+        module_ids = self.module_ids_by_abs_path
+        self.relation_version += 1
+        if record['type'] == 'snapshot_begin':
+            self.delta_snapshot = set()
+        elif record['type'] == 'snapshot_end':
+            for abs_path in set(module_ids).difference(self.delta_snapshot):
+                self.apply_relation_delta({'type': 'remove', 'abs_path': abs_path})
+            self.delta_snapshot = None
+        elif record['type'] == 'module':
+            if self.delta_snapshot is not None:
+                self.delta_snapshot.add(record['abs_path'])
+            module_id = module_ids.get(record['abs_path'], record['abs_path'])
+            relation = self.relation_data.get(module_id, {'imports': set()})
+            for field in ('top_dir', 'mod_name', 'mod_path', 'abs_path'):
+                relation[field] = record[field]
+            self.prepare_relation(relation)
+            top_dir = self.top_dirs.get(relation['top_dir'])
+            if top_dir is not None and 'color' not in top_dir:
+                top_dir['color'] = random.uniform(0, 1)
+                top_dir['pos'] = [random.uniform(-1, +1), random.uniform(-1, +1), random.uniform(-1, +1)]
+            if module_id not in self.vertexes:
+                module_ids[record['abs_path']] = module_id
+                self.relation_data[module_id] = relation
+                self.vertexes[module_id] = Vertex(0, 0, 1, self.vertex_store)
+                self.style_vertex(self.vertexes[module_id], relation)
+        elif record['type'] == 'remove':
+            module_id = module_ids.pop(record['abs_path'], None)
+            if module_id is not None:
+                del self.relation_data[module_id]
+                self.vertex_store.release(self.vertexes.pop(module_id).index)
+                for relation in self.relation_data.values():
+                    relation['imports'].discard(module_id)
+                if self.selected_uuid == module_id:
+                    self.selected_uuid = None
+                    self.widget_title.attribute['label'] = ''
+        elif record['type'] == 'imports':
+            module_id = module_ids.get(record['abs_path'])
+            if module_id is not None:
+                self.relation_data[module_id]['imports'] = set(module_ids[abs_path] for abs_path in record['imports']
+                                                               if abs_path in module_ids)
+
+    def update_vertex_sizes(self):
+        for vertex in self.vertexes.values():
+            vertex.size = 7
+        for module_id in self.relation_data:
+            self.vertexes[module_id].size += len(self.relation_data[module_id]['imports']) * 2
+            for other_module_id in self.relation_data[module_id]['imports']:
+                self.vertexes[other_module_id].size += 2
 
     def get_selected_imports_list(self, drawing_title_font):
         relation = self.relation_data[self.selected_uuid]
@@ -359,59 +876,240 @@ class ModelVisualizer:
                     self.draw_string_and_its_outline(drawing_title_font, group_name.upper(), group_x, group_y,
                                                      color=rgb_color)
 
-    def list_drawing_circles(self, drawing_scale):
-        drawing_circles = []
-        sum_of_depth = 0
+    def project_vertexes(self, drawing_scale):
+        # Every vertex projected in one product, kept until the view, the vertex store or the scales change
         circle_scale = (self.widget_scale_vertex.attribute['scroll_value'] / 33) ** 2
-
+        key = (self.view_version, self.vertex_store.version, len(self.vertexes), drawing_scale, circle_scale)
+        if self.projection is not None and self.projection['key'] == key:
+            return self.projection
+
+        indexes = self.vertex_indexes()
+        homogeneous_positions = numpy.ones((len(indexes), 4))
+        homogeneous_positions[:, :3] = self.vertex_store.positions[indexes]
+        projected = homogeneous_positions @ numpy.asarray(self.relation_view).T
+        visible = projected[:, 2] >= 1
+        depths = projected[:, 3]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            screen_positions = numpy.where(visible[:, None], projected[:, :2] / projected[:, 2:3], numpy.nan)
+            radii = numpy.ceil(self.vertex_store.sizes[indexes] * drawing_scale / depths * circle_scale)
+            colors = self.vertex_store.colors[indexes]
+            color_fix_v = (self.vertex_store.flags[indexes] & VertexStore.FLAG_COLOR_FIX_V) != 0
+            color_v = numpy.where(color_fix_v, colors[:, 2], 0.75 + 0.25 / depths)
+        drawn = visible & (radii > 2)
+
+        self.projection = {'key': key,
+                           'module_ids': list(self.vertexes),
+                           'indexes': indexes,
+                           'rows': {module_id: row for row, module_id in enumerate(self.vertexes)},
+                           'screen_positions': screen_positions,
+                           'depths': depths,
+                           'visible': visible,
+                           'drawn': drawn,
+                           'radii': numpy.where(drawn, radii, 0).astype(numpy.int64),
+                           'colors': (hsv_to_rgb_array(colors[:, 0], colors[:, 1], color_v) * 255).astype(numpy.int64)}
+        return self.projection
+
+    def pick_vertex(self, pos):
+        # The module of the circle drawn last under pos in the last drawn frame, None over a collapsed package. The
+        # grid is rebuilt only when the projection changes.
+        projection = self.projection
+        level_of_detail = self.level_of_detail
+        if projection is None or level_of_detail is None:
+            return None
+        if self.picking_grid_key != (level_of_detail['key'], self.window_w, self.window_h):
+            self.picking_grid_key = (level_of_detail['key'], self.window_w, self.window_h)
+            shown_rows = numpy.flatnonzero(level_of_detail['shown'])
+            nodes = numpy.concatenate([shown_rows,
+                                       len(projection['rows']) + numpy.arange(len(level_of_detail['clusters']))])
+            positions = numpy.concatenate([projection['screen_positions'][shown_rows],
+                                           level_of_detail['screen_positions']])
+            radii = numpy.concatenate([projection['radii'][shown_rows], level_of_detail['radii']])
+            depths = numpy.concatenate([projection['depths'][shown_rows], level_of_detail['depths']])
+            # In drawing order, far to near like draw_frame
+            order = numpy.argsort(-depths, kind='stable')
+            self.picking_rows = nodes[order].tolist()
+            self.picking_grid = ScreenGrid(positions[order].astype(numpy.int64), radii[order], self.window_w,
+                                           self.window_h)
+        circle = self.picking_grid.pick(int(pos[0]), int(pos[1]))
+        if circle is None or self.picking_rows[circle] >= len(projection['rows']):
+            return None
+        return projection['module_ids'][self.picking_rows[circle]]
+
+    def list_clusters(self):
+        # Packages of every vertex row: the top_dir, then the packages along mod_path. levels[depth][row] is the
+        # cluster at that depth, -1 past the end of the path.
+        if self.cluster_tree is not None and self.cluster_tree['key'] == self.relation_version:
+            return self.cluster_tree
+        cluster_ids = {}
+        paths = []
         for module_id in self.vertexes:
-            vertex = self.vertexes[module_id]
-            pos_on_screen = self.vertex_position_on_screen(vertex)
-            if pos_on_screen[2] >= 1:
-                radius = int(numpy.ceil(vertex.size * drawing_scale / pos_on_screen[3] * circle_scale))
-                if radius > 2:
-                    color_v = (0.75 + 0.25 / pos_on_screen[3]) if not vertex.color_fix_v else vertex.color_v
-                    color_rgb = [int(value * 255)
-                                 for value in colorsys.hsv_to_rgb(vertex.color_h, vertex.color_s, color_v)]
-
-                    drawing_circles.append({
-                        'uuid': module_id,
-                        'color': color_rgb,
-                        'pos': (int(pos_on_screen[0]), int(pos_on_screen[1])),
-                        'radius': radius,
-                        'depth': pos_on_screen[3]
-                    })
-                sum_of_depth += pos_on_screen[3]
-        return drawing_circles, sum_of_depth
+            relation = self.relation_data[module_id]
+            if relation['top_dir'] == '__external__':
+                path = ['__external__'] + relation['abs_path'][len('external://'):].split('.')[:-1]
+            else:
+                path = [relation['top_dir']] + relation['mod_path'].split('.')[1:-1]
+            paths.append([cluster_ids.setdefault(tuple(path[:depth + 1]), len(cluster_ids))
+                          for depth in range(len(path))])
+        levels = numpy.full((max(map(len, paths), default=0), len(paths)), -1, dtype=numpy.int64)
+        for row, path in enumerate(paths):
+            levels[:len(path), row] = path
+        self.cluster_tree = {'key': self.relation_version,
+                             'clusters': list(cluster_ids),
+                             'levels': levels}
+        return self.cluster_tree
+
+    def collapse_clusters(self, drawing_scale):
+        # Every drawn module either shown or folded into the outermost package too crowded on screen, so zooming in
+        # opens packages level by level. nodes numbers the circles: the row of a shown module, the row count plus
+        # the cluster index of a folded one, -1 if not drawn.
+        projection = self.project_vertexes(drawing_scale)
+        is_enabled = self.widget_enable_collapsing_packages.attribute['is_checked']
+        key = (projection['key'], self.relation_version, is_enabled, self.cluster_collapse_spacing)
+        if self.level_of_detail is not None and self.level_of_detail['key'] == key:
+            return self.level_of_detail
+
+        drawn = projection['drawn']
+        screen_positions = projection['screen_positions']
+        representatives = numpy.full(len(drawn), -1, dtype=numpy.int64)
+        cluster_tree = self.list_clusters()
+        cluster_count = len(cluster_tree['clusters'])
+        extents = numpy.zeros(cluster_count)
+        if is_enabled:
+            lows = numpy.full((cluster_count, 2), numpy.inf)
+            highs = numpy.full((cluster_count, 2), -numpy.inf)
+            drawn_counts = numpy.zeros(cluster_count, dtype=numpy.int64)
+            for level in cluster_tree['levels']:
+                members = numpy.flatnonzero(drawn & (level >= 0))
+                numpy.minimum.at(lows, level[members], screen_positions[members])
+                numpy.maximum.at(highs, level[members], screen_positions[members])
+                drawn_counts += numpy.bincount(level[members], minlength=cluster_count)
+            # The square the modules are spread over, against the square they would need
+            with numpy.errstate(invalid='ignore'):
+                extents = (highs - lows).max(axis=1)
+                is_collapsed = (drawn_counts > 1) & (extents < self.cluster_collapse_spacing * numpy.sqrt(drawn_counts))
+            for level in cluster_tree['levels']:
+                members = numpy.flatnonzero(drawn & (representatives < 0) & (level >= 0))
+                members = members[is_collapsed[level[members]]]
+                representatives[members] = level[members]
+
+        shown = drawn & (representatives < 0)
+        folded_rows = numpy.flatnonzero(representatives >= 0)
+        clusters, cluster_of_rows = numpy.unique(representatives[folded_rows], return_inverse=True)
+        member_counts = numpy.bincount(cluster_of_rows, minlength=len(clusters))
+
+        def cluster_mean(values):
+            return numpy.bincount(cluster_of_rows, weights=values, minlength=len(clusters)) / member_counts
+
+        # As much area as the members, but no wider than the members drawn where they are
+        member_radii = projection['radii'][folded_rows]
+        largest_radii = numpy.zeros(len(clusters), dtype=numpy.int64)
+        numpy.maximum.at(largest_radii, cluster_of_rows, member_radii)
+        radii = numpy.sqrt(numpy.bincount(cluster_of_rows, weights=member_radii ** 2, minlength=len(clusters)))
+        radii = numpy.ceil(numpy.minimum(radii, extents[clusters] / 2 + largest_radii))
+
+        nodes = numpy.where(shown, numpy.arange(len(drawn)), -1)
+        nodes[folded_rows] = len(drawn) + cluster_of_rows
+        member_colors = projection['colors'][folded_rows]
+        self.level_of_detail = {
+            'key': key,
+            'shown': shown,
+            'nodes': nodes,
+            'clusters': [cluster_tree['clusters'][cluster] for cluster in clusters.tolist()],
+            'member_counts': member_counts,
+            'screen_positions': numpy.stack([cluster_mean(screen_positions[folded_rows, k]) for k in range(2)], axis=1)
+            .reshape(-1, 2),
+            'depths': cluster_mean(projection['depths'][folded_rows]),
+            'radii': radii.astype(numpy.int64),
+            'colors': numpy.stack([cluster_mean(member_colors[:, k]) for k in range(3)], axis=1)
+            .reshape(-1, 3).astype(numpy.int64)}
+        return self.level_of_detail
+
+    def list_drawing_circles(self, drawing_scale):
+        projection = self.project_vertexes(drawing_scale)
+        level_of_detail = self.collapse_clusters(drawing_scale)
+        module_ids = projection['module_ids']
+        shown = level_of_detail['shown']
+        drawing_circles = []
+        for row, position, radius, color, depth in zip(
+                numpy.flatnonzero(shown).tolist(),
+                projection['screen_positions'][shown].astype(numpy.int64).tolist(),
+                projection['radii'][shown].tolist(),
+                projection['colors'][shown].tolist(),
+                projection['depths'][shown].tolist()):
+            drawing_circles.append({
+                'uuid': module_ids[row],
+                'color': color,
+                'pos': tuple(position),
+                'radius': radius,
+                'depth': depth
+            })
+        for cluster, member_count, position, radius, color, depth in zip(
+                level_of_detail['clusters'],
+                level_of_detail['member_counts'].tolist(),
+                level_of_detail['screen_positions'].astype(numpy.int64).tolist(),
+                level_of_detail['radii'].tolist(),
+                level_of_detail['colors'].tolist(),
+                level_of_detail['depths'].tolist()):
+            drawing_circles.append({
+                'uuid': None,
+                'cluster': cluster,
+                'members': member_count,
+                'color': color,
+                'pos': tuple(position),
+                'radius': radius,
+                'depth': depth
+            })
+        # Averaged over the modules drawn before collapsing, so collapsing does not change which names are drawn
+        average_of_depth = float(projection['depths'][projection['visible']].sum()) / \
+            max(1, numpy.count_nonzero(projection['drawn']))
+        return drawing_circles, average_of_depth
 
     def draw_circles_and_get_circle_groups(self, drawing_circles, average_of_depth, drawing_plain_fonts):
         drawing_groups = {}
         circle_scale = (self.widget_scale_vertex.attribute['scroll_value'] / 33) ** 2
         name_scale = (self.widget_scale_vertex_name.attribute['scroll_value'] / 33) ** 2
 
+        selected_cluster = None
+        if self.selected_uuid in self.projection['rows']:
+            selected_node = self.level_of_detail['nodes'][self.projection['rows'][self.selected_uuid]]
+            if selected_node >= len(self.projection['rows']):
+                selected_cluster = self.level_of_detail['clusters'][selected_node - len(self.projection['rows'])]
+
+        surface_width, surface_height = self.window_surf.get_size()
         for circle in drawing_circles:
-            if circle['uuid'] == self.selected_uuid:
-                pygame.draw.circle(self.window_surf, [0, 0, 0], circle['pos'], circle['radius'] + 3)
+            if circle['uuid'] is None:
+                is_selected = circle['cluster'] == selected_cluster
             else:
-                pygame.draw.circle(self.window_surf, [0, 0, 0], circle['pos'], circle['radius'] + 1)
-            pygame.draw.circle(self.window_surf, circle['color'], circle['pos'], circle['radius'])
+                is_selected = circle['uuid'] == self.selected_uuid
+            # Circles off the window are skipped, outline included
+            x, y = circle['pos']
+            reach = circle['radius'] + 4
+            if -reach < x < surface_width + reach and -reach < y < surface_height + reach:
+                outline_radius = circle['radius'] + (3 if is_selected else 1)
+                pygame.draw.circle(self.window_surf, [0, 0, 0], circle['pos'], outline_radius)
+                pygame.draw.circle(self.window_surf, circle['color'], circle['pos'], circle['radius'])
+                if self.svg_canvas is not None:
+                    self.svg_canvas.circle([0, 0, 0], circle['pos'], outline_radius)
+                    self.svg_canvas.circle(circle['color'], circle['pos'], circle['radius'])
 
             if circle['depth'] < average_of_depth:
                 if self.widget_enable_drawing_vertex_names.attribute['is_checked']:
-                    lines = [line.strip() for line in self.relation_data[circle['uuid']]['mod_name'].split('.') if len(line.strip()) > 0]
+                    if circle['uuid'] is None:
+                        lines = [circle['cluster'][-1], f'({circle["members"]})']
+                    else:
+                        lines = [line.strip() for line in self.relation_data[circle['uuid']]['mod_name'].split('.') if len(line.strip()) > 0]
                     is_multilines = len(lines) > 1
                     if is_multilines:
-                        fit_size, line_height = get_fit_size_of_mutipleline_text_for_circle(drawing_plain_fonts, lines,
-                                                                                            circle[
-                                                                                                'radius'] * name_scale * circle_scale)
+                        fit_size, line_height = self.text_fits.fit_size_of_mutipleline_text_for_circle(
+                            lines, circle['radius'] * name_scale * circle_scale)
                         for y_index, line in enumerate(lines):
                             y_proportion = (y_index / (len(lines) - 1) - 0.5) * 2
                             self.draw_string_and_its_outline(drawing_plain_fonts[fit_size], line, circle['pos'][0],
                                                              circle['pos'][1] + line_height * y_proportion)
                     else:
                         line = lines[0]
-                        fit_size = get_fit_size_of_singleline_for_circle(drawing_plain_fonts, line,
-                                                                         circle['radius'] * name_scale * circle_scale)
+                        fit_size = self.text_fits.fit_size_of_singleline_for_circle(
+                            line, circle['radius'] * name_scale * circle_scale)
                         self.draw_string_and_its_outline(drawing_plain_fonts[fit_size], line, circle['pos'][0],
                                                          circle['pos'][1])
                 self.insert_vertex_to_groups(circle, drawing_groups)
@@ -425,31 +1123,37 @@ class ModelVisualizer:
         self.window_surf.blit(text_solid, (x - text_solid.get_width() // 2, y - text_solid.get_height() // 2))
 
     def draw_string_and_its_outline(self, drawing_font, text, x, y, color=[255, 255, 255]):
-        text_shadow = drawing_font.render(text, True, (0, 0, 0))
-        text_solid = drawing_font.render(text, True, color)
-        self.window_surf.blit(text_shadow,
-                              (x + 1 - text_shadow.get_width() // 2, y + 1 - text_shadow.get_height() // 2))
-        self.window_surf.blit(text_shadow,
-                              (x + 1 - text_shadow.get_width() // 2, y - 1 - text_shadow.get_height() // 2))
-        self.window_surf.blit(text_shadow,
-                              (x - 1 - text_shadow.get_width() // 2, y + 1 - text_shadow.get_height() // 2))
-        self.window_surf.blit(text_shadow,
-                              (x - 1 - text_shadow.get_width() // 2, y - 1 - text_shadow.get_height() // 2))
-        self.window_surf.blit(text_solid, (x - text_solid.get_width() // 2, y - text_solid.get_height() // 2))
+        # Font.size is the rendered size, so texts off the window are neither rendered nor blitted
+        text_width, text_height = drawing_font.size(text)
+        left = x - 1 - text_width // 2
+        top = y - 1 - text_height // 2
+        surface_width, surface_height = self.window_surf.get_size()
+        if left + text_width + 3 < 0 or top + text_height + 3 < 0 or left > surface_width or top > surface_height:
+            return
+        text_outlined = self.text_surfaces.outlined_text(drawing_font, text, color)
+        self.window_surf.blit(text_outlined, (left, top))
+        if self.svg_canvas is not None:
+            family, size = self.font_specs[drawing_font]
+            self.svg_canvas.text(family, size, text, x, y, color)
 
     def insert_vertex_to_groups(self, circle, drawing_groups):
-        info = self.relation_data[circle['uuid']]
-        if info['top_dir'] != '__external__':
-            if not (info['top_dir'] in drawing_groups):
+        if circle['uuid'] is None:
+            top_dir = circle['cluster'][0]
+            member = circle['cluster']
+        else:
+            top_dir = self.relation_data[circle['uuid']]['top_dir']
+            member = circle['uuid']
+        if top_dir != '__external__':
+            if not (top_dir in drawing_groups):
                 group = {}
                 group['members'] = []
                 group['pos'] = [[], []]
-                group['color_h'] = self.top_dirs[info['top_dir']]['color']
-                drawing_groups[info['top_dir']] = group
+                group['color_h'] = self.top_dirs[top_dir]['color']
+                drawing_groups[top_dir] = group
 
-            drawing_groups[info['top_dir']]['members'].append(circle['uuid'])
+            drawing_groups[top_dir]['members'].append(member)
             for k in range(2):
-                drawing_groups[info['top_dir']]['pos'][k].append(circle['pos'][k])
+                drawing_groups[top_dir]['pos'][k].append(circle['pos'][k])
 
     def vertex_position_on_screen(self, vertex):
         tpos = self.relation_view.dot([vertex.x, vertex.y, vertex.z, 1]).tolist()[0]
@@ -467,35 +1171,77 @@ class ModelVisualizer:
                 if A != B:
                     callback(A, B, RelationInfo(self, A, B))
 
-    def draw_relations(self, drawing_circles):
-        lines = []
-        for A in drawing_circles:
-            for B in drawing_circles:
-                if A['uuid'] != B['uuid']:
-                    info = RelationInfo(self, A['uuid'], B['uuid'])
-                    if self.widget_enable_strict_select_mode.attribute['is_checked']:
-                        suppose_to_draw_relation = (A['uuid'] == self.selected_uuid or B['uuid'] == self.selected_uuid)
-                    else:
-                        if self.selected_uuid:
-                            suppose_to_draw_relation = \
-                                info.detail_a['top_dir'] == self.relation_data[self.selected_uuid]['top_dir'] \
-                                or info.detail_b['top_dir'] == self.relation_data[self.selected_uuid]['top_dir']
-                        else:
-                            suppose_to_draw_relation = self.widget_enable_drawing_relation.attribute['is_checked']
-                    if info.a_import_b and (not info.is_a_external) and suppose_to_draw_relation:
-                        a_2d_pos = self.vertex_position_on_screen(info.vertex_a)
-                        b_2d_pos = self.vertex_position_on_screen(info.vertex_b)
-                        if a_2d_pos[2] >= 1 and b_2d_pos[2] >= 1:
-                            lines.append({
-                                'color': [255 * k for k in
-                                              colorsys.hsv_to_rgb(info.vertex_a.color_h, info.vertex_a.color_s, 1)],
-                                'start_pos':(int(a_2d_pos[0]), int(a_2d_pos[1])),
-                                'end_pos':(int(b_2d_pos[0]), int(b_2d_pos[1])),
-                            })
-
+    def list_relation_edges(self):
+        # Import edges as rows of the vertex order, sorted like the old pair by pair scan drew them
+        if self.relation_edges is not None and self.relation_edges['key'] == self.relation_version:
+            return self.relation_edges
+        rows = {module_id: row for row, module_id in enumerate(self.vertexes)}
+        edges = sorted((rows[module_id], rows[other_id]) for module_id, relation in self.relation_data.items()
+                       if relation['top_dir'] != '__external__'
+                       for other_id in relation['imports'] if other_id in rows and other_id != module_id)
+        edges = numpy.array(edges, dtype=numpy.int64).reshape(-1, 2)
+        group_ids = {}
+        groups = numpy.array([group_ids.setdefault(self.relation_data[module_id]['top_dir'], len(group_ids))
+                              for module_id in self.vertexes], dtype=numpy.int64)
+        self.relation_edges = {'key': self.relation_version,
+                               'from_rows': edges[:, 0],
+                               'to_rows': edges[:, 1],
+                               'from_groups': groups[edges[:, 0]],
+                               'to_groups': groups[edges[:, 1]],
+                               'group_ids': group_ids}
+        return self.relation_edges
+
+    def draw_relations(self, drawing_scale):
+        relation_edges = self.list_relation_edges()
+        projection = self.project_vertexes(drawing_scale)
+        level_of_detail = self.collapse_clusters(drawing_scale)
+        from_rows = relation_edges['from_rows']
+        to_rows = relation_edges['to_rows']
+
+        if self.widget_enable_strict_select_mode.attribute['is_checked']:
+            selected_row = projection['rows'].get(self.selected_uuid, -1)
+            selected = (from_rows == selected_row) | (to_rows == selected_row)
+        elif self.selected_uuid is not None or self.focused_top_dir is not None:
+            if self.selected_uuid is not None:
+                selected_group = relation_edges['group_ids'][self.relation_data[self.selected_uuid]['top_dir']]
+            else:
+                selected_group = relation_edges['group_ids'].get(self.focused_top_dir, -1)
+            selected = (relation_edges['from_groups'] == selected_group) | (relation_edges['to_groups'] == selected_group)
+        elif self.widget_enable_drawing_relation.attribute['is_checked']:
+            selected = numpy.ones(len(from_rows), dtype=bool)
+        else:
+            return
+        # Edges of collapsed packages join their circles, one line per pair of circles thickening with its edges
+        from_nodes = level_of_detail['nodes'][from_rows]
+        to_nodes = level_of_detail['nodes'][to_rows]
+        edge_indexes = numpy.flatnonzero(selected & (from_nodes >= 0) & (to_nodes >= 0) & (from_nodes != to_nodes))
+        edge_counts = numpy.ones(len(edge_indexes), dtype=numpy.int64)
+        if len(level_of_detail['clusters']) > 0:
+            node_count = len(level_of_detail['nodes']) + len(level_of_detail['clusters'])
+            _, first_indexes, edge_counts = numpy.unique(
+                from_nodes[edge_indexes] * node_count + to_nodes[edge_indexes], return_index=True, return_counts=True)
+            order = numpy.argsort(first_indexes)
+            edge_indexes = edge_indexes[first_indexes[order]]
+            edge_counts = edge_counts[order]
+        from_rows = from_rows[edge_indexes]
+        node_positions = numpy.concatenate([projection['screen_positions'], level_of_detail['screen_positions']])
+
+        # Segments with both ends past the same side of the window can not cross it
+        start_positions = node_positions[from_nodes[edge_indexes]].astype(numpy.int64)
+        end_positions = node_positions[to_nodes[edge_indexes]].astype(numpy.int64)
+        surface_size = numpy.array(self.window_surf.get_size())
+        on_screen = ~(((start_positions < 0) & (end_positions < 0)).any(axis=1) |
+                      ((start_positions >= surface_size) & (end_positions >= surface_size)).any(axis=1))
+
+        vertex_colors = self.vertex_store.colors[projection['indexes'][from_rows[on_screen]]]
+        colors = hsv_to_rgb_array(vertex_colors[:, 0], vertex_colors[:, 1], numpy.ones(len(vertex_colors))) * 255
         width = int(self.widget_width_relations.attribute['scroll_value'] ** 2 / 33 / 33)
-        for line in lines:
-            pygame.draw.line(self.window_surf, line['color'], line['start_pos'], line['end_pos'], width)
+        widths = width + numpy.log2(edge_counts[on_screen]).astype(numpy.int64)
+        for color, start_pos, end_pos, line_width in zip(colors.tolist(), start_positions[on_screen].tolist(),
+                                                         end_positions[on_screen].tolist(), widths.tolist()):
+            pygame.draw.line(self.window_surf, color, start_pos, end_pos, line_width)
+            if self.svg_canvas is not None:
+                self.svg_canvas.line(color, start_pos, end_pos, line_width)
 
     def listen_event_user_interface(self, event):
         if event.type == pygame.locals.MOUSEBUTTONDOWN or event.type == pygame.locals.MOUSEBUTTONUP or event.type == pygame.locals.MOUSEMOTION:
@@ -529,17 +1275,22 @@ class ModelVisualizer:
 
         for widget in self.widgets:
             if widget.tag == 'checkbox':
-                PyUIWidget.draw_checkbox(self.window_surf, work_on_rect, drawing_plain_font, widget)
+                PyUIWidget.draw_checkbox(self.window_surf, work_on_rect, drawing_plain_font, widget,
+                                         text_surfaces=self.text_surfaces)
             elif widget.tag == 'scrollbar':
-                PyUIWidget.draw_scroll_bar(self.window_surf, work_on_rect, drawing_plain_font, widget)
+                PyUIWidget.draw_scroll_bar(self.window_surf, work_on_rect, drawing_plain_font, widget,
+                                           text_surfaces=self.text_surfaces)
             elif widget.tag == 'label':
-                PyUIWidget.draw_label(self.window_surf, work_on_rect, drawing_plain_font, widget)
+                PyUIWidget.draw_label(self.window_surf, work_on_rect, drawing_plain_font, widget,
+                                      text_surfaces=self.text_surfaces)
             elif widget.tag == 'title':
-                PyUIWidget.draw_label(self.window_surf, work_on_rect, drawing_plain_font, widget)
+                PyUIWidget.draw_label(self.window_surf, work_on_rect, drawing_plain_font, widget,
+                                      text_surfaces=self.text_surfaces)
             elif widget.tag == 'text':
-                PyUIWidget.draw_text(self.window_surf, work_on_rect, drawing_plain_font, widget)
+                PyUIWidget.draw_text(self.window_surf, work_on_rect, drawing_plain_font, widget,
+                                     text_surfaces=self.text_surfaces)
 
-        if self.selected_uuid:
+        if self.selected_uuid is not None:
             self.widget_description.attribute['text'] = self.get_selected_imports_list(drawing_title_font)
         else:
             self.widget_description.attribute['text'] = ''
@@ -548,7 +1299,7 @@ class ModelVisualizer:
         if info.equal_top_dir:
             if not (info.is_a_external or info.is_b_external):
                 if info.vector_a_to_b_length > 0.6:
-                    factor = 0.0 * (info.vector_a_to_b_length - 0.6)
+                    factor = self.group_attract * (info.vector_a_to_b_length - 0.6)
                     info.vertex_a.add_force([+k * self.dt * factor for k in info.vector_a_to_b])
                     info.vertex_b.add_force([-k * self.dt * factor for k in info.vector_a_to_b])
                 elif info.vector_a_to_b_length < 0.2:
@@ -564,6 +1315,10 @@ class ModelVisualizer:
                 info.vertex_b.add_force([-k * self.dt * factor for k in info.vector_a_to_b])
 
     def module_physic(self, physics_speed):
+        if self.physics_engine != 'python':
+            self.module_physic_vectorized(physics_speed)
+            return
+
         self.each_relation(self.working_between_relations)
 
         for vertex in self.vertexes.values():
@@ -575,12 +1330,89 @@ class ModelVisualizer:
             if length != 1:
                 vertex.set_pos([vertex.get_pos()[k] / length for k in range(3)])
 
+    def vertex_indexes(self):
+        return numpy.fromiter((vertex.index for vertex in self.vertexes.values()), dtype=numpy.int64,
+                              count=len(self.vertexes))
+
+    def build_layout(self, indexes):
+        # Same rules as working_between_relations on arrays, for all pairs at once or through octrees (barnes-hut)
+        group_ids = {}
+        groups = [group_ids.setdefault(self.relation_data[module_id]['top_dir'], len(group_ids))
+                  for module_id in self.vertexes]
+        externals = [self.relation_data[module_id]['top_dir'] == '__external__' for module_id in self.vertexes]
+        positions = self.vertex_store.positions[indexes]
+        velocities = self.vertex_store.velocities[indexes]
+        rows = {module_id: row for row, module_id in enumerate(self.vertexes)}
+        edges = [(rows[module_id], rows[other_id]) for module_id in self.vertexes
+                 for other_id in self.relation_data[module_id]['imports'] if other_id in rows]
+        if self.physics_engine == 'barnes-hut':
+            layout = layout_engine.BarnesHutLayout(positions, velocities, groups, externals, edges,
+                                                   self.barnes_hut_theta, self.group_attract, self.edge_attract)
+        else:
+            layout = layout_engine.ForceLayout(positions, velocities, groups, externals, edges, self.group_attract,
+                                               self.edge_attract)
+        return layout
+
+    def store_layout(self, indexes, generations, positions, velocities=None):
+        # Slots freed or taken by another vertex since the layout started have a new generation and are skipped
+        alive = self.vertex_store.generations[indexes] == generations
+        self.vertex_store.positions[indexes[alive]] = positions[alive]
+        if velocities is not None:
+            self.vertex_store.velocities[indexes[alive]] = velocities[alive]
+        self.vertex_store.version += 1
+
+    def module_physic_vectorized(self, physics_speed):
+        indexes = self.vertex_indexes()
+        layout = self.build_layout(indexes)
+        layout.tick(self.dt, physics_speed)
+        self.vertex_store.positions[indexes] = layout.positions
+        self.vertex_store.velocities[indexes] = layout.velocities
+        self.vertex_store.version += 1
+
+    def start_layout_worker(self, physics_speed_of=None):
+        # The default schedule continues prepare_vertex_position past its ticks until the layout settles
+        if physics_speed_of is None:
+            physics_speed_of = (lambda tick: 1 / (4 + tick)) if self.warm_layout else (lambda tick: 1 / (1 + tick / 4))
+        self.stop_layout_worker()
+        self.layout_indexes = self.vertex_indexes()
+        self.layout_generations = self.vertex_store.generations[self.layout_indexes]
+        self.layout_snapshot_version = 0
+        self.layout_worker = layout_engine.LayoutWorker(
+            self.build_layout(self.layout_indexes), physics_speed_of,
+            on_tick=lambda start, end: self.profiler.record('layout_tick', start, end, 'physics'))
+        self.layout_worker.start()
+
+    def stop_layout_worker(self):
+        if self.layout_worker is None:
+            return
+        self.layout_worker.stop()
+        self.store_layout(self.layout_indexes, self.layout_generations, self.layout_worker.layout.positions,
+                          self.layout_worker.layout.velocities)
+        self.layout_worker = None
+
+    def apply_layout_snapshot(self):
+        if self.layout_worker is None or self.layout_worker.snapshot_version == self.layout_snapshot_version:
+            return False
+        self.layout_snapshot_version = self.layout_worker.snapshot_version
+        self.store_layout(self.layout_indexes, self.layout_generations, self.layout_worker.snapshot)
+        return True
+
     def prepare_vertex_position(self):
+        if self.warm_layout:
+            # Seeded from the layout cache; a few slow ticks settle the modules that were not cached
+            for tick in range(self.max_delta_physics_time):
+                self.dt = 0.25
+                with self.profiler.measure('physics_tick', 'physics'):
+                    self.module_physic(1 / (4 + tick))
+            return
+
         for tick in range(self.max_physics_time):
             self.dt = 0.25
-            self.module_physic(1 / (1 + tick / 4))
+            with self.profiler.measure('physics_tick', 'physics'):
+                self.module_physic(1 / (1 + tick / 4))
 
     def caculate_drawing_view(self, rotation_view, drawing_scale):
+        self.view_version += 1
         self.relation_view = numpy.matlib.identity(4)
         self.relation_view *= matrix_translate((self.window_w - self.menu_panel_width) // 2, self.window_h // 2)
         self.relation_view *= homogeneous_coordinates_matrix()
@@ -590,35 +1422,170 @@ class ModelVisualizer:
         self.relation_view *= matrix_translate(0, 0, 2)
         self.relation_view *= rotation_view
 
-    def main_loop(self):
+    def create_window(self):
         pygame.init()
         pygame.display.set_caption('Model Visualizer')
 
         self.window_surf = pygame.display.set_mode((self.window_w, self.window_h), pygame.RESIZABLE)
-
-        drawing_plain_fonts = []
-        drawing_title_font = pygame.font.SysFont("Seogu UI", 32)
+        self.create_fonts()
+
+    def create_offscreen_surface(self, width, height, font_source=None):
+        # Draws into memory without a display or a window
+        pygame.font.init()
+        self.window_w = width
+        self.window_h = height
+        self.window_surf = pygame.Surface((width, height))
+        self.create_fonts(font_source)
+
+    def create_fonts(self, source=None):
+        # Fonts and their caches, taken from another visualizer when given so a batch loads them once
+        if source is not None:
+            self.drawing_plain_fonts = source.drawing_plain_fonts
+            self.drawing_title_font = source.drawing_title_font
+            self.font_specs = source.font_specs
+            self.text_surfaces = source.text_surfaces
+            self.text_fits = source.text_fits
+            return
+
+        self.drawing_plain_fonts = []
+        self.drawing_title_font = pygame.font.SysFont("Seogu UI", 32)
+        self.font_specs = {self.drawing_title_font: ("Seogu UI", 32)}
         for _ in range(48):
-            drawing_plain_fonts.append(pygame.font.SysFont("Consolas", 10 + _))
+            self.drawing_plain_fonts.append(pygame.font.SysFont("Consolas", 10 + _))
+            self.font_specs[self.drawing_plain_fonts[-1]] = ("Consolas", 10 + _)
+        self.text_fits = TextFitCache(self.drawing_plain_fonts)
+
+    def draw_frame(self, drawing_scale, phase_times=None, draw_interface=True):
+        phase_start = [time.perf_counter()]
+        profiler = self.profiler if self.profiler.recording else None
+
+        def end_phase(name):
+            if phase_times is not None or profiler is not None:
+                phase_end = time.perf_counter()
+                if phase_times is not None:
+                    phase_times[name] = phase_times.get(name, 0.0) + phase_end - phase_start[0]
+                if profiler is not None:
+                    profiler.record(name, phase_start[0], phase_end)
+                phase_start[0] = phase_end
+
+        self.window_surf.fill((224, 235, 246))
+        if self.svg_canvas is not None:
+            self.svg_canvas.fill((224, 235, 246))
+        end_phase('fill')
+
+        drawing_circles, average_circle_depth = self.list_drawing_circles(drawing_scale)
+        end_phase('list_drawing_circles')
+
+        if self.widget_width_relations.attribute['scroll_value'] >= 33:
+            self.draw_relations(drawing_scale)
+        end_phase('draw_relations')
+
+        drawing_circles.sort(key=lambda x: x['depth'], reverse=True)
+        drawing_groups = self.draw_circles_and_get_circle_groups(drawing_circles, average_circle_depth,
+                                                                 self.drawing_plain_fonts)
+        end_phase('draw_circles_and_get_circle_groups')
+
+        if self.widget_enable_drawing_group_names.attribute['is_checked']:
+            self.draw_groups(drawing_groups, self.drawing_title_font)
+        end_phase('draw_groups')
+
+        if draw_interface:
+            self.draw_user_interfaces(self.drawing_plain_fonts[4], self.drawing_title_font)
+        end_phase('draw_user_interfaces')
+
+        if self.profiler.show_overlay:
+            self.draw_profiler_overlay(self.drawing_plain_fonts[4])
+        return drawing_circles
+
+    def draw_profiler_overlay(self, drawing_plain_font):
+        # Rolling p50 and p99 of every phase in the top left corner; the numbers change every frame, so the rows
+        # are rendered directly instead of through the text cache
+        percentiles = self.profiler.percentiles()
+        rows = [('phase', 'p50 ms', 'p99 ms')]
+        for name, (p50, p99, _) in percentiles.items():
+            rows.append((name, f'{p50 * 1000:.2f}', f'{p99 * 1000:.2f}'))
+        if 'frame' in percentiles:
+            rows.append(('fps at p50', f'{1 / max(percentiles["frame"][0], 1e-6):.1f}', ''))
+        surfaces = [[drawing_plain_font.render(text, True, (0, 0, 0)) for text in row] for row in rows]
+        column_widths = [max(row[column].get_width() for row in surfaces) + 12 for column in range(3)]
+        line_height = drawing_plain_font.get_linesize()
+        panel_rect = (4, 4, sum(column_widths) + 8, line_height * len(rows) + 8)
+        pygame.draw.rect(self.window_surf, [240, 240, 240], panel_rect)
+        pygame.draw.rect(self.window_surf, [153, 180, 209], panel_rect, 1)
+        for index, row in enumerate(surfaces):
+            y = 8 + index * line_height
+            self.window_surf.blit(row[0], (10, y))
+            # Numbers are aligned to the right edge of their column
+            x = 10 + column_widths[0]
+            for column in (1, 2):
+                x += column_widths[column]
+                self.window_surf.blit(row[column], (x - 12 - row[column].get_width(), y))
+
+    def frame_state(self):
+        # Everything a frame is drawn from
+        return (self.view_version, self.vertex_store.version, self.relation_version, self.selected_uuid,
+                self.profiler.show_overlay, [sorted(widget.attribute.items()) for widget in self.widgets])
+
+    @staticmethod
+    def wait_events(timeout):
+        # Pending events, waiting up to timeout seconds for the first one, forever if None
+        if timeout is not None and timeout <= 0:
+            return pygame.event.get()
+        event = pygame.event.wait(0 if timeout is None else math.ceil(timeout * 1000))
+        if event.type == pygame.NOEVENT:
+            return pygame.event.get()
+        return [event] + pygame.event.get()
+
+    def main_loop(self):
+        self.create_window()
 
         rotation_view = numpy.matlib.identity(4)
 
         drawing_scale = 1
-        drawing_circles = []
 
         self.caculate_drawing_view(rotation_view, drawing_scale)
 
-        timer_start = datetime.datetime.now()
+        frame_interval = 1 / self.max_fps if self.max_fps > 0 else 0
+        drawn_frame_state = None
+        next_frame_time = timer_start = time.perf_counter()
         while not self.stop_loop:
-            timer_end = datetime.datetime.now()
-            timer_duration = timer_end - timer_start
-            self.dt = timer_duration.microseconds / 1000000
-            self.t += self.dt
-            timer_start = datetime.datetime.now()
+            with self.profiler.measure('receive_relation_deltas', 'loop'):
+                self.receive_relation_deltas()
+            with self.profiler.measure('apply_layout_snapshot', 'loop'):
+                self.apply_layout_snapshot()
+
+            frame_state = self.frame_state()
+            is_redraw_pending = self.continuous_redraw or frame_state != drawn_frame_state
+            timer_end = time.perf_counter()
+            if is_redraw_pending and timer_end >= next_frame_time:
+                self.dt = timer_end - timer_start
+                self.t += self.dt
+                timer_start = timer_end
+                next_frame_time = timer_end + frame_interval
+
+                with self.profiler.measure('frame'):
+                    self.draw_frame(drawing_scale)
+                    with self.profiler.measure('display_flip'):
+                        pygame.display.flip()
+                drawn_frame_state = frame_state
+                is_redraw_pending = self.continuous_redraw
+
+            if is_redraw_pending:
+                timeout = next_frame_time - time.perf_counter()
+            elif self.layout_worker is not None and self.layout_worker.is_alive():
+                timeout = frame_interval
+            elif self.delta_server is not None:
+                timeout = self.idle_poll_interval
+            else:
+                timeout = None
 
-            for event in pygame.event.get():
+            events = self.wait_events(timeout)
+            event_start = time.perf_counter()
+            for event in events:
                 if event.type == pygame.locals.QUIT:
                     self.stop_loop = True
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    drawn_frame_state = None
                 elif event.type == pygame.VIDEORESIZE:
                     if event.w != self.window_w or event.h != self.window_h:
                         self.window_w = event.w
@@ -626,7 +1593,8 @@ class ModelVisualizer:
                         self.window_surf = pygame.display.set_mode((self.window_w, self.window_h), pygame.RESIZABLE)
                         self.caculate_drawing_view(rotation_view, drawing_scale)
                 elif event.type == pygame.locals.KEYDOWN:
-                    pass
+                    if event.key == pygame.locals.K_F3:
+                        self.profiler.toggle_overlay()
                 elif self.listen_event_user_interface(event):
                     pass
                 elif event.type == pygame.locals.MOUSEMOTION:
@@ -638,14 +1606,10 @@ class ModelVisualizer:
                         self.caculate_drawing_view(rotation_view, drawing_scale)
                 elif event.type == pygame.locals.MOUSEBUTTONDOWN:
                     if event.button == 3:
-                        self.selected_uuid = None
+                        self.selected_uuid = self.pick_vertex(event.pos)
                         self.widget_title.attribute['label'] = ''
-                        for circle in reversed(drawing_circles):
-                            if points_distance([circle['pos'][0], circle['pos'][1], 0], [event.pos[0], event.pos[1], 0]) \
-                                    <= circle['radius']:
-                                self.selected_uuid = circle['uuid']
-                                self.widget_title.attribute['label'] = self.relation_data[circle['uuid']]['mod_path'].replace('external://', '')
-                                break
+                        if self.selected_uuid is not None:
+                            self.widget_title.attribute['label'] = self.relation_data[self.selected_uuid]['mod_path'].replace('external://', '')
                     elif event.button == 4:
                         drawing_scale *= 1.1
                         if drawing_scale > 5:
@@ -656,42 +1620,80 @@ class ModelVisualizer:
                         if drawing_scale < 0.5:
                             drawing_scale = 0.5
                         self.caculate_drawing_view(rotation_view, drawing_scale)
-
-            self.window_surf.fill((224, 235, 246))
-
-            drawing_circles, sum_of_depth = self.list_drawing_circles(drawing_scale)
-
-            if self.widget_width_relations.attribute['scroll_value'] >= 33:
-                self.draw_relations(drawing_circles)
-
-    
-            drawing_circles.sort(key=lambda x: x['depth'], reverse=True)
-            average_circle_depth = sum_of_depth / len(drawing_circles)
-            drawing_groups = self.draw_circles_and_get_circle_groups(drawing_circles, average_circle_depth,
-                                                                     drawing_plain_fonts)
-
-            if self.widget_enable_drawing_group_names.attribute['is_checked']:
-                self.draw_groups(drawing_groups, drawing_title_font)
-
-            self.draw_user_interfaces(drawing_plain_fonts[4], drawing_title_font)
-            pygame.display.flip()
+            if events:
+                self.profiler.record('handle_events', event_start, time.perf_counter(), 'loop')
+        self.stop_layout_worker()
         pygame.quit()
 
 
 if __name__ == '__main__':
-    if len(sys.argv) <= 1:
-        print('Number of arguments is wrong.')
-        print(f'python {sys.argv[0]} [INPUT_FILE_NAME]')
-    else:
-        print('[Start]Createing_Visualizer')
-        model_visualizer = ModelVisualizer()
-
-        print('[Start]Analyze Model')
-        model_visualizer.analyze_model(sys.argv[1])
-
+    parser = argparse.ArgumentParser(usage=f'python {sys.argv[0]} [INPUT_FILE_NAME]')
+    parser.add_argument('input_file')
+    parser.add_argument('--listen', nargs='?', const=graph_format.DELTA_PORT, type=int,
+                        help=f'accept relation deltas from project_watcher.py --push '
+                             f'(default port {graph_format.DELTA_PORT})')
+    parser.add_argument('--physics', choices=layout_engine.PHYSICS_ENGINES, default='numpy',
+                        help='layout engine, python is the original pair by pair loop')
+    parser.add_argument('--blocking-layout', action='store_true',
+                        help='lay out before the window opens instead of in the background')
+    parser.add_argument('--layout-cache', help='start from and save the converged layout in this file')
+    parser.add_argument('--theta', type=float, default=layout_engine.BARNES_HUT_THETA,
+                        help='Barnes-Hut opening angle, 0 is exact and larger values are faster')
+    parser.add_argument('--group-attract', type=float, default=layout_engine.SAME_GROUP_ATTRACT,
+                        help='pull between modules of one top_dir further apart than 0.6, 0 is off')
+    parser.add_argument('--edge-attract', type=float, default=layout_engine.EDGE_ATTRACT,
+                        help='spring constant pulling every module towards its imports, 0 is off '
+                             '(numpy and barnes-hut layouts)')
+    parser.add_argument('--fps', type=int, default=60, help='frame rate cap, 0 is unlimited')
+    parser.add_argument('--collapse-spacing', type=float,
+                        help='start with collapsing on, drawing a package as one circle while its modules are closer '
+                             'than this many pixels (off by default, 24 when turned on from the checkbox)')
+    parser.add_argument('--continuous-redraw', action='store_true',
+                        help='redraw every frame instead of only when the view, selection, widgets or layout change')
+    parser.add_argument('--profile', action='store_true',
+                        help='show the phase timings overlay from the start, F3 toggles it')
+    parser.add_argument('--profile-trace',
+                        help='write the timings of every phase and layout tick to this Chrome trace file')
+    args = parser.parse_args()
+
+    print('[Start]Createing_Visualizer')
+    model_visualizer = ModelVisualizer()
+    model_visualizer.physics_engine = args.physics
+    model_visualizer.barnes_hut_theta = args.theta
+    model_visualizer.group_attract = args.group_attract
+    model_visualizer.edge_attract = args.edge_attract
+    model_visualizer.max_fps = args.fps
+    model_visualizer.continuous_redraw = args.continuous_redraw
+    if args.collapse_spacing:
+        model_visualizer.cluster_collapse_spacing = args.collapse_spacing
+        model_visualizer.widget_enable_collapsing_packages.attribute['is_checked'] = True
+    if args.profile:
+        model_visualizer.profiler.toggle_overlay()
+    if args.profile_trace:
+        model_visualizer.profiler.start_trace()
+
+    print('[Start]Analyze Model')
+    model_visualizer.analyze_model(args.input_file)
+    if args.layout_cache:
+        model_visualizer.layout_cache = layout_engine.LayoutCache(args.layout_cache)
+        model_visualizer.seed_layout_from_cache()
+
+    if args.physics == 'python' or args.blocking_layout:
         print('[Start]Prepare Model Visualizer')
         model_visualizer.prepare_vertex_position()
-
-        print('[Start]Main Loop')
-        model_visualizer.main_loop()
-        print('[Finish]')
+    else:
+        print('[Start]Layout in background')
+        model_visualizer.start_layout_worker()
+
+    if args.listen:
+        print(f'[Start]Listen for relation deltas on port {args.listen}')
+        model_visualizer.start_listening(args.listen)
+
+    print('[Start]Main Loop')
+    model_visualizer.main_loop()
+    if model_visualizer.layout_cache is not None:
+        model_visualizer.save_layout_to_cache()
+    if args.profile_trace:
+        event_count = model_visualizer.profiler.save_trace(args.profile_trace)
+        print(f'[Profile] {event_count} events written to {args.profile_trace}')
+    print('[Finish]')
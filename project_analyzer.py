@@ -1,12 +1,164 @@
-import fnmatch
+import argparse
+import ast
+import functools
+import hashlib
+import io
+import json
+import multiprocessing
 import os
 import re
 import sys
+import tempfile
+import time
+import tokenize
 import uuid
 
+import graph_format
+
+
+def compile_import_regexes():
+    module_pattern = r'([\._a-zA-Z][\w\.\_]*)'
+    var_name_pattern = r'([_a-zA-Z][\w\.\_]*)'
+    hard_space_pattern = r'( |\\\n)+'
+    soft_space_pattern = r'( |\\\n)*'
+    hard_space_and_new_line_pattern = r'[ \n]+'
+    soft_space_and_new_line_pattern = r'[ \n]*'
+
+    import_pattern = rf'^(from{hard_space_pattern}{module_pattern}{hard_space_pattern})?import{hard_space_pattern}({var_name_pattern}({hard_space_pattern}as{hard_space_pattern}{var_name_pattern})?({soft_space_pattern},{soft_space_pattern}{var_name_pattern})*|\({soft_space_and_new_line_pattern}{var_name_pattern}({hard_space_pattern}as{hard_space_pattern}{var_name_pattern})?({soft_space_and_new_line_pattern},{soft_space_and_new_line_pattern}{var_name_pattern}({hard_space_and_new_line_pattern}as{hard_space_pattern}{var_name_pattern})?)*({soft_space_and_new_line_pattern},)?{soft_space_and_new_line_pattern}\)|\*)'
+    from_pattern = rf'from{hard_space_pattern}{module_pattern}{hard_space_pattern}import'
+    as_pattern = rf'{hard_space_pattern}as{hard_space_pattern}{var_name_pattern}{soft_space_pattern}'
+    module_pattern = r'([_a-zA-Z][\w\.\_]*|\*)'
+
+    return (re.compile(import_pattern, flags=re.MULTILINE),
+            re.compile(from_pattern, flags=re.MULTILINE),
+            re.compile(as_pattern, flags=re.MULTILINE),
+            re.compile(module_pattern, flags=re.MULTILINE))
+
+
+IMPORT_REGEX, FROM_REGEX, AS_REGEX, MODULE_REGEX = compile_import_regexes()
+IMPORT_STATEMENT_REGEX = re.compile(r'[ \t]*((?:from|import)\b)')
+
+IMPORT_ENGINES = ('ast', 'regex')
+# A shard keeps the relative imports it cannot resolve as external modules named by this prefix and the package
+# name they point at, which may be in another shard
+SHARD_RELATIVE_PREFIX = 'relative:'
+
+
+def read_imports_by_regex(path):
+    imports = []
+    file = open(path, 'r', encoding='utf-8').read()
+    for import_match in IMPORT_REGEX.finditer(file):
+        import_statement = str(import_match.group())
+
+        as_statement = AS_REGEX.search(import_statement)
+        if as_statement:
+            import_statement = import_statement[:as_statement.start()] + import_statement[as_statement.end():]
+
+        from_match = FROM_REGEX.search(import_statement)
+        if from_match:
+            from_statement = from_match.group()
+        else:
+            from_statement = None
+        target = import_statement[import_statement.find('import') + 6:]
+        modules_statement = MODULE_REGEX.findall(target)
+
+        # from_statement
+        # package_statement
+        for module in modules_statement:
+            imports.append({'from': from_statement[5:-7] if from_statement else None, 'module': module})
+    return imports
+
+
+def import_statement_starts(source):
+    # Offsets of the from/import keywords starting a line that has the word import in it. str.find jumps between
+    # the few occurrences of the word, where a multiline regex would try a match at every position of the file.
+    starts = []
+    line_start = -1
+    position = source.find('import')
+    while position != -1:
+        previous_line_start = line_start
+        line_start = source.rfind('\n', 0, position) + 1
+        while line_start > 1 and source[line_start - 2] == '\\':
+            # 'from package \\' continued on the next line
+            line_start = source.rfind('\n', 0, line_start - 1) + 1
+        if line_start != previous_line_start:
+            keyword = IMPORT_STATEMENT_REGEX.match(source, line_start)
+            if keyword:
+                starts.append(keyword.start(1))
+        position = source.find('import', position + 6)
+    return starts
+
+
+def read_import_statements(path):
+    try:
+        with tokenize.open(path) as file:
+            source = file.read()
+    except (SyntaxError, UnicodeDecodeError):
+        with open(path, 'rb') as file:
+            source = file.read().decode('utf-8', 'replace')
+
+    # Only the logical line starting at each candidate is tokenized, so brackets and backslashes in comments and
+    # strings never extend a statement and the rest of the file is never read. A continuation line never starts
+    # with from or import, so a candidate still open at the next candidate is not code and is dropped.
+    candidates = import_statement_starts(source)
+    statements = []
+    for index, statement_start in enumerate(candidates):
+        segment_end = candidates[index + 1] if index + 1 < len(candidates) else len(source)
+        line_end = source.find('\n', statement_start, segment_end)
+        line = source[statement_start:segment_end if line_end == -1 else line_end]
+        if '(' not in line and '\\' not in line:
+            # Nothing can continue the statement past its line, which holds for most imports
+            statements.append(line)
+            continue
+        segment = source[statement_start:segment_end]
+        try:
+            for token in tokenize.generate_tokens(io.StringIO(segment).readline):
+                if token.type == tokenize.NEWLINE:
+                    line_start = 0
+                    for _ in range(token.start[0] - 1):
+                        line_start = segment.index('\n', line_start) + 1
+                    statements.append(segment[:line_start + token.start[1]])
+                    break
+        except (tokenize.TokenError, SyntaxError):
+            # Unfinished brackets or strings, e.g. prose in a docstring
+            pass
+    return statements
+
+
+def read_imports_by_ast(path):
+    statements = read_import_statements(path)
+    try:
+        trees = [ast.parse('\n'.join(statements))]
+    except SyntaxError:
+        # One of the candidates is not code (e.g. prose in a docstring), so parse them one by one
+        trees = []
+        for statement in statements:
+            try:
+                trees.append(ast.parse(statement))
+            except SyntaxError:
+                pass
+
+    imports = []
+    for tree in trees:
+        for node in tree.body:
+            if isinstance(node, ast.ImportFrom):
+                from_statement = '.' * node.level + (node.module or '')
+                for alias in node.names:
+                    imports.append({'from': from_statement, 'module': alias.name})
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    imports.append({'from': None, 'module': alias.name})
+    return imports
+
+
+def read_imports(path, engine='regex'):
+    if engine == 'ast':
+        return read_imports_by_ast(path)
+    return read_imports_by_regex(path)
+
 
 class Module:
-    def __init__(self, name: str, abs_path='', real_path='', external_module=False):
+    def __init__(self, name: str, abs_path='', real_path='', external_module=False, imports=None):
         self.imports = []
         self.name = name
         if external_module:
@@ -29,66 +181,263 @@ class Module:
                 self.top_dir = abs_path
             else:
                 self.top_dir = abs_path[:abs_path.find('/')]
-            self.read_source_code(real_path)
-
-    def read_source_code(self, path):
-        module_pattern = r'([\._a-zA-Z][\w\.\_]*)'
-        var_name_pattern = r'([_a-zA-Z][\w\.\_]*)'
-        hard_space_pattern = r'( |\\\n)+'
-        soft_space_pattern = r'( |\\\n)*'
-        hard_space_and_new_line_pattern = r'[ \n]+'
-        soft_space_and_new_line_pattern = r'[ \n]*'
-
-        import_pattern = rf'^(from{hard_space_pattern}{module_pattern}{hard_space_pattern})?import{hard_space_pattern}({var_name_pattern}({hard_space_pattern}as{hard_space_pattern}{var_name_pattern})?({soft_space_pattern},{soft_space_pattern}{var_name_pattern})*|\({soft_space_and_new_line_pattern}{var_name_pattern}({hard_space_pattern}as{hard_space_pattern}{var_name_pattern})?({soft_space_and_new_line_pattern},{soft_space_and_new_line_pattern}{var_name_pattern}({hard_space_and_new_line_pattern}as{hard_space_pattern}{var_name_pattern})?)*({soft_space_and_new_line_pattern},)?{soft_space_and_new_line_pattern}\)|\*)'
-        from_pattern = rf'from{hard_space_pattern}{module_pattern}{hard_space_pattern}import'
-        as_pattern = rf'{hard_space_pattern}as{hard_space_pattern}{var_name_pattern}{soft_space_pattern}'
-        module_pattern = r'([_a-zA-Z][\w\.\_]*|\*)'
-
-        import_regex = re.compile(import_pattern, flags=re.MULTILINE)
-        from_regex = re.compile(from_pattern, flags=re.MULTILINE)
-        as_regex = re.compile(as_pattern, flags=re.MULTILINE)
-        module_regex = re.compile(module_pattern, flags=re.MULTILINE)
-
-        file = open(path, 'r', encoding='utf-8').read()
-        for import_match in import_regex.finditer(file):
-            import_statement = str(import_match.group())
-
-            as_statement = as_regex.search(import_statement)
-            if as_statement:
-                import_statement = import_statement[:as_statement.start()] + import_statement[as_statement.end():]
-
-            from_match = from_regex.search(import_statement)
-            if from_match:
-                from_statement = from_match.group()
+            if imports is None:
+                self.read_source_code(real_path)
+            else:
+                self.imports.extend(imports)
+
+    def read_source_code(self, path, engine='regex'):
+        self.imports.extend(read_imports(path, engine))
+
+
+def compare_import_engines(paths):
+    engine_times = {}
+    engine_imports = {}
+    for engine in IMPORT_ENGINES:
+        timer_start = time.perf_counter()
+        engine_imports[engine] = [read_imports(path, engine) for path in paths]
+        engine_times[engine] = time.perf_counter() - timer_start
+
+    differences = {}
+    for index, path in enumerate(paths):
+        found = {engine: set((statement['from'], statement['module']) for statement in engine_imports[engine][index])
+                 for engine in IMPORT_ENGINES}
+        only_ast = found['ast'] - found['regex']
+        only_regex = found['regex'] - found['ast']
+        if only_ast or only_regex:
+            differences[path] = {'ast': sorted(only_ast, key=str), 'regex': sorted(only_regex, key=str)}
+    return engine_times, differences
+
+
+class AnalysisCache:
+    version = 1
+
+    def __init__(self, cache_path, engine='regex'):
+        self.cache_path = cache_path
+        self.engine = engine
+        self.entries = {}
+        self.file_keys = {}
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    @staticmethod
+    def file_digest(path):
+        with open(path, 'rb') as file:
+            return hashlib.sha1(file.read()).hexdigest()
+
+    def load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get('version') == self.version and data.get('engine') == self.engine:
+            self.entries = data['files']
+
+    def save(self):
+        # Only files seen in this run are kept, so deleted files drop out of the cache
+        files = {path: self.entries[path] for path in self.file_keys if path in self.entries}
+        with open(self.cache_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'version': self.version, 'engine': self.engine, 'files': files}, file)
+        os.replace(self.cache_path + '.tmp', self.cache_path)
+
+    def get(self, path):
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        self.file_keys[path] = [stat.st_size, stat.st_mtime_ns, None]
+        if entry is not None and entry['size'] == stat.st_size:
+            if entry['mtime'] == stat.st_mtime_ns:
+                self.hits += 1
+                return entry['imports']
+            digest = self.file_digest(path)
+            self.file_keys[path][2] = digest
+            if entry['hash'] == digest:
+                entry['mtime'] = stat.st_mtime_ns
+                self.hits += 1
+                return entry['imports']
+        self.misses += 1
+        return None
+
+    def put(self, path, imports):
+        size, mtime, digest = self.file_keys[path]
+        if digest is None:
+            digest = self.file_digest(path)
+        self.entries[path] = {'size': size, 'mtime': mtime, 'hash': digest, 'imports': imports}
+
+
+class GitIgnoreMatcher:
+    # Rules are checked like git does: the last rule matching a path decides, so a '!' rule re-includes what an
+    # earlier rule ignored and a later rule can ignore it again
+    def __init__(self, patterns, base_dir=''):
+        self.base_dir = base_dir
+        self.rules = []
+        for pattern in patterns:
+            pattern = pattern.rstrip()
+            if len(pattern) == 0 or pattern[0] == '#':
+                continue
+            is_negated = pattern[0] == '!'
+            if is_negated:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if len(pattern) == 0:
+                continue
+            if '/' in pattern:
+                # Patterns with a slash are anchored to the directory of their .gitignore
+                regex = self.translate(pattern.lstrip('/'))
             else:
-                from_statement = None
-            target = import_statement[import_statement.find('import') + 6:]
-            modules_statement = module_regex.findall(target)
+                regex = r'(?:.*/)?' + self.translate(pattern)
+            # Directories are matched with a trailing slash, so dir-only patterns never match files
+            regex += '/' if dir_only else '/?'
+            self.rules.append((re.compile(regex + r'\Z'), not is_negated))
+
+        # Most paths match no rule at all and are rejected by the combined regex alone
+        self.any_regex = re.compile('|'.join(f'(?:{rule.pattern})' for rule, _ in self.rules)) if self.rules else None
+
+    @staticmethod
+    def translate(pattern):
+        # '*' and '?' stay inside one path segment; '**/' matches any number of directories and a trailing '/**'
+        # everything inside a directory
+        regex = ''
+        index = 0
+        while index < len(pattern):
+            character = pattern[index]
+            if pattern.startswith('**', index) and (index == 0 or pattern[index - 1] == '/'):
+                if pattern.startswith('**/', index):
+                    regex += '(?:.*/)?'
+                    index += 3
+                    continue
+                if index + 2 == len(pattern):
+                    regex += '.+'
+                    index += 2
+                    continue
+            if character == '*':
+                regex += '[^/]*'
+                while pattern.startswith('*', index + 1):
+                    index += 1
+            elif character == '?':
+                regex += '[^/]'
+            elif character == '[' and pattern.find(']', index + 2) != -1:
+                end = pattern.find(']', index + 2)
+                characters = pattern[index + 1:end]
+                if characters[0] in '!^':
+                    characters = '^' + characters[1:]
+                regex += '[' + characters.replace('\\', '\\\\') + ']'
+                index = end
+            elif character == '\\' and index + 1 < len(pattern):
+                index += 1
+                regex += re.escape(pattern[index])
+            else:
+                regex += re.escape(character)
+            index += 1
+        return regex
+
+    @staticmethod
+    def from_file(path, base_dir=''):
+        with open(path) as file:
+            return GitIgnoreMatcher(file.read().splitlines(), base_dir)
+
+    def match(self, rel_path, is_dir):
+        subject = rel_path[len(self.base_dir):] + ('/' if is_dir else '')
+        if self.any_regex is None or not self.any_regex.match(subject):
+            return None
+        for rule, is_ignored in reversed(self.rules):
+            if rule.match(subject):
+                return is_ignored
+        return None
+
+
+def is_word_character(character):
+    return character.isalnum() or character == '_'
+
+
+class RelationIndex:
+    def __init__(self):
+        self.forward = {}
+        self.reverse = {}
+
+    def add_module(self, module_id):
+        self.forward.setdefault(module_id, set())
+        self.reverse.setdefault(module_id, set())
+
+    def add(self, from_id, to_id):
+        self.forward.setdefault(from_id, set()).add(to_id)
+        self.reverse.setdefault(to_id, set()).add(from_id)
+
+    def remove(self, from_id, to_id):
+        self.forward[from_id].discard(to_id)
+        self.reverse[to_id].discard(from_id)
+
+    def remove_module(self, module_id):
+        for to_id in self.forward.pop(module_id, ()):
+            self.reverse[to_id].discard(module_id)
+        for from_id in self.reverse.pop(module_id, ()):
+            self.forward[from_id].discard(module_id)
+
+    # Read-only views; the index changes only through add, remove and remove_module
+    def importees(self, module_id):
+        return frozenset(self.forward.get(module_id, ()))
 
-            # from_statement
-            # package_statement
-            for module in modules_statement:
-                self.imports.append({'from': from_statement[5:-7] if from_statement else None, 'module': module})
+    def importers(self, module_id):
+        return frozenset(self.reverse.get(module_id, ()))
+
+    def __iter__(self):
+        for from_id, to_ids in self.forward.items():
+            for to_id in to_ids:
+                yield from_id, to_id
+
+    def __len__(self):
+        return sum(len(to_ids) for to_ids in self.forward.values())
 
 
 class ProjectAnalyzer:
 
-    def __init__(self, target_path: str):
-        self.ignore_list = set()
+    def __init__(self, target_path: str, jobs=1, cache_path=None, engine='regex', roots=None):
+        self.ignore_list = []
+        self.ignore_matcher = None
         self.modules = {}
         self.packages = {}
-        self.import_relation = []
+        self.external_modules = {}
+        self.module_ids_by_path = {}
+        self.relations = RelationIndex()
+        self.relative_prefixes = {}
+        # (abs_dir, from_statement) of relative imports that name no module, to the package name they point at
+        self.unresolved_imports = {}
+        self.source_files = []
         self.target_path = target_path
+        self.roots = roots
+        self.jobs = jobs
+        self.engine = engine
+        self.parse_time = 0.0
+        self.phase_times = {}
+        self.cache = AnalysisCache(cache_path, engine) if cache_path else None
+        self.output_module = {}
+        self.output = {}
 
+        self.analyze()
+
+    def analyze(self):
+        timer_start = time.perf_counter()
         self.get_git_ignore()
-        self.travel_files(self.target_path)
+        self.travel_source_roots()
+        self.phase_times['walk'] = time.perf_counter() - timer_start
+
+        self.read_source_files()
+        self.phase_times['parse'] = self.parse_time
 
+        timer_start = time.perf_counter()
         self.make_relations()
+        self.phase_times['relations'] = time.perf_counter() - timer_start
+
+        timer_start = time.perf_counter()
+        self.build_output_module()
+        self.phase_times['output'] = time.perf_counter() - timer_start
 
+    def build_output_module(self):
         self.output_module = {}
-        self.output = {}
         for module_id in self.modules:
-            relation_data = set([str(rel['to']) for rel in self.import_relation if rel['from'] == module_id])
+            relation_data = set([str(to_id) for to_id in self.relations.importees(module_id)])
             module = self.modules[module_id]
             self.output_module[str(module_id)] = {'top_dir': module.top_dir,
                                                   'mod_name': module.mod_name,
@@ -96,102 +445,414 @@ class ProjectAnalyzer:
                                                   'abs_path': module.abs_path,
                                                   'imports': relation_data}
 
-    def add_internal_module(self, path):
+    def relation_graph(self):
+        # Dense node ids follow abs_path order, so the same tree always produces the same ids
+        module_ids = sorted(self.modules, key=lambda module_id: self.modules[module_id].abs_path)
+        node_ids = {module_id: node_id for node_id, module_id in enumerate(module_ids)}
+        nodes = []
+        imports = []
+        for module_id in module_ids:
+            module = self.modules[module_id]
+            nodes.append({'key': module.abs_path,
+                          'top_dir': module.top_dir,
+                          'mod_name': module.mod_name,
+                          'mod_path': module.mod_path,
+                          'abs_path': module.abs_path})
+            imports.append([node_ids[to_id] for to_id in self.relations.importees(module_id)])
+        return nodes, imports
+
+    def write_relation_graph(self, path):
+        graph_format.write_graph(path, *self.relation_graph())
+
+    def write_output(self, path, output_format):
+        if output_format == 'rtmb':
+            self.write_relation_graph(path)
+        elif output_format == 'jsonl':
+            graph_format.write_jsonl(path, *self.relation_graph())
+        else:
+            with open(f'{path}', 'w') as file:
+                file.write(str(self.output_module))
+
+    def importees(self, module_id):
+        return self.relations.importees(module_id)
+
+    def importers(self, module_id):
+        return self.relations.importers(module_id)
+
+    @staticmethod
+    def package_name(abs_path):
+        if abs_path[abs_path.rfind('/') + 1:] == '__init__.py':
+            return abs_path[:abs_path.rfind('/')].replace('/', '.')
+        return abs_path[:-3].replace('/', '.')
+
+    def add_internal_module(self, path, imports=None):
         abs_path = path.replace(self.target_path, '')
         name = path[path.rfind('/') + 1:]
         module_id = uuid.uuid4()
-        self.modules[module_id] = Module(name, abs_path, path)
-        if name == '__init__.py':
-            self.packages[abs_path[:abs_path.rfind('/')].replace('/', '.')] = module_id
-        else:
-            self.packages[abs_path[:-3].replace('/', '.')] = module_id
+        self.modules[module_id] = Module(name, abs_path, path, imports=imports)
+        self.relations.add_module(module_id)
+        self.packages[self.package_name(abs_path)] = module_id
+        self.module_ids_by_path[path] = module_id
         return module_id
 
     def add_external_module(self, name):
         module_id = uuid.uuid4()
         self.modules[module_id] = Module(name, external_module=True)
-        self.packages[name] = module_id
+        self.relations.add_module(module_id)
+        self.external_modules[name] = module_id
         return module_id
 
+    def remove_module(self, module_id):
+        module = self.modules.pop(module_id)
+        self.relations.remove_module(module_id)
+        if module.top_dir == '__external__':
+            del self.external_modules[module.name]
+        else:
+            package_name = self.package_name(module.abs_path[1:])
+            if self.packages.get(package_name) == module_id:
+                del self.packages[package_name]
+        return module
+
+    def relative_import_prefixes(self, abs_dir):
+        if abs_dir not in self.relative_prefixes:
+            package_dir = abs_dir[1:-1]
+            self.relative_prefixes[abs_dir] = (package_dir.replace('/', '.') + '.',
+                                               package_dir[:package_dir.rfind('/') + 1].replace('/', '.'))
+        return self.relative_prefixes[abs_dir]
+
+    def resolve_import(self, abs_dir, statement):
+        # Returns the package name an import statement points at and whether it lies outside the project
+        from_statement = statement['from']
+        if from_statement is None:
+            return None, False
+        if from_statement in self.packages:
+            return from_statement, False
+        if len(from_statement) > 1 and from_statement[0] == '.' and is_word_character(from_statement[1]):
+            path = self.relative_import_prefixes(abs_dir)[0] + from_statement[1:]
+            if path in self.packages:
+                return path, False
+            return self.unresolved_import(abs_dir, from_statement, path)
+        if len(from_statement) > 2 and from_statement[0] == '.' and is_word_character(from_statement[2]):
+            path = self.relative_import_prefixes(abs_dir)[1] + from_statement[2:]
+            if path in self.packages:
+                return path, False
+            return self.unresolved_import(abs_dir, from_statement, path)
+        explicit_path = f'{from_statement}.{statement["module"]}'
+        return explicit_path, explicit_path not in self.packages
+
+    def unresolved_import(self, abs_dir, from_statement, path):
+        if self.roots is not None:
+            return SHARD_RELATIVE_PREFIX + path, True
+        self.unresolved_imports[(abs_dir, from_statement)] = path
+        return None, False
+
+    def link_module(self, module_id):
+        # Rebuilds the outgoing relations of one module and tells whether they changed
+        old_importees = self.relations.importees(module_id)
+        for to_id in old_importees:
+            self.relations.remove(module_id, to_id)
+        mod = self.modules[module_id]
+        for statement in mod.imports:
+            package_name, is_external = self.resolve_import(mod.abs_dir, statement)
+            if package_name is None:
+                continue
+            if is_external:
+                # Add relation for external package
+                to_id = self.external_modules.get(package_name)
+                if to_id is None:
+                    to_id = self.add_external_module(package_name)
+            else:
+                to_id = self.packages[package_name]
+            self.relations.add(module_id, to_id)
+        return old_importees != self.relations.importees(module_id)
+
     def make_relations(self):
-        external_modules = set()
-        external_module_imports = {}
+        for module_id in list(self.modules):
+            if self.modules[module_id].top_dir != '__external__':
+                self.link_module(module_id)
 
-        for module_id in self.modules:
-            mod = self.modules[module_id]
-            for statement in mod.imports:
-                if statement['from'] is not None:
-                    if statement['from'] in self.packages:
-                        self.import_relation.append({'from': module_id, 'to': self.packages[statement["from"]]})
-                    else:
-                        if re.match(r'\.\w+', statement['from']):
-                            path = \
-                                (mod.abs_path[:mod.abs_path.rfind('/')][1:] + '/' + statement['from'][1:]).replace('/',
-                                                                                                                   '.')
-                            if path in self.packages:
-                                self.import_relation.append({'from': module_id, 'to': self.packages[path]})
-                            else:
-                                raise path
-                        elif re.match(r'\..\w+', statement['from']):
-                            top_dir = mod.abs_dir[1:-1]
-                            path = top_dir[:top_dir.rfind('/') + 1].replace('/', '.') + statement['from'][2:]
-                            if path in self.packages:
-                                self.import_relation.append({'from': module_id, 'to': self.packages[path]})
-                            else:
-                                raise path
-                        else:
-                            explicit_path = f'{statement["from"]}.{statement["module"]}'
-                            if explicit_path in self.packages:
-                                self.import_relation.append({'from': module_id, 'to': self.packages[explicit_path]})
-                            else:
-                                if not (explicit_path in external_modules):
-                                    external_modules.add(explicit_path)
-                                    external_module_imports[explicit_path] = []
-                                # Add relation for external package
-                                external_module_imports[explicit_path].append(module_id)
-        for module_name in external_modules:
-            module_id = self.add_external_module(module_name)
-            for importing_module_id in external_module_imports[module_name]:
-                self.import_relation.append({'from': importing_module_id, 'to': module_id})
+    def update_source_files(self, added_files, modified_files, removed_files):
+        # Re-parses only the touched files and patches the relation index in place
+        # Files are read before anything is patched, so a read error leaves the analyzer untouched
+        source_imports = {path: read_imports(path, self.engine) for path in list(modified_files) + list(added_files)}
+
+        known_ids = set(self.modules)
+        relink_ids = set()
+        removed_modules = []
+        for path in removed_files:
+            # Every import that resolved to a deleted package name pointed at its module
+            module_id = self.module_ids_by_path.pop(path)
+            relink_ids.update(self.relations.importers(module_id))
+            removed_modules.append(self.remove_module(module_id))
+
+        for path in modified_files:
+            module_id = self.module_ids_by_path[path]
+            self.modules[module_id].imports = source_imports[path]
+            relink_ids.add(module_id)
+        added_names = set()
+        for path in added_files:
+            package_name = self.package_name(path.replace(self.target_path, ''))
+            if package_name in self.packages:
+                relink_ids.update(self.relations.importers(self.packages[package_name]))
+            added_names.add(package_name)
+            relink_ids.add(self.add_internal_module(path, source_imports[path]))
+
+        if added_names:
+            # An import resolves to a new package name P where it used to reach the external module P, the module
+            # P.name of a 'from P import name', or nothing for a relative import
+            unresolved_dirs = set(abs_dir for (abs_dir, _), package_name in self.unresolved_imports.items()
+                                  if package_name in added_names)
+            for module_id, module in self.modules.items():
+                if module.top_dir == '__external__':
+                    package_name = module.name
+                else:
+                    package_name = self.package_name(module.abs_path[1:])
+                    if module.abs_dir in unresolved_dirs:
+                        relink_ids.add(module_id)
+                if package_name in added_names or package_name.rpartition('.')[0] in added_names:
+                    relink_ids.update(self.relations.importers(module_id))
+
+        changed_ids = set(module_id for module_id in relink_ids
+                          if module_id in self.modules and self.link_module(module_id))
+
+        for module_id in list(self.external_modules.values()):
+            if len(self.relations.importers(module_id)) == 0:
+                removed_modules.append(self.remove_module(module_id))
+        added_ids = [module_id for module_id in self.modules if module_id not in known_ids]
+        changed_ids.update(added_ids)
+        return [module.abs_path for module in removed_modules], \
+            added_ids, [module_id for module_id in self.modules if module_id in changed_ids]
 
     def get_git_ignore(self):
-        self.ignore_list.add('.git')
+        # A list, not a set: the matcher resolves rules by their order in the file
+        self.ignore_list.append('.git')
         try:
             file = open(self.target_path + '.gitignore')
 
             for line in file.read().splitlines():
                 if len(line) > 0:
                     if line[0] != '#':
-                        self.ignore_list.add(line)
+                        self.ignore_list.append(line)
         except FileNotFoundError as fe:
             pass
+        self.ignore_matcher = GitIgnoreMatcher(self.ignore_list)
 
-    def is_not_to_ignore(self, name) -> bool:
-        for ignore_keyword in self.ignore_list:
-            if fnmatch.fnmatch(name, ignore_keyword):
-                return False
+    @staticmethod
+    def is_not_to_ignore(rel_path, is_dir, ignore_matchers) -> bool:
+        # The deepest .gitignore with an opinion on the path wins
+        for ignore_matcher in reversed(ignore_matchers):
+            is_ignored = ignore_matcher.match(rel_path, is_dir)
+            if is_ignored is not None:
+                return not is_ignored
         return True
 
-    def travel_files(self, base_path):
-        for _ in os.listdir(base_path):
-            rel_path = base_path.replace(self.target_path, '')
-            if self.is_not_to_ignore(rel_path):
-                sub_dir = base_path + f'{_}'
-                if os.path.isdir(sub_dir):
-                    if self.is_not_to_ignore(sub_dir) and self.is_not_to_ignore(_):
-                        self.travel_files(sub_dir + '/')
-                elif os.path.isfile(sub_dir):
-                    if self.is_not_to_ignore(sub_dir) and self.is_not_to_ignore(_):
-                        if fnmatch.fnmatch(sub_dir, '*.py'):
-                            self.add_internal_module(sub_dir)
+    def travel_files(self, base_path, ignore_matchers=None):
+        rel_dir = base_path.replace(self.target_path, '')
+        if ignore_matchers is None:
+            ignore_matchers = [self.ignore_matcher]
+        with os.scandir(base_path) as scanner:
+            entries = list(scanner)
+
+        if rel_dir:
+            for entry in entries:
+                if entry.name == '.gitignore' and entry.is_file():
+                    ignore_matchers = ignore_matchers + [GitIgnoreMatcher.from_file(entry.path, rel_dir)]
+
+        for entry in entries:
+            # DirEntry caches its file type, so ignored directories are pruned without another stat
+            if entry.is_dir():
+                if self.is_not_to_ignore(rel_dir + entry.name, True, ignore_matchers):
+                    self.travel_files(base_path + entry.name + '/', ignore_matchers)
+            elif entry.name.endswith('.py') and entry.is_file():
+                if self.is_not_to_ignore(rel_dir + entry.name, False, ignore_matchers):
+                    self.source_files.append(base_path + entry.name)
+
+    def iterate_source_imports(self):
+        timer_start = time.perf_counter()
+        cached_imports = {}
+        pending_files = []
+        for path in self.source_files:
+            imports = self.cache.get(path) if self.cache else None
+            if imports is None:
+                pending_files.append(path)
+            else:
+                cached_imports[path] = imports
+
+        read_imports_with_engine = functools.partial(read_imports, engine=self.engine)
+        pool = multiprocessing.Pool(self.jobs) if self.jobs > 1 and len(pending_files) > 1 else None
+        try:
+            if pool:
+                chunk_size = max(1, len(pending_files) // (self.jobs * 16))
+                parsed_imports = pool.imap(read_imports_with_engine, pending_files, chunk_size)
+            else:
+                parsed_imports = map(read_imports_with_engine, pending_files)
+
+            # Results are yielded in walk order, so the module table matches a serial run
+            for path in self.source_files:
+                imports = cached_imports.get(path)
+                if imports is None:
+                    imports = next(parsed_imports)
+                    if self.cache:
+                        self.cache.put(path, imports)
+                yield path, imports
+        finally:
+            if pool:
+                pool.terminate()
+
+        if self.cache:
+            self.cache.save()
+        self.parse_time = time.perf_counter() - timer_start
+
+    def travel_source_roots(self):
+        if self.roots is None:
+            self.travel_files(self.target_path)
+            return
+        # A shard walks only some top level entries, but names stay relative to target_path so shards merge
+        for root in self.roots:
+            root = root.strip('/')
+            path = self.target_path + root
+            if os.path.isdir(path):
+                if self.is_not_to_ignore(root, True, [self.ignore_matcher]):
+                    self.travel_files(path + '/')
+            elif root.endswith('.py') and os.path.isfile(path):
+                if self.is_not_to_ignore(root, False, [self.ignore_matcher]):
+                    self.source_files.append(path)
+
+    def read_source_files(self):
+        for path, imports in self.iterate_source_imports():
+            self.add_internal_module(path, imports)
+
+    def files_per_second(self):
+        if self.parse_time == 0:
+            return 0.0
+        return len(self.source_files) / self.parse_time
+
+
+def output_format_of(path):
+    if path.endswith(graph_format.EXTENSION):
+        return 'rtmb'
+    if path.endswith(graph_format.JSONL_EXTENSION):
+        return 'jsonl'
+    return 'rtm'
+
+
+class StreamingProjectAnalyzer(ProjectAnalyzer):
+    def __init__(self, target_path: str, output_path, jobs=1, cache_path=None, engine='regex', roots=None):
+        self.output_path = output_path
+        self.module_count = 0
+        self.edge_count = 0
+        super().__init__(target_path, jobs=jobs, cache_path=cache_path, engine=engine, roots=roots)
+
+    def analyze(self):
+        # Only the walk list and the package name index stay in memory; parsed imports are spilled to disk
+        timer_start = time.perf_counter()
+        self.get_git_ignore()
+        self.travel_source_roots()
+        self.phase_times['walk'] = time.perf_counter() - timer_start
+        with open(self.output_path, 'w', encoding='utf-8') as output_file, \
+                tempfile.TemporaryFile('w+', encoding='utf-8') as import_spill:
+            self.write_record(output_file, {'type': 'header', 'format': graph_format.JSONL_FORMAT,
+                                            'version': graph_format.JSONL_VERSION})
+            self.stream_modules(output_file, import_spill)
+            self.phase_times['parse'] = self.parse_time
+
+            timer_start = time.perf_counter()
+            import_spill.seek(0)
+            self.stream_relations(output_file, import_spill)
+            self.phase_times['relations'] = time.perf_counter() - timer_start
+
+    @staticmethod
+    def write_record(output_file, record):
+        output_file.write(json.dumps(record))
+        output_file.write('\n')
+
+    def write_module_record(self, output_file, module):
+        module_id = self.module_count
+        self.module_count += 1
+        self.write_record(output_file, {'type': 'module',
+                                        'id': module_id,
+                                        'top_dir': module.top_dir,
+                                        'mod_name': module.mod_name,
+                                        'mod_path': module.mod_path,
+                                        'abs_path': module.abs_path})
+        return module_id
+
+    def stream_modules(self, output_file, import_spill):
+        for path, imports in self.iterate_source_imports():
+            abs_path = path.replace(self.target_path, '')
+            module = Module(path[path.rfind('/') + 1:], abs_path, path, imports=())
+            module_id = self.write_module_record(output_file, module)
+            self.packages[self.package_name(abs_path)] = module_id
+            import_spill.write(json.dumps([module_id, module.abs_dir,
+                                           [[statement['from'], statement['module']] for statement in imports]]))
+            import_spill.write('\n')
+            output_file.flush()
+
+    def stream_relations(self, output_file, import_spill):
+        external_modules = {}
+        for line in import_spill:
+            module_id, abs_dir, imports = json.loads(line)
+            importees = set()
+            for from_statement, module_name in imports:
+                package_name, is_external = self.resolve_import(abs_dir, {'from': from_statement,
+                                                                          'module': module_name})
+                if package_name is None:
+                    continue
+                if is_external:
+                    if package_name not in external_modules:
+                        external_modules[package_name] = self.write_module_record(
+                            output_file, Module(package_name, external_module=True))
+                    importees.add(external_modules[package_name])
+                else:
+                    importees.add(self.packages[package_name])
+            for to_id in sorted(importees):
+                self.write_record(output_file, {'type': 'import', 'from': module_id, 'to': to_id})
+            self.edge_count += len(importees)
 
 
 if __name__ == '__main__':
-    if len(sys.argv) <= 2:
-        print('Number of arguments is wrong.')
-        print(f'python {sys.argv[0]} [PROJECT_DIR] [OUTPUTFILE_NAME]')
+    parser = argparse.ArgumentParser(usage=f'python {sys.argv[0]} [PROJECT_DIR] [OUTPUTFILE_NAME]')
+    parser.add_argument('project_dir')
+    parser.add_argument('output_file')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes parsing source files')
+    parser.add_argument('--cache', help='analysis cache file reused between runs')
+    parser.add_argument('--engine', choices=IMPORT_ENGINES, default='regex', help='import extraction engine')
+    parser.add_argument('--compare-engines', action='store_true',
+                        help='also time every import extraction engine and list the files they disagree on')
+    parser.add_argument('--root', action='append', dest='roots',
+                        help='analyze only this top level directory or file of the project as a shard '
+                             '(repeatable, merge shards with shard_merger.py)')
+    parser.add_argument('--format', choices=('rtm', 'rtmb', 'jsonl'),
+                        help=f'output format, by default picked from the {graph_format.EXTENSION} or '
+                             f'{graph_format.JSONL_EXTENSION} extension and rtm otherwise; '
+                             f'jsonl streams records while the project is analyzed')
+    args = parser.parse_args()
+
+    output_format = args.format or output_format_of(args.output_file)
+
+    print(f'Get file from {args.project_dir}')
+    if output_format == 'jsonl':
+        python_import_map = StreamingProjectAnalyzer(args.project_dir, args.output_file, jobs=args.jobs,
+                                                     cache_path=args.cache, engine=args.engine, roots=args.roots)
     else:
-        print(f'Get file from {sys.argv[1]}')
-        python_import_map = ProjectAnalyzer(sys.argv[1])
-        with open(f'{sys.argv[2]}', 'w') as file:
-            file.write(str(python_import_map.output_module))
+        python_import_map = ProjectAnalyzer(args.project_dir, jobs=args.jobs, cache_path=args.cache,
+                                            engine=args.engine, roots=args.roots)
+    print(f'Parsed {len(python_import_map.source_files)} files in {python_import_map.parse_time:.3f}s '
+          f'({python_import_map.files_per_second():.1f} files/sec, jobs={python_import_map.jobs}, '
+          f'engine={python_import_map.engine})')
+    if python_import_map.unresolved_imports:
+        print(f'Skipped {len(python_import_map.unresolved_imports)} relative imports that do not resolve to a module')
+    if python_import_map.cache:
+        print(f'Cache hits {python_import_map.cache.hits}, misses {python_import_map.cache.misses}')
+    if args.compare_engines:
+        engine_times, differences = compare_import_engines(python_import_map.source_files)
+        for engine in IMPORT_ENGINES:
+            print(f'[{engine}] {engine_times[engine]:.3f}s')
+        for path in differences:
+            print(path)
+            for engine in IMPORT_ENGINES:
+                for statement in differences[path][engine]:
+                    print(f'  only {engine}: from {statement[0]} import {statement[1]}')
+        print(f'{len(differences)} of {len(python_import_map.source_files)} files differ')
+    if output_format != 'jsonl':
+        python_import_map.write_output(args.output_file, output_format)
@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+
+import graph_format
+from project_analyzer import IMPORT_ENGINES, ProjectAnalyzer, output_format_of
+
+
+class ProjectWatcher:
+    def __init__(self, analyzer: ProjectAnalyzer, push_address=None, output_path=None, interval=1.0):
+        self.analyzer = analyzer
+        self.push_address = push_address
+        self.output_path = output_path
+        self.interval = interval
+        self.connection = None
+        self.file_states = self.scan_file_states()
+
+    def scan_file_states(self):
+        # inotify is not in the standard library, so the tree is polled; the walk prunes ignored directories
+        self.analyzer.source_files = []
+        self.analyzer.travel_files(self.analyzer.target_path)
+        file_states = {}
+        for path in self.analyzer.source_files:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            file_states[path] = (stat.st_mtime_ns, stat.st_size)
+        return file_states
+
+    def module_record(self, module_id):
+        module = self.analyzer.modules[module_id]
+        return {'type': 'module',
+                'top_dir': module.top_dir,
+                'mod_name': module.mod_name,
+                'mod_path': module.mod_path,
+                'abs_path': module.abs_path}
+
+    def imports_record(self, module_id):
+        return {'type': 'imports',
+                'abs_path': self.analyzer.modules[module_id].abs_path,
+                'imports': sorted(self.analyzer.modules[to_id].abs_path
+                                  for to_id in self.analyzer.importees(module_id))}
+
+    def snapshot_records(self):
+        records = [{'type': 'snapshot_begin'}]
+        records.extend(self.module_record(module_id) for module_id in self.analyzer.modules)
+        records.extend(self.imports_record(module_id) for module_id in self.analyzer.modules)
+        records.append({'type': 'snapshot_end'})
+        return records
+
+    def poll(self):
+        file_states = self.scan_file_states()
+        added_files = [path for path in file_states if path not in self.file_states]
+        removed_files = [path for path in self.file_states if path not in file_states]
+        modified_files = [path for path in file_states
+                          if path in self.file_states and file_states[path] != self.file_states[path]]
+        if not (added_files or removed_files or modified_files):
+            return []
+
+        try:
+            removed_paths, added_ids, changed_ids = \
+                self.analyzer.update_source_files(added_files, modified_files, removed_files)
+        except (OSError, UnicodeDecodeError) as error:
+            # Usually a file caught in the middle of a save; the same change is picked up by the next poll
+            print(f'[Watch] Retrying later: {error}')
+            return []
+        self.file_states = file_states
+        print(f'[Watch] {len(added_files)} added, {len(modified_files)} modified, {len(removed_files)} removed, '
+              f'{len(changed_ids)} modules with new relations')
+
+        records = [{'type': 'remove', 'abs_path': abs_path} for abs_path in removed_paths]
+        records.extend(self.module_record(module_id) for module_id in added_ids)
+        records.extend(self.imports_record(module_id) for module_id in changed_ids)
+        return records
+
+    def connect(self):
+        try:
+            self.connection = socket.create_connection(self.push_address, timeout=self.interval)
+        except OSError:
+            return False
+        print(f'[Watch] Connected to visualizer at {self.push_address[0]}:{self.push_address[1]}')
+        return True
+
+    def push(self, records):
+        if self.push_address is None:
+            return
+        if self.connection is None:
+            if not self.connect():
+                return
+            # A fresh connection gets the whole graph, which already contains the pending deltas
+            records = self.snapshot_records()
+        if len(records) == 0:
+            return
+        try:
+            self.connection.sendall(''.join(json.dumps(record) + '\n' for record in records).encode('utf-8'))
+        except OSError:
+            self.connection.close()
+            self.connection = None
+
+    def write_output(self):
+        self.analyzer.build_output_module()
+        self.analyzer.write_output(self.output_path, output_format_of(self.output_path))
+
+    def run(self):
+        self.push([])
+        while True:
+            time.sleep(self.interval)
+            records = self.poll()
+            self.push(records)
+            if records and self.output_path:
+                self.write_output()
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage=f'python {sys.argv[0]} [PROJECT_DIR]')
+    parser.add_argument('project_dir')
+    parser.add_argument('-o', '--output', help='relation file rewritten after every change (.rtm, .rtmb or .jsonl)')
+    parser.add_argument('--push', nargs='?', const=f'localhost:{graph_format.DELTA_PORT}', type=parse_address,
+                        help=f'push relation deltas to a visualizer started with --listen '
+                             f'(default localhost:{graph_format.DELTA_PORT})')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls of the tree')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes for the first analysis')
+    parser.add_argument('--engine', choices=IMPORT_ENGINES, default='regex', help='import extraction engine')
+    args = parser.parse_args()
+
+    print(f'Get file from {args.project_dir}')
+    python_import_map = ProjectAnalyzer(args.project_dir, jobs=args.jobs, engine=args.engine)
+    watcher = ProjectWatcher(python_import_map, push_address=args.push, output_path=args.output,
+                             interval=args.interval)
+    if args.output:
+        watcher.write_output()
+    print(f'[Watch] Watching {len(watcher.file_states)} files, press Ctrl+C to stop')
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print('[Finish]')
@@ -0,0 +1,159 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import graph_format
+from project_analyzer import IMPORT_ENGINES, SHARD_RELATIVE_PREFIX, GitIgnoreMatcher, ProjectAnalyzer, output_format_of
+
+EXTERNAL_PREFIX = 'external://'
+
+
+def list_shards(target_path):
+    # Every top level directory is a shard, loose top level files share one more
+    ignore_patterns = ['.git']
+    if os.path.isfile(target_path + '.gitignore'):
+        with open(target_path + '.gitignore') as file:
+            ignore_patterns.extend(file.read().splitlines())
+    ignore_matcher = GitIgnoreMatcher(ignore_patterns)
+
+    shards = []
+    top_files = []
+    with os.scandir(target_path) as scanner:
+        for entry in sorted(scanner, key=lambda entry: entry.name):
+            if entry.is_dir():
+                if not ignore_matcher.match(entry.name, True):
+                    shards.append((entry.name, [entry.name]))
+            elif entry.name.endswith('.py') and entry.is_file():
+                if not ignore_matcher.match(entry.name, False):
+                    top_files.append(entry.name)
+    if top_files:
+        shards.append(('__top__', top_files))
+    return shards
+
+
+def analyze_shard(target_path, shard_name, roots, shard_path, engine):
+    timer_start = time.perf_counter()
+    python_import_map = ProjectAnalyzer(target_path, engine=engine, roots=roots)
+    python_import_map.write_relation_graph(shard_path)
+    return shard_name, len(python_import_map.source_files), time.perf_counter() - timer_start
+
+
+def analyze_shards(target_path, shard_dir, jobs=1, engine='regex'):
+    tasks = [(target_path, shard_name, roots, os.path.join(shard_dir, shard_name + graph_format.EXTENSION), engine)
+             for shard_name, roots in list_shards(target_path)]
+    if jobs > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.starmap(analyze_shard, tasks, 1)
+    else:
+        results = [analyze_shard(*task) for task in tasks]
+    for shard_name, file_count, elapsed in results:
+        print(f'[Shard] {shard_name}: {file_count} files in {elapsed:.3f}s')
+    return [task[3] for task in tasks]
+
+
+def merge_shards(shard_paths):
+    shard_maps = [graph_format.read_any_relation_map(path) for path in shard_paths]
+
+    nodes = {}
+    packages = {}
+    for relation_map in shard_maps:
+        for relation in relation_map.values():
+            abs_path = relation['abs_path']
+            if not abs_path.startswith(EXTERNAL_PREFIX) and abs_path not in nodes:
+                nodes[abs_path] = relation
+                packages[ProjectAnalyzer.package_name(abs_path[1:])] = abs_path
+
+    def resolve_external(relation):
+        # An external 'a.b.c' came from 'from a.b import c'; resolve it like make_relations would have,
+        # trying the module of the from clause first and the imported name second
+        name = relation['abs_path'][len(EXTERNAL_PREFIX):]
+        if name.startswith(SHARD_RELATIVE_PREFIX):
+            # A relative import names its package exactly and is dropped when no shard has it, as in a full run
+            return packages.get(name[len(SHARD_RELATIVE_PREFIX):])
+        from_statement = name.rpartition('.')[0]
+        if from_statement in packages:
+            return packages[from_statement]
+        if name in packages:
+            return packages[name]
+        nodes.setdefault(relation['abs_path'], relation)
+        return relation['abs_path']
+
+    imports = {abs_path: set() for abs_path in nodes}
+    for relation_map in shard_maps:
+        for relation in relation_map.values():
+            if relation['abs_path'].startswith(EXTERNAL_PREFIX):
+                continue
+            module_imports = imports[relation['abs_path']]
+            for other_key in relation['imports']:
+                other_relation = relation_map[other_key]
+                if other_relation['abs_path'].startswith(EXTERNAL_PREFIX):
+                    other_abs_path = resolve_external(other_relation)
+                    if other_abs_path is not None:
+                        module_imports.add(other_abs_path)
+                else:
+                    module_imports.add(other_relation['abs_path'])
+
+    abs_paths = sorted(nodes)
+    node_ids = {abs_path: node_id for node_id, abs_path in enumerate(abs_paths)}
+    merged_nodes = []
+    merged_imports = []
+    for abs_path in abs_paths:
+        relation = nodes[abs_path]
+        merged_nodes.append({'key': abs_path,
+                             'top_dir': relation['top_dir'],
+                             'mod_name': relation['mod_name'],
+                             'mod_path': relation['mod_path'],
+                             'abs_path': abs_path})
+        merged_imports.append([node_ids[other] for other in imports.get(abs_path, ())])
+    return merged_nodes, merged_imports
+
+
+def write_merged(path, nodes, imports):
+    if output_format_of(path) == 'rtmb':
+        graph_format.write_graph(path, nodes, imports)
+    else:
+        relation_map = {}
+        for node, targets in zip(nodes, imports):
+            relation = {field: node[field] for field in graph_format.NODE_FIELDS if field != 'key'}
+            relation['imports'] = set(nodes[target]['key'] for target in targets)
+            relation_map[node['key']] = relation
+        graph_format.write_relation_map(path, relation_map)
+
+
+def merge(output_path, shard_paths):
+    timer_start = time.perf_counter()
+    nodes, imports = merge_shards(shard_paths)
+    write_merged(output_path, nodes, imports)
+    print(f'[Merge] {len(shard_paths)} shards, {len(nodes)} modules, '
+          f'{sum(len(targets) for targets in imports)} relations in {time.perf_counter() - timer_start:.3f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage=f'python {sys.argv[0]} {{analyze,merge}} ...')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    analyze_parser = commands.add_parser('analyze', help='analyze every top level directory as a shard, then merge')
+    analyze_parser.add_argument('project_dir')
+    analyze_parser.add_argument('output_file')
+    analyze_parser.add_argument('-j', '--jobs', type=int, default=1, help='number of shards analyzed at once')
+    analyze_parser.add_argument('--shard-dir', help='keep the shard files in this directory')
+    analyze_parser.add_argument('--engine', choices=IMPORT_ENGINES, default='regex', help='import extraction engine')
+
+    merge_parser = commands.add_parser('merge', help='merge shards written by project_analyzer.py --root')
+    merge_parser.add_argument('output_file')
+    merge_parser.add_argument('shard_files', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'analyze':
+        print(f'Get file from {args.project_dir}')
+        if args.shard_dir:
+            os.makedirs(args.shard_dir, exist_ok=True)
+            merge(args.output_file, analyze_shards(args.project_dir, args.shard_dir, args.jobs, args.engine))
+        else:
+            with tempfile.TemporaryDirectory() as shard_dir:
+                merge(args.output_file, analyze_shards(args.project_dir, shard_dir, args.jobs, args.engine))
+    else:
+        merge(args.output_file, args.shard_files)
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+
+from project_analyzer import GitIgnoreMatcher, ProjectAnalyzer
+
+
+class GitIgnoreMatcherTest(unittest.TestCase):
+    def test_negation_followed_by_re_ignore(self):
+        matcher = GitIgnoreMatcher(['*.log', '!keep.log', 'keep.log'])
+        self.assertTrue(matcher.match('keep.log', False))
+        self.assertTrue(matcher.match('other.log', False))
+
+    def test_negation_after_ignore(self):
+        matcher = GitIgnoreMatcher(['*.log', '!keep.log'])
+        self.assertFalse(matcher.match('keep.log', False))
+        self.assertFalse(matcher.match('logs/keep.log', False))
+        self.assertTrue(matcher.match('logs/other.log', False))
+
+    def test_ignore_after_negation(self):
+        # An earlier '!' rule does not win over a later rule
+        matcher = GitIgnoreMatcher(['!keep.log', '*.log'])
+        self.assertTrue(matcher.match('keep.log', False))
+
+    def test_double_star_between_directories(self):
+        matcher = GitIgnoreMatcher(['a/**/b'])
+        self.assertTrue(matcher.match('a/b', False))
+        self.assertTrue(matcher.match('a/x/b', False))
+        self.assertTrue(matcher.match('a/x/y/b', True))
+        self.assertIsNone(matcher.match('a/xb', False))
+        self.assertIsNone(matcher.match('c/a/b', False))
+
+    def test_leading_and_trailing_double_star(self):
+        matcher = GitIgnoreMatcher(['**/build', 'cache/**'])
+        self.assertTrue(matcher.match('build', True))
+        self.assertTrue(matcher.match('src/deep/build', True))
+        self.assertTrue(matcher.match('cache/data.bin', False))
+        self.assertTrue(matcher.match('cache/nested/data.bin', False))
+        self.assertIsNone(matcher.match('cache', True))
+
+    def test_star_stays_in_one_directory(self):
+        matcher = GitIgnoreMatcher(['docs/*.py'])
+        self.assertTrue(matcher.match('docs/conf.py', False))
+        self.assertIsNone(matcher.match('docs/api/conf.py', False))
+
+    def test_unanchored_pattern_matches_at_any_depth(self):
+        matcher = GitIgnoreMatcher(['*.pyc', '__pycache__/'])
+        self.assertTrue(matcher.match('a/b/c.pyc', False))
+        self.assertTrue(matcher.match('a/__pycache__', True))
+        self.assertIsNone(matcher.match('a/__pycache__', False))
+
+    def test_anchored_pattern_and_base_dir(self):
+        matcher = GitIgnoreMatcher(['/generated', '# comment', ''], 'pkg/')
+        self.assertTrue(matcher.match('pkg/generated', True))
+        self.assertIsNone(matcher.match('pkg/sub/generated', True))
+
+    def test_character_classes(self):
+        matcher = GitIgnoreMatcher(['file[0-9].py', 'tmp[!a].txt'])
+        self.assertTrue(matcher.match('file3.py', False))
+        self.assertIsNone(matcher.match('filex.py', False))
+        self.assertTrue(matcher.match('tmpb.txt', False))
+        self.assertIsNone(matcher.match('tmpa.txt', False))
+
+
+class ProjectGitIgnoreTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.project_path = self.temp_dir.name + '/'
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, rel_path, text=''):
+        path = os.path.join(self.project_path, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(text)
+
+    def analyzed_paths(self):
+        return sorted(module.abs_path for module in ProjectAnalyzer(self.project_path).modules.values())
+
+    def test_root_gitignore_rules_keep_file_order(self):
+        # Enough rules that a set would scramble their order under most hash seeds
+        rules = [f'unused_{index}_*.py' for index in range(20)]
+        self.write('.gitignore', '\n'.join(['gen_*.py'] + rules + ['!gen_keep.py']) + '\n')
+        for name in ('gen_drop.py', 'gen_keep.py', 'main.py'):
+            self.write(name)
+        self.assertEqual(self.analyzed_paths(), ['/gen_keep.py', '/main.py'])
+
+    def test_root_gitignore_re_ignore(self):
+        self.write('.gitignore', '!gen_keep.py\ngen_*.py\n')
+        self.write('gen_keep.py')
+        self.write('main.py')
+        self.assertEqual(self.analyzed_paths(), ['/main.py'])
+
+    def test_nested_gitignore_and_git_directory(self):
+        self.write('.git/hooks/hook.py')
+        self.write('pkg/.gitignore', 'build/\n')
+        self.write('pkg/build/out.py')
+        self.write('pkg/mod.py')
+        self.assertEqual(self.analyzed_paths(), ['/pkg/mod.py'])
+
+
+if __name__ == '__main__':
+    unittest.main()
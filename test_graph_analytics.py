@@ -0,0 +1,57 @@
+import unittest
+
+import numpy
+
+from graph_analytics import ImportGraph, csr_from_imports, reachable_mask, strongly_connected_components
+
+ABS_PATHS = ['/a.py', '/b.py', '/c.py', 'external://os', '/d.py', '/e.py']
+MOD_PATHS = ['a', 'b', 'c', 'external://os', 'd', 'e']
+# b and c import each other, d imports itself, and e stands alone
+IMPORTS = [[1], [2], [1, 3], [], [4, 0], []]
+
+
+class ImportGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.graph = ImportGraph(ABS_PATHS, MOD_PATHS, *csr_from_imports(IMPORTS))
+
+    def test_components(self):
+        components = self.graph.components
+        self.assertEqual(components[1], components[2])
+        self.assertEqual(len(set(components.tolist())), 5)
+        self.assertEqual([self.graph.component_members(component_id).tolist()
+                          for component_id in self.graph.cyclic_components()], [[1, 2], [4]])
+        self.assertEqual(self.graph.shortest_cycle(1), [1, 2, 1])
+        self.assertEqual(self.graph.shortest_cycle(4), [4, 4])
+        self.assertEqual(self.graph.shortest_cycle(0), [])
+
+    def test_layers(self):
+        self.assertEqual(self.graph.layers.tolist(), [2, 1, 1, 0, 3, 0])
+        self.assertEqual([members.tolist() for members in self.graph.layer_members()], [[3, 5], [1, 2], [0], [4]])
+
+    def test_impact(self):
+        self.assertEqual(self.graph.impact(['/c.py']).tolist(), [1, 2, 0, 4])
+        self.assertEqual(self.graph.impact(['os']).tolist(), [3, 1, 2, 0, 4])
+        self.assertEqual(self.graph.transitive_imports(['a']).tolist(), [0, 1, 2, 3])
+        self.assertEqual(self.graph.transitive_importers([5]).tolist(), [5])
+
+    def test_summary(self):
+        self.assertEqual(self.graph.summary(), {'modules': 6, 'relations': 6, 'components': 5,
+                                                'cyclic_components': 2, 'modules_in_cycles': 3,
+                                                'largest_component': 2, 'layers': 4})
+
+    def test_components_match_reachability(self):
+        # Two modules share a component exactly when each reaches the other, and components come in
+        # dependency order
+        random_state = numpy.random.RandomState(0)
+        imports = [random_state.choice(60, random_state.randint(0, 3), replace=False).tolist() for _ in range(60)]
+        offsets, targets = csr_from_imports(imports)
+        components, _ = strongly_connected_components(offsets, targets)
+        reaches = numpy.array([reachable_mask(offsets, targets, 60, [node_id]) for node_id in range(60)])
+        self.assertTrue(numpy.array_equal(components[:, None] == components[None, :], reaches & reaches.T))
+        for node_id, node_imports in enumerate(imports):
+            for other in node_imports:
+                self.assertLessEqual(components[other], components[node_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
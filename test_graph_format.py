@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+import graph_format
+from project_analyzer import ProjectAnalyzer, StreamingProjectAnalyzer
+
+
+class GraphFormatTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.project_path = os.path.join(self.temp_dir.name, 'project') + '/'
+        self.write('app/main.py', 'import os\nfrom app import util\nfrom lib.core import run\n')
+        self.write('app/util.py', 'import json\n')
+        self.write('app/__init__.py')
+        self.write('lib/core.py', 'from app.util import helper\n')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, rel_path, text=''):
+        path = os.path.join(self.project_path, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(text)
+
+    def output_path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def expected_relation_map(self):
+        analyzer = ProjectAnalyzer(self.project_path)
+        relation_map = {}
+        for relation in analyzer.output_module.values():
+            relation = dict(relation)
+            relation['imports'] = set(analyzer.output_module[key]['abs_path'] for key in relation['imports'])
+            relation_map[relation['abs_path']] = relation
+        return relation_map
+
+    def test_jsonl_to_rtmb_to_rtm_round_trip(self):
+        jsonl_path = self.output_path('relations.jsonl')
+        StreamingProjectAnalyzer(self.project_path, jsonl_path)
+        relation_map = graph_format.relation_map_from_jsonl(jsonl_path)
+        self.assertEqual(relation_map, self.expected_relation_map())
+
+        graph_format.convert(jsonl_path, self.output_path('relations.rtmb'))
+        graph_format.convert(self.output_path('relations.rtmb'), self.output_path('relations.rtm'))
+        self.assertEqual(graph_format.read_relation_map(self.output_path('relations.rtm')), relation_map)
+
+    def test_convert_writes_jsonl(self):
+        graph_format.convert(self.write_rtmb(), self.output_path('copy.jsonl'))
+        self.assertEqual(graph_format.read_any_relation_map(self.output_path('copy.jsonl')),
+                         self.expected_relation_map())
+
+    def test_rtm_to_rtmb_to_rtm_round_trip(self):
+        rtm_path = self.output_path('relations.rtm')
+        analyzer = ProjectAnalyzer(self.project_path)
+        analyzer.write_output(rtm_path, 'rtm')
+        graph_format.convert(rtm_path, self.output_path('relations.rtmb'))
+        graph_format.convert(self.output_path('relations.rtmb'), self.output_path('copy.rtm'))
+        self.assertEqual(graph_format.read_relation_map(self.output_path('copy.rtm')), analyzer.output_module)
+
+    def test_graph_file_reads_back_nodes_and_imports(self):
+        nodes, imports = ProjectAnalyzer(self.project_path).relation_graph()
+        with graph_format.GraphFile(self.write_rtmb()) as graph_file:
+            self.assertEqual(graph_file.node_count, len(nodes))
+            for node_id, node in enumerate(nodes):
+                self.assertEqual(graph_file.node(node_id), node)
+                self.assertEqual(sorted(graph_file.imports(node_id)), sorted(imports[node_id]))
+
+    def write_rtmb(self):
+        rtmb_path = self.output_path('relations.rtmb')
+        ProjectAnalyzer(self.project_path).write_output(rtmb_path, 'rtmb')
+        return rtmb_path
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy
+
+import layout_engine
+
+
+def sphere_positions(count, seed=0):
+    positions = numpy.random.RandomState(seed).normal(size=(count, 3))
+    return positions / numpy.linalg.norm(positions, axis=1)[:, None]
+
+
+class AttractionTest(unittest.TestCase):
+    def setUp(self):
+        self.positions = sphere_positions(200)
+        self.velocities = numpy.zeros_like(self.positions)
+        self.groups = numpy.arange(200) % 4
+        self.externals = numpy.zeros(200, dtype=bool)
+        self.edges = [(index, (index * 7 + 3) % 200) for index in range(200)]
+
+    def layouts(self, **options):
+        return (layout_engine.ForceLayout(self.positions, self.velocities, self.groups, self.externals, self.edges,
+                                          **options),
+                layout_engine.BarnesHutLayout(self.positions, self.velocities, self.groups, self.externals,
+                                              self.edges, theta=0.5, **options))
+
+    def test_attraction_is_off_by_default(self):
+        for default_layout, off_layout in zip(self.layouts(), self.layouts(group_attract=0.0, edge_attract=0.0)):
+            numpy.testing.assert_array_equal(default_layout.pair_forces(0.25), off_layout.pair_forces(0.25))
+
+    def test_edge_attract_pulls_imports_closer(self):
+        for off_layout, on_layout in zip(self.layouts(), self.layouts(edge_attract=0.5)):
+            change = on_layout.pair_forces(0.25) - off_layout.pair_forces(0.25)
+            self.assertGreater(numpy.abs(change).max(), 0)
+            # Along every edge the extra force points from the importer to its import
+            edges = numpy.array(self.edges)
+            vectors = self.positions[edges[:, 1]] - self.positions[edges[:, 0]]
+            self.assertGreater(numpy.einsum('ij,ij->', change[edges[:, 0]], vectors), 0)
+
+    def test_group_attract_changes_forces(self):
+        for off_layout, on_layout in zip(self.layouts(), self.layouts(group_attract=0.5)):
+            self.assertGreater(numpy.abs(on_layout.pair_forces(0.25) - off_layout.pair_forces(0.25)).max(), 0)
+
+    def test_exact_barnes_hut_matches_all_pairs_with_edges(self):
+        exact = layout_engine.ForceLayout(self.positions, self.velocities, self.groups, self.externals, self.edges,
+                                          edge_attract=0.5)
+        octree = layout_engine.BarnesHutLayout(self.positions, self.velocities, self.groups, self.externals,
+                                               self.edges, theta=0, edge_attract=0.5)
+        numpy.testing.assert_allclose(octree.pair_forces(0.25), exact.pair_forces(0.25), atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
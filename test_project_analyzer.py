@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+
+from project_analyzer import ProjectAnalyzer
+
+
+class ProjectTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.project_path = self.temp_dir.name + '/'
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, rel_path, text=''):
+        path = os.path.join(self.project_path, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    @staticmethod
+    def relation_map(analyzer):
+        return {analyzer.modules[module_id].abs_path:
+                set(analyzer.modules[to_id].abs_path for to_id in analyzer.importees(module_id))
+                for module_id in analyzer.modules}
+
+
+class UpdateSourceFilesTest(ProjectTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write('app/main.py', 'from app.util import helper\nfrom .config import value\nfrom lib import core\n')
+        self.write('app/util.py', 'import json\n')
+        self.write('other.py', 'import json\n')
+        self.analyzer = ProjectAnalyzer(self.project_path)
+
+    def assert_matches_fresh_analysis(self):
+        self.assertEqual(self.relation_map(self.analyzer), self.relation_map(ProjectAnalyzer(self.project_path)))
+
+    def test_added_modules_take_over_imports(self):
+        self.assertIn('external://lib.core', self.relation_map(self.analyzer)['/app/main.py'])
+        added_files = [self.write('app/config.py'), self.write('lib/__init__.py')]
+        removed_paths, added_ids, changed_ids = self.analyzer.update_source_files(added_files, [], [])
+        self.assert_matches_fresh_analysis()
+        self.assertEqual(removed_paths, ['external://lib.core'])
+        self.assertEqual(len(added_ids), 2)
+        main_id = self.analyzer.module_ids_by_path[self.project_path + 'app/main.py']
+        other_id = self.analyzer.module_ids_by_path[self.project_path + 'other.py']
+        self.assertIn(main_id, changed_ids)
+        self.assertNotIn(other_id, changed_ids)
+
+    def test_removed_module_becomes_external(self):
+        util_path = self.project_path + 'app/util.py'
+        os.remove(util_path)
+        removed_paths, _, changed_ids = self.analyzer.update_source_files([], [], [util_path])
+        self.assert_matches_fresh_analysis()
+        self.assertIn('/app/util.py', removed_paths)
+        self.assertIn('external://app.util.helper', self.relation_map(self.analyzer)['/app/main.py'])
+        self.assertIn(self.analyzer.module_ids_by_path[self.project_path + 'app/main.py'], changed_ids)
+
+    def test_modified_module(self):
+        self.write('other.py', 'from app import util\n')
+        self.analyzer.update_source_files([], [self.project_path + 'other.py'], [])
+        self.assert_matches_fresh_analysis()
+
+
+class AnalysisCacheTest(ProjectTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_path = os.path.join(self.temp_dir.name, 'analysis.cache')
+        self.main_path = self.write('main.py', 'import json\nfrom lib import aa\n')
+        self.write('lib/__init__.py')
+
+    def analyze(self):
+        analyzer = ProjectAnalyzer(self.project_path, cache_path=self.cache_path)
+        return analyzer, self.relation_map(analyzer)['/main.py']
+
+    def test_unchanged_files_hit(self):
+        analyzer, first_imports = self.analyze()
+        self.assertEqual((analyzer.cache.hits, analyzer.cache.misses), (0, 2))
+        analyzer, imports = self.analyze()
+        self.assertEqual((analyzer.cache.hits, analyzer.cache.misses), (2, 0))
+        self.assertEqual(imports, first_imports)
+
+    def test_touched_file_with_same_content_hits(self):
+        self.analyze()
+        stat = os.stat(self.main_path)
+        os.utime(self.main_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        analyzer, _ = self.analyze()
+        self.assertEqual((analyzer.cache.hits, analyzer.cache.misses), (2, 0))
+
+    def test_changed_content_misses(self):
+        self.analyze()
+        stat = os.stat(self.main_path)
+        # Same size as before, so the content hash tells the change apart
+        with open(self.main_path, 'w') as file:
+            file.write('import json\nfrom abc import aa\n')
+        os.utime(self.main_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        analyzer, imports = self.analyze()
+        self.assertEqual((analyzer.cache.hits, analyzer.cache.misses), (1, 1))
+        self.assertEqual(imports, {'external://abc.aa'})
+
+    def test_engine_change_misses(self):
+        self.analyze()
+        analyzer = ProjectAnalyzer(self.project_path, cache_path=self.cache_path, engine='ast')
+        self.assertEqual((analyzer.cache.hits, analyzer.cache.misses), (0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import graph_format
+import shard_merger
+from project_analyzer import ProjectAnalyzer
+
+
+class ShardMergerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.project_path = os.path.join(self.temp_dir.name, 'project') + '/'
+        self.shard_dir = os.path.join(self.temp_dir.name, 'shards')
+        os.makedirs(self.shard_dir)
+        self.write('.gitignore', 'build/\n')
+        self.write('app/__init__.py')
+        self.write('app/main.py', 'from app.util import helper\nfrom lib.core import run\nfrom .views import page\n')
+        self.write('app/util.py', 'from os import path\nfrom lib import core\n')
+        self.write('app/views.py', 'from ..lib.core import run\nfrom ..absent import name\n')
+        self.write('lib/__init__.py', 'from app import util\n')
+        self.write('lib/core.py', 'from os import path\nfrom missing import thing\n')
+        self.write('build/out.py', 'from app import main\n')
+        self.write('setup.py', 'from app.main import start\nfrom lib import core\n')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, rel_path, text=''):
+        path = os.path.join(self.project_path, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(text)
+
+    def analyze_shards(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return shard_merger.analyze_shards(self.project_path, self.shard_dir)
+
+    def test_list_shards(self):
+        self.assertEqual(shard_merger.list_shards(self.project_path),
+                         [('app', ['app']), ('lib', ['lib']), ('__top__', ['setup.py'])])
+
+    def test_merged_shards_equal_full_run(self):
+        merged_nodes, merged_imports = shard_merger.merge_shards(self.analyze_shards())
+        nodes, imports = ProjectAnalyzer(self.project_path).relation_graph()
+        self.assertEqual(merged_nodes, nodes)
+        self.assertEqual([sorted(targets) for targets in merged_imports],
+                         [sorted(targets) for targets in imports])
+
+    def test_merged_rtm_equals_full_run(self):
+        merged_path = os.path.join(self.temp_dir.name, 'merged.rtm')
+        with contextlib.redirect_stdout(io.StringIO()):
+            shard_merger.merge(merged_path, self.analyze_shards())
+        full_path = os.path.join(self.temp_dir.name, 'full.rtmb')
+        ProjectAnalyzer(self.project_path).write_output(full_path, 'rtmb')
+        self.assertEqual(graph_format.read_any_relation_map(merged_path), graph_format.read_any_relation_map(full_path))
+
+
+if __name__ == '__main__':
+    unittest.main()